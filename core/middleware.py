@@ -0,0 +1,152 @@
+import cProfile
+import logging
+import random
+import re
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+request_logger = logging.getLogger("core.requests")
+sql_logger = logging.getLogger("core.sql")
+
+# Сколько символов SQL писать в лог медленного запроса.
+SQL_LOG_LENGTH = 2000
+
+
+class QueryTracker:
+    """``execute_wrapper``: считает запросы к БД, их время и собирает медленные."""
+
+    def __init__(self, slow_ms):
+        self.slow = slow_ms / 1000
+        self.count = 0
+        self.seconds = 0.0
+        self.slow_queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if elapsed >= self.slow:
+                self.slow_queries.append((elapsed, context["connection"].alias, sql))
+
+
+class RequestTimingMiddleware:
+    """Замеряет время запроса, число и время SQL-запросов.
+
+    Запросы дольше ``REQUEST_TIMING_SLOW_MS`` и отдельные SQL-запросы
+    дольше ``REQUEST_TIMING_SLOW_SQL_MS`` пишутся в логи ``core.requests``
+    и ``core.sql`` с именем представления и id пользователя.
+
+    С ``REQUEST_TIMING_PROFILE_RATE`` > 0 такая доля запросов выполняется
+    под cProfile, и профили медленных из них сохраняются в
+    ``REQUEST_TIMING_PROFILE_DIR`` (смотреть через ``python -m pstats``).
+
+    Время потоковых ответов (выгрузки) учитывается до начала передачи тела.
+
+    Middleware работает и в синхронной, и в асинхронной цепочке: под ASGI
+    async-представления не переводятся в поток. В асинхронном режиме время
+    ожидания включает ``await`` в представлении, а cProfile не используется —
+    он профилирует поток, а не корутину.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tracker = QueryTracker(settings.REQUEST_TIMING_SLOW_SQL_MS)
+        profiler = self.profiler()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.track_queries(stack, tracker)
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # В этом потоке уже работает другой профилировщик.
+                    profiler = None
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        return self.finish(request, response, time.perf_counter() - started, tracker, profiler)
+
+    async def __acall__(self, request):
+        tracker = QueryTracker(settings.REQUEST_TIMING_SLOW_SQL_MS)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.track_queries(stack, tracker)
+            response = await self.get_response(request)
+        return self.finish(request, response, time.perf_counter() - started, tracker)
+
+    @staticmethod
+    def track_queries(stack, tracker):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(tracker))
+
+    def finish(self, request, response, elapsed, tracker, profiler=None):
+        slow = elapsed * 1000 >= settings.REQUEST_TIMING_SLOW_MS
+        if slow or tracker.slow_queries:
+            self.log(request, response, elapsed, tracker, slow)
+            if slow and profiler is not None:
+                self.save_profile(profiler, request, elapsed)
+        if settings.DEBUG:
+            response["Server-Timing"] = (
+                f'db;dur={tracker.seconds * 1000:.1f};desc="{tracker.count} queries", '
+                f"total;dur={elapsed * 1000:.1f}"
+            )
+        return response
+
+    @staticmethod
+    def profiler():
+        rate = settings.REQUEST_TIMING_PROFILE_RATE
+        if rate <= 0 or random.random() >= rate:
+            return None
+        return cProfile.Profile()
+
+    @staticmethod
+    def view_name(request):
+        match = getattr(request, "resolver_match", None)
+        return match.view_name if match else request.path
+
+    @staticmethod
+    def owner_id(request):
+        user = getattr(request, "user", None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def log(self, request, response, elapsed, tracker, slow):
+        view, owner = self.view_name(request), self.owner_id(request)
+        if slow:
+            request_logger.warning(
+                "%s %s view=%s owner=%s status=%s %.1f мс, SQL: %d запросов за %.1f мс",
+                request.method, request.path, view, owner, response.status_code,
+                elapsed * 1000, tracker.count, tracker.seconds * 1000,
+            )
+        for seconds, alias, sql in tracker.slow_queries:
+            sql_logger.warning(
+                "view=%s owner=%s db=%s %.1f мс: %s", view, owner, alias, seconds * 1000, sql[:SQL_LOG_LENGTH],
+            )
+
+    def save_profile(self, profiler, request, elapsed):
+        directory = Path(settings.REQUEST_TIMING_PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        view = re.sub(r"[^\w.-]+", "_", self.view_name(request)).strip("_") or "request"
+        stamp = timezone.now().strftime("%Y%m%dT%H%M%S%f")
+        path = directory / f"{stamp}-{view}-{elapsed * 1000:.0f}ms.prof"
+        profiler.dump_stats(path)
+        request_logger.warning("Профиль %s %s сохранён в %s", request.method, request.path, path)
@@ -27,6 +27,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -92,6 +93,49 @@ EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = env.bool('EMAIL_USE_TLS', default=True)
 DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='noreply@example.com')
 
+MAILING_BATCH_SIZE = env.int('MAILING_BATCH_SIZE', default=100)
+MAILING_FLUSH_SIZE = env.int('MAILING_FLUSH_SIZE', default=500)
+MAILING_FLUSH_INTERVAL = env.float('MAILING_FLUSH_INTERVAL', default=5.0)
+MAILING_ASYNC_CONCURRENCY = env.int('MAILING_ASYNC_CONCURRENCY', default=100)
+# {"gmail.com": {"rate": 10, "burst": 20, "concurrency": 2}}: писем в секунду и SMTP-сессий на домен
+MAILING_DOMAIN_LIMITS = env.json('MAILING_DOMAIN_LIMITS', default={})
+MAILING_DEFAULT_DOMAIN_LIMIT = env.json('MAILING_DEFAULT_DOMAIN_LIMIT', default={})
+MAILING_RETRY_MAX_ATTEMPTS = env.int('MAILING_RETRY_MAX_ATTEMPTS', default=5)
+MAILING_RETRY_BASE_DELAY = env.int('MAILING_RETRY_BASE_DELAY', default=60)
+MAILING_RETRY_MAX_DELAY = env.int('MAILING_RETRY_MAX_DELAY', default=6 * 60 * 60)
+MAILING_RETRY_LEASE = env.int('MAILING_RETRY_LEASE', default=10 * 60)
+MAILING_JOB_LEASE = env.int('MAILING_JOB_LEASE', default=10 * 60)
+MAILING_EXPORT_CHUNK_SIZE = env.int('MAILING_EXPORT_CHUNK_SIZE', default=2000)
+MAILING_IMPORT_CHUNK_SIZE = env.int('MAILING_IMPORT_CHUNK_SIZE', default=1000)
+MAILING_LIST_CACHE_TIMEOUT = env.int('MAILING_LIST_CACHE_TIMEOUT', default=15 * 60)
+MAILING_ATTEMPT_RETENTION_DAYS = env.int('MAILING_ATTEMPT_RETENTION_DAYS', default=365)
+MAILING_ARCHIVE_BATCH_SIZE = env.int('MAILING_ARCHIVE_BATCH_SIZE', default=5000)
+# Складывать метрики отправки всех воркеров в Redis (нужен кэш django_redis)
+MAILING_METRICS_SHARED = env.bool('MAILING_METRICS_SHARED', default=False)
+MAILING_METRICS_MAX_DOMAINS = env.int('MAILING_METRICS_MAX_DOMAINS', default=50)
+MAILING_METRICS_TOKEN = env('MAILING_METRICS_TOKEN', default='')
+
+# Пороги логов core.requests и core.sql, мс; доля запросов под cProfile
+REQUEST_TIMING_SLOW_MS = env.int('REQUEST_TIMING_SLOW_MS', default=500)
+REQUEST_TIMING_SLOW_SQL_MS = env.int('REQUEST_TIMING_SLOW_SQL_MS', default=100)
+REQUEST_TIMING_PROFILE_RATE = env.float('REQUEST_TIMING_PROFILE_RATE', default=0.0)
+REQUEST_TIMING_PROFILE_DIR = env('REQUEST_TIMING_PROFILE_DIR', default='') or str(BASE_DIR / 'profiles')
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "timing": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+    },
+    "handlers": {
+        "timing": {"class": "logging.StreamHandler", "formatter": "timing"},
+    },
+    "loggers": {
+        "core.requests": {"handlers": ["timing"], "level": "WARNING", "propagate": False},
+        "core.sql": {"handlers": ["timing"], "level": "WARNING", "propagate": False},
+    },
+}
+
 AUTH_USER_MODEL = "users.CustomUser"
 
 REST_FRAMEWORK = {
@@ -5,8 +5,9 @@ from users.views import HomeView, CustomLoginView, CustomLogoutView, CustomRegis
 from mailings.views import (
     MessageListView, MessageDetailView, MessageCreateView, MessageUpdateView, MessageDeleteView,
     RecipientListView, RecipientDetailView, RecipientCreateView, RecipientUpdateView, RecipientDeleteView,
+    RecipientSegmentListView, RecipientSegmentCreateView, RecipientSegmentUpdateView, RecipientSegmentDeleteView,
     MailingListView, MailingDetailView, MailingCreateView, MailingUpdateView, MailingDeleteView,
-    MailAttemptListView
+    MailAttemptListView, metrics_view
 )
 
 urlpatterns = [
@@ -15,6 +16,7 @@ urlpatterns = [
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("api/", include("mailings.urls")),
+    path("metrics", metrics_view, name="metrics"),
 
     # Web paths
     path('', HomeView.as_view(), name='home'),
@@ -37,6 +39,12 @@ urlpatterns = [
     path('recipients/<int:pk>/update/', RecipientUpdateView.as_view(), name='recipient_update'),
     path('recipients/<int:pk>/delete/', RecipientDeleteView.as_view(), name='recipient_delete'),
 
+    # Segments
+    path('segments/', RecipientSegmentListView.as_view(), name='segments_list'),
+    path('segments/create/', RecipientSegmentCreateView.as_view(), name='segment_create'),
+    path('segments/<int:pk>/update/', RecipientSegmentUpdateView.as_view(), name='segment_update'),
+    path('segments/<int:pk>/delete/', RecipientSegmentDeleteView.as_view(), name='segment_delete'),
+
     # Mailings
     path('mailings/', MailingListView.as_view(), name='mailings_list'),
     path('mailings/<int:pk>/', MailingDetailView.as_view(), name='mailing_detail'),
@@ -0,0 +1,79 @@
+import time
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db import transaction
+
+MANAGERS_GROUP = "Менеджеры"
+
+GENERATION_KEY = "mailings:auth:generation"
+SNAPSHOT_TIMEOUT = 60 * 60
+
+
+@dataclass(frozen=True)
+class AuthSnapshot:
+    """Роль и права пользователя, которые иначе читались бы из БД в каждом запросе."""
+    manager: bool
+    perms: frozenset
+
+
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        value = cache.get(GENERATION_KEY) or 0
+    return value
+
+
+def snapshot_key(user_id):
+    return f"mailings:auth:{generation()}:{user_id}"
+
+
+def auth_snapshot(user):
+    """Снимок прав ``user`` из кэша; в пределах запроса хранится на самом объекте."""
+    snapshot = getattr(user, "_auth_snapshot", None)
+    if snapshot is not None:
+        return snapshot
+    if not user.is_authenticated:
+        return AuthSnapshot(manager=False, perms=frozenset())
+    key = snapshot_key(user.pk)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = AuthSnapshot(
+            manager=user.groups.filter(name=MANAGERS_GROUP).exists(),
+            perms=frozenset(user.get_all_permissions()),
+        )
+        cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+    user._auth_snapshot = snapshot
+    return snapshot
+
+
+def is_manager(user):
+    return auth_snapshot(user).manager
+
+
+def sees_all_objects(user):
+    """Менеджеры и персонал видят объекты всех пользователей."""
+    return user.is_staff or is_manager(user)
+
+
+def has_perms(user, perms):
+    if user.is_active and user.is_superuser:
+        return True
+    return user.is_active and set(perms) <= auth_snapshot(user).perms
+
+
+def invalidate_user(*user_ids):
+    def invalidate():
+        cache.delete_many([snapshot_key(user_id) for user_id in user_ids])
+    transaction.on_commit(invalidate)
+
+
+def invalidate_all():
+    """Сбрасывает снимки всех пользователей, например после изменения прав группы."""
+    def invalidate():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+    transaction.on_commit(invalidate)
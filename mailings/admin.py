@@ -1,22 +1,67 @@
 from django.contrib import admin
-from .models import Recipient, Message, Mailing, MailAttempt
+from .models import (
+    Recipient, RecipientSegment, Message, Mailing, MailingStats, MailAttempt, MailAttemptRollup, SendJob, MailRetry,
+    FailureReason,
+)
 
 @admin.register(Recipient)
 class RecipientAdmin(admin.ModelAdmin):
     list_display = ("email", "full_name", "owner", "created_at")
+    list_select_related = ("owner",)
     search_fields = ("email", "full_name")
 
+@admin.register(RecipientSegment)
+class RecipientSegmentAdmin(admin.ModelAdmin):
+    list_display = ("name", "comment_contains", "domain", "owner", "created_at")
+    list_select_related = ("owner",)
+    search_fields = ("name",)
+
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ("subject", "owner", "created_at")
+    list_select_related = ("owner",)
     search_fields = ("subject",)
 
 @admin.register(Mailing)
 class MailingAdmin(admin.ModelAdmin):
-    list_display = ("id", "status", "start_at", "end_at", "owner")
+    list_display = ("id", "status", "start_at", "end_at", "segment", "owner", "archived_at")
+    list_select_related = ("segment", "owner")
     list_filter = ("status", "start_at", "end_at")
+    autocomplete_fields = ("recipients",)
+
+@admin.register(MailingStats)
+class MailingStatsAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "sent", "success", "failed", "recipients_reached", "last_attempt_at")
+    list_select_related = ("mailing",)
 
 @admin.register(MailAttempt)
 class MailAttemptAdmin(admin.ModelAdmin):
-    list_display = ("id", "mailing", "recipient", "status", "attempted_at")
+    list_display = ("id", "mailing", "recipient", "status", "smtp_code", "attempted_at")
+    list_select_related = ("mailing", "recipient")
     list_filter = ("status", "attempted_at")
+    raw_id_fields = ("mailing", "recipient", "owner", "failure")
+
+@admin.register(FailureReason)
+class FailureReasonAdmin(admin.ModelAdmin):
+    list_display = ("id", "text")
+    search_fields = ("text",)
+
+@admin.register(MailAttemptRollup)
+class MailAttemptRollupAdmin(admin.ModelAdmin):
+    list_display = ("mailing", "day", "status", "count", "last_attempt_at")
+    list_select_related = ("mailing",)
+    list_filter = ("status", "day")
+    raw_id_fields = ("mailing", "owner")
+
+@admin.register(SendJob)
+class SendJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "mailing", "status", "processed", "succeeded", "failed", "created_at")
+    list_select_related = ("mailing",)
+    list_filter = ("status", "created_at")
+
+@admin.register(MailRetry)
+class MailRetryAdmin(admin.ModelAdmin):
+    list_display = ("id", "mailing", "recipient", "attempts", "next_attempt_at")
+    list_select_related = ("mailing", "recipient")
+    raw_id_fields = ("mailing", "recipient")
+    list_filter = ("next_attempt_at",)
@@ -4,3 +4,7 @@ class MailingsConfig(AppConfig):
     default_auto_field = "django.db.models.AutoField"
     name = "mailings"
     verbose_name = "Сервис рассылок"
+
+    def ready(self):
+        from .signals import connect_signals
+        connect_signals()
@@ -0,0 +1,130 @@
+"""Архивация попыток отправки старше срока хранения (команда ``archive_attempts``).
+
+Попытки сворачиваются в ``MailAttemptRollup`` — по строке на рассылку,
+день и статус, — при желании выгружаются в NDJSON с gzip и удаляются.
+Каждая пачка обрабатывается в своей короткой транзакции, поэтому
+блокировки не держатся дольше одной пачки.
+
+Архивируются только попытки завершённых рассылок, которые закончились
+до границы хранения: отправка ищет ещё не доставленных получателей по
+таблице попыток, и у активной рассылки удалённые попытки привели бы к
+повторным письмам. По той же причине рассылка с заархивированными
+попытками получает отметку ``archived_at`` и больше не отправляется.
+"""
+import gzip
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .caching import bump_versions
+from .exports import EXPORT_FIELDS, export_row, ndjson_lines
+from .models import MailAttempt, MailAttemptRollup, Mailing
+
+# Поля, нужные для свёртки, сверх полей выгрузки.
+ROLLUP_FIELDS = ("mailing_id", "owner_id", "status", "attempted_at")
+
+
+def retention_cutoff(days=None, now=None):
+    """Начало дня (в текущем часовом поясе), ``days`` дней назад."""
+    days = settings.MAILING_ATTEMPT_RETENTION_DAYS if days is None else days
+    today = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days)
+
+
+def archivable_attempts(cutoff):
+    return MailAttempt.objects.filter(
+        attempted_at__lt=cutoff, mailing__status="FINISHED", mailing__end_at__lt=cutoff,
+    )
+
+
+def rollup(rows):
+    """``{(рассылка, владелец, день, статус): [число, последняя попытка]}`` по строкам пачки."""
+    totals = {}
+    for mailing_id, owner_id, status, attempted_at in rows:
+        key = (mailing_id, owner_id, timezone.localdate(attempted_at), status)
+        total = totals.setdefault(key, [0, attempted_at])
+        total[0] += 1
+        total[1] = max(total[1], attempted_at)
+    return totals
+
+
+def save_rollups(totals):
+    """Прибавляет итоги пачки к сохранённым: день может попасть в несколько пачек."""
+    for (mailing_id, owner_id, day, status), (count, last_attempt_at) in totals.items():
+        rollups = MailAttemptRollup.objects.filter(mailing_id=mailing_id, day=day, status=status)
+        updated = rollups.update(
+            count=F("count") + count, last_attempt_at=Greatest(F("last_attempt_at"), last_attempt_at),
+        )
+        if not updated:
+            MailAttemptRollup.objects.create(
+                mailing_id=mailing_id, owner_id=owner_id, day=day, status=status,
+                count=count, last_attempt_at=last_attempt_at,
+            )
+
+
+class AttemptArchiver:
+    """Сворачивает, выгружает и удаляет попытки пачками по ``batch_size``.
+
+    С ``dump_dir`` удаляемые строки пишутся в ``attempts-<граница>-<время>.ndjson.gz``
+    до фиксации транзакции: при сбое файл может содержать строки, которые
+    останутся в БД и попадут в выгрузку снова, но ни одна не потеряется.
+    ``pause`` — пауза между пачками, чтобы не мешать отправке.
+    """
+
+    def __init__(self, cutoff, batch_size=None, dump_dir=None, pause=0.0, dry_run=False):
+        self.cutoff = cutoff
+        self.batch_size = batch_size or settings.MAILING_ARCHIVE_BATCH_SIZE
+        self.dump_dir = Path(dump_dir) if dump_dir else None
+        self.pause = pause
+        self.dry_run = dry_run
+        self.archived = 0
+        self.rollups = 0
+        self.dump_path = None
+
+    def run(self):
+        attempts = archivable_attempts(self.cutoff)
+        if self.dry_run:
+            self.archived = attempts.count()
+            return self
+        dump = self.open_dump()
+        try:
+            while ids := list(attempts.order_by("id").values_list("id", flat=True)[:self.batch_size]):
+                self.archive_batch(ids, dump)
+                if self.pause:
+                    time.sleep(self.pause)
+        finally:
+            if dump is not None:
+                dump.close()
+        return self
+
+    def open_dump(self):
+        if self.dump_dir is None:
+            return None
+        self.dump_dir.mkdir(parents=True, exist_ok=True)
+        stamp = timezone.now().strftime("%Y%m%dT%H%M%S")
+        self.dump_path = self.dump_dir / f"attempts-{self.cutoff.date().isoformat()}-{stamp}.ndjson.gz"
+        return gzip.open(self.dump_path, "wt", encoding="utf-8")
+
+    def archive_batch(self, ids, dump):
+        with transaction.atomic():
+            rows = list(
+                MailAttempt.objects.filter(id__in=ids).order_by("id").values_list(*EXPORT_FIELDS, *ROLLUP_FIELDS)
+            )
+            totals = rollup(row[len(EXPORT_FIELDS):] for row in rows)
+            save_rollups(totals)
+            if dump is not None:
+                dump.writelines(ndjson_lines(export_row(row[:len(EXPORT_FIELDS)]) for row in rows))
+                dump.flush()
+            MailAttempt.objects.filter(id__in=ids).delete()
+            Mailing.objects.filter(
+                pk__in={mailing_id for mailing_id, _, _, _ in totals}, archived_at__isnull=True,
+            ).update(archived_at=timezone.now())
+            bump_versions((MailAttempt, Mailing), {owner_id for _, owner_id, _, _ in totals})
+        self.archived += len(rows)
+        self.rollups += len(totals)
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from contextlib import suppress
+
+import aiosmtplib
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.mail.message import sanitize_address
+
+from .metrics import report
+from .models import Mailing
+from .services import INTERLEAVE_BATCHES, MailingDispatcher
+from .throttling import POLL_INTERVAL, DomainQueue
+
+
+def default_smtp_options():
+    """Параметры aiosmtplib из настроек почты Django."""
+    return {
+        "hostname": settings.EMAIL_HOST,
+        "port": int(settings.EMAIL_PORT),
+        "username": settings.EMAIL_HOST_USER or None,
+        "password": settings.EMAIL_HOST_PASSWORD or None,
+        "start_tls": settings.EMAIL_USE_TLS,
+        "use_tls": getattr(settings, "EMAIL_USE_SSL", False),
+        "timeout": settings.EMAIL_TIMEOUT or 60,
+    }
+
+
+class AsyncMailingDispatcher(MailingDispatcher):
+    """Отправляет рассылку из одного event loop.
+
+    ``concurrency`` SMTP-сессий разбирают общую очередь писем, так что
+    сотни SMTP-диалогов идут одновременно без потока на соединение.
+    Рассылка должна быть загружена вместе с ``message`` и ``owner``.
+    """
+
+    def __init__(self, mailing, concurrency=None, smtp_options=None, **kwargs):
+        super().__init__(mailing, **kwargs)
+        self.concurrency = concurrency or settings.MAILING_ASYNC_CONCURRENCY
+        self.smtp_options = smtp_options or default_smtp_options()
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        sessions = [asyncio.create_task(self.session(queue)) for _ in range(self.concurrency)]
+        producer = asyncio.create_task(self.produce(queue, len(sessions)))
+        tasks = [producer, *sessions]
+        try:
+            # Очередь ограничена: если все сеансы упали, producer навсегда
+            # застрял бы в queue.put. Ждём всех вместе и поднимаем первую ошибку.
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.aflush()
+            await sync_to_async(report)(self.metrics)
+        if self.finalize:
+            await sync_to_async(self.update_status)()
+        return self
+
+    async def produce(self, queue, sessions):
+        message = self.mailing.message
+        recipients = self.metrics.atimed(self.recipients().aiterator(chunk_size=self.batch_size), "fetch")
+        # Здесь лимиты домена считаются на письмо, а не на пачку.
+        pending = DomainQueue(self.throttle, 1)
+        async for recipient in recipients:
+            if self.should_stop():
+                break
+            if self.checkpoint:
+                self.issued.append(recipient.pk)
+            with self.metrics.timer("build"):
+                email = self.build_message(message, recipient)
+            pending.push(email.domain, email)
+            while len(pending) >= self.batch_size * INTERLEAVE_BATCHES:
+                await self.feed(pending, queue)
+        while pending and not self.should_stop():
+            await self.feed(pending, queue)
+        for _ in range(sessions):
+            await queue.put(None)
+
+    async def feed(self, pending, queue):
+        domain, emails, delay = pending.pop()
+        if not emails:
+            with self.metrics.timer("throttle"):
+                await asyncio.sleep(min(delay, POLL_INTERVAL))
+        for email in emails:
+            await queue.put(email)
+
+    async def session(self, queue):
+        smtp = aiosmtplib.SMTP(**self.smtp_options)
+        try:
+            while (email := await queue.get()) is not None:
+                try:
+                    await self.asend(smtp, email)
+                finally:
+                    self.throttle.release(email.domain)
+        finally:
+            if smtp.is_connected:
+                with suppress(Exception):
+                    await smtp.quit()
+
+    async def asend(self, smtp, email):
+        encoding = email.encoding or settings.DEFAULT_CHARSET
+        started = time.perf_counter()
+        error = None
+        try:
+            if not smtp.is_connected:
+                await smtp.connect()
+            await smtp.sendmail(
+                sanitize_address(email.from_email, encoding),
+                [sanitize_address(address, encoding) for address in email.recipients()],
+                email.message().as_bytes(linesep="\r\n"),
+            )
+        except Exception as e:
+            error = e
+            # После отказа по конкретному письму aiosmtplib сам делает RSET.
+            if not isinstance(e, (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused)):
+                smtp.close()
+        self.metrics.delivered(email.domain, time.perf_counter() - started)
+        await self.arecord(email.recipient, error)
+
+    async def arecord(self, recipient, error=None):
+        if self.buffer.put(self.make_attempt(recipient, error)):
+            await self.aflush()
+
+    async def aflush(self):
+        attempts = self.buffer.take()
+        if attempts:
+            # transaction.atomic недоступен в async-коде, поэтому запись
+            # вместе с on_flush выполняется в синхронном потоке.
+            await sync_to_async(self.buffer.save)(attempts)
+
+
+async def adispatch_mailing(mailing, owner=None, **kwargs):
+    """Асинхронный вариант ``dispatch_mailing``."""
+    mailing = await Mailing.objects.select_related("message", "owner", "segment").aget(pk=mailing.pk)
+    return await AsyncMailingDispatcher(mailing, owner=owner, **kwargs).run()
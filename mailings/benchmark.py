@@ -0,0 +1,237 @@
+"""Замер скорости отправки на локальном SMTP-сервере (команда ``bench_dispatch``).
+
+Каждый путь отправки получает свою рассылку на ``recipients`` синтетических
+получателей и отправляет её через ``StubSMTPServer``:
+
+* ``command`` — ``send_mailing`` с параметрами движка;
+* ``api`` — ``POST /api/mailings/{id}/send/`` и воркер очереди;
+* ``web`` — кнопка «Отправить» на странице рассылки и воркер очереди.
+"""
+import io
+import os
+import resource
+import statistics
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import Mailing, Message, Recipient
+from .services import claim_job, run_job
+from .smtp_stub import StubSMTPServer
+
+PATHS = ("command", "api", "web")
+
+SEED_BATCH_SIZE = 1000
+
+
+class QueryCounter:
+    """``execute_wrapper``, который считает запросы всех соединений, в том
+    числе открытых во время замера в потоках пула и ``sync_to_async``."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    @contextmanager
+    def active(self):
+        for connection in connections.all(initialized_only=True):
+            self.install(connection)
+        connection_created.connect(self.install)
+        try:
+            yield self
+        finally:
+            connection_created.disconnect(self.install)
+            for connection in connections.all(initialized_only=True):
+                if self in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(self)
+
+
+def peak_rss_kb():
+    """Пиковый RSS этого процесса и его дочерних процессов, КБ (Linux)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[round(fraction * 100) - 1]
+
+
+class Seed:
+    """Синтетические пользователь, сообщение и получатели одного замера."""
+
+    def __init__(self, recipients, domains=10):
+        self.tag = uuid.uuid4().hex[:8]
+        self.owner = get_user_model().objects.create(email=f"bench-{self.tag}@example.com")
+        self.owner.user_permissions.add(*Permission.objects.filter(content_type__app_label="mailings"))
+        self.message = Message.objects.create(
+            subject="Benchmark {{ full_name }}",
+            body="Здравствуйте, {{ full_name }}!\nЭто тестовое письмо замера отправки.",
+            owner=self.owner,
+        )
+        self.recipient_ids = []
+        for start in range(0, recipients, SEED_BATCH_SIZE):
+            batch = Recipient.objects.bulk_create(
+                Recipient(
+                    email=f"r{i}.{self.tag}@bench{i % domains}.example.com",
+                    full_name=f"Recipient {i}",
+                    owner=self.owner,
+                )
+                for i in range(start, min(start + SEED_BATCH_SIZE, recipients))
+            )
+            self.recipient_ids.extend(recipient.pk for recipient in batch)
+
+    def mailing(self):
+        now = timezone.now()
+        mailing = Mailing.objects.create(
+            start_at=now, end_at=now + timedelta(days=1), message=self.message, owner=self.owner
+        )
+        through = Mailing.recipients.through
+        for start in range(0, len(self.recipient_ids), SEED_BATCH_SIZE):
+            through.objects.bulk_create(
+                through(mailing_id=mailing.pk, recipient_id=pk)
+                for pk in self.recipient_ids[start:start + SEED_BATCH_SIZE]
+            )
+        return mailing
+
+    def cleanup(self):
+        # Рассылки, попытки, задачи и получатели удаляются каскадом.
+        self.owner.delete()
+
+
+@contextmanager
+def smtp_settings(server):
+    """Направляет почтовые настройки (и окружение дочерних процессов) на ``server``."""
+    values = {
+        "EMAIL_HOST": server.server_address[0],
+        "EMAIL_PORT": str(server.port),
+        "EMAIL_HOST_USER": "",
+        "EMAIL_HOST_PASSWORD": "",
+        "EMAIL_USE_TLS": "False",
+    }
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST=values["EMAIL_HOST"],
+            EMAIL_PORT=server.port,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False,
+            ALLOWED_HOSTS=["testserver"],
+        ):
+            yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def drain_jobs(batch_size=None, concurrency=1, workers=1, **kwargs):
+    # Очередь разбирается так же, как это делает run_send_worker.
+    while (job := claim_job(worker="bench")) is not None:
+        run_job(job, batch_size=batch_size, concurrency=concurrency, workers=workers)
+
+
+def send(path, seed, mailing, batch_size=None, concurrency=1, workers=1, use_async=False):
+    if path == "command":
+        call_command(
+            "send_mailing", mailing.pk, batch_size=batch_size, concurrency=concurrency,
+            workers=workers, use_async=use_async, stdout=io.StringIO(),
+        )
+        return
+    if path == "api":
+        client = APIClient()
+        client.force_authenticate(seed.owner)
+        response = client.post(reverse("mailing-send", args=(mailing.pk,)))
+        expected = 202
+    elif path == "web":
+        client = Client()
+        client.force_login(seed.owner)
+        response = client.post(reverse("mailing_detail", args=(mailing.pk,)))
+        expected = 302
+    else:
+        raise ValueError(f"Неизвестный путь отправки: {path}")
+    if response.status_code != expected:
+        raise RuntimeError(f"{path}: ответ {response.status_code} вместо {expected}")
+    drain_jobs(batch_size=batch_size, concurrency=concurrency, workers=workers)
+
+
+def run_benchmark(paths=PATHS, recipients=1000, latency=0.0, failure_rate=0.0, domains=10,
+                  keep=False, **options):
+    """Возвращает словарь с результатами по каждому пути отправки.
+
+    ``options`` (``batch_size``, ``concurrency``, ``workers``, ``use_async``)
+    передаются движку отправки; ``use_async`` влияет только на путь ``command``.
+    """
+    results = {}
+    with StubSMTPServer(latency=latency, failure_rate=failure_rate) as server:
+        with smtp_settings(server):
+            seed = Seed(recipients, domains)
+            try:
+                for path in paths:
+                    results[path] = measure(server, path, seed, **options)
+            finally:
+                if not keep:
+                    seed.cleanup()
+    return results
+
+
+def measure(server, path, seed, **options):
+    mailing = seed.mailing()
+    server.stats = dict.fromkeys(server.stats, 0)
+    server.latencies = []
+    counter = QueryCounter()
+    with counter.active():
+        started = time.perf_counter()
+        send(path, seed, mailing, **options)
+        elapsed = time.perf_counter() - started
+
+    sent = server.stats["accepted"] + server.stats["rejected"]
+    latencies = sorted(server.latencies)
+    in_process = options.get("workers", 1) <= 1
+    return {
+        "recipients": len(seed.recipient_ids),
+        "sent": sent,
+        "accepted": server.stats["accepted"],
+        "rejected": server.stats["rejected"],
+        "smtp_sessions": server.stats["sessions"],
+        "seconds": round(elapsed, 4),
+        "messages_per_second": round(sent / elapsed, 1) if elapsed else None,
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        # Запросы дочерних процессов (--workers) здесь не видны.
+        "queries": counter.count if in_process else None,
+        "queries_per_recipient": round(counter.count / sent, 3) if sent and in_process else None,
+        "peak_rss_kb": peak_rss_kb(),
+    }
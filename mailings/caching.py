@@ -0,0 +1,58 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+CACHE_PREFIX = "mailings"
+
+
+def version_key(model, owner_id=None):
+    """Ключ счётчика версий данных ``model`` владельца; ``None`` — данные всех владельцев."""
+    scope = "all" if owner_id is None else owner_id
+    return f"{CACHE_PREFIX}:version:{model._meta.label_lower}:{scope}"
+
+
+def initial_version():
+    # Счётчик, вытесненный из кэша, начинается с текущего времени, а не
+    # с единицы, чтобы не совпасть с версией, под которой уже что-то лежит.
+    return time.time_ns()
+
+
+def get_versions(models, owner_id=None):
+    keys = [version_key(model, owner_id) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, initial_version(), timeout=None)
+            versions[key] = cache.get(key) or initial_version()
+    return [versions[key] for key in keys]
+
+
+def bump_versions(models, owner_ids):
+    """Сбрасывает закэшированные списки ``models`` у владельцев ``owner_ids``.
+
+    Версии меняются после коммита транзакции, иначе параллельный запрос
+    успел бы закэшировать старые данные уже под новой версией.
+    """
+    owner_ids = set(owner_ids)
+    if not owner_ids:
+        return
+
+    def bump():
+        for model in models:
+            for owner_id in owner_ids | {None}:
+                key = version_key(model, owner_id)
+                try:
+                    cache.incr(key)
+                except ValueError:
+                    cache.add(key, initial_version(), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def list_cache_key(name, request, models, owner_id=None):
+    """Ключ страницы списка: пользователь, версии данных и полный URL с параметрами."""
+    versions = ".".join(str(version) for version in get_versions(models, owner_id))
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"{CACHE_PREFIX}:list:{name}:{request.user.pk}:{versions}:{path}"
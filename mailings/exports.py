@@ -0,0 +1,125 @@
+import csv
+import json
+from datetime import datetime, time
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import AttemptStatus
+
+EXPORT_FIELDS = (
+    "id",
+    "mailing_id",
+    "recipient_id",
+    "recipient__email",
+    "status",
+    "attempted_at",
+    "failure__text",
+)
+EXPORT_HEADER = ("id", "mailing", "recipient", "email", "status", "attempted_at", "response")
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_moment(value, end=False):
+    """Дата (``2024-05-01``) или дата-время в ISO 8601; дата без времени
+    означает начало дня, а для верхней границы — его конец."""
+    # Разборщики Django возвращают None для чужого формата, но бросают
+    # ValueError для несуществующей даты вроде 2024-13-45.
+    try:
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        raise ExportError(f"Неверная дата: {value}") from None
+    if moment is None:
+        if day is None:
+            raise ExportError(f"Неверная дата: {value}")
+        moment = datetime.combine(day, time.max if end else time.min)
+    if settings.USE_TZ and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_attempts(queryset, mailing=None, since=None, until=None, status=None):
+    if mailing:
+        try:
+            mailing = int(mailing)
+        except ValueError:
+            raise ExportError(f"Неверный номер рассылки: {mailing}") from None
+        queryset = queryset.filter(mailing_id=mailing)
+    if since:
+        queryset = queryset.filter(attempted_at__gte=parse_moment(since))
+    if until:
+        queryset = queryset.filter(attempted_at__lte=parse_moment(until, end=True))
+    if status:
+        status = status.upper()
+        if status not in AttemptStatus.names:
+            raise ExportError(f"Неверный статус: {status}")
+        queryset = queryset.filter(status=AttemptStatus[status])
+    return queryset
+
+
+def export_row(row):
+    """Строка ``EXPORT_FIELDS`` в прежнем виде: статус именем, ответ текстом."""
+    *head, status, attempted_at, failure = row
+    status = AttemptStatus(status)
+    response = "OK" if status == AttemptStatus.SUCCESS else failure or ""
+    return (*head, status.name, attempted_at, response)
+
+
+def export_rows(queryset, chunk_size=None):
+    """Строки выгрузки с серверного курсора, без создания моделей."""
+    chunk_size = chunk_size or settings.MAILING_EXPORT_CHUNK_SIZE
+    rows = queryset.order_by("id").values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    return map(export_row, rows)
+
+
+class Echo:
+    """Псевдофайл для ``csv.writer``: ``write`` просто возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_HEADER)
+    for row in rows:
+        yield writer.writerow(export_value(value) for value in row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        record = {name: export_value(value) for name, value in zip(EXPORT_HEADER, row)}
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def export_lines(rows, output="csv"):
+    if output == "csv":
+        return csv_lines(rows)
+    if output == "ndjson":
+        return ndjson_lines(rows)
+    raise ExportError(f"Неизвестный формат: {output}")
+
+
+def streaming_export(queryset, output="csv", filename="attempts"):
+    if output not in CONTENT_TYPES:
+        raise ExportError(f"Неизвестный формат: {output}")
+    response = StreamingHttpResponse(
+        export_lines(export_rows(queryset), output), content_type=CONTENT_TYPES[output]
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{output}"'
+    return response
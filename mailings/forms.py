@@ -1,26 +1,67 @@
 from django import forms
-from .models import Recipient, Message, Mailing
+from .models import Recipient, RecipientSegment, Message, Mailing
 
 class RecipientForm(forms.ModelForm):
     class Meta:
         model = Recipient
         fields = ['email', 'full_name', 'comment']
 
+class RecipientSegmentForm(forms.ModelForm):
+    class Meta:
+        model = RecipientSegment
+        fields = ['name', 'comment_contains', 'domain', 'created_after', 'created_before']
+        widgets = {
+            'created_after': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+            'created_before': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+        }
+
 class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
         fields = ['subject', 'body']
 
+class EmailListWidget(forms.Textarea):
+    """Список адресов в текстовом поле: через пробел или с новой строки."""
+
+    def value_from_datadict(self, data, files, name):
+        value = data.get(name)
+        return value.split() if value is not None else None
+
+    def format_value(self, value):
+        if isinstance(value, (list, tuple)):
+            return '\n'.join(str(item) for item in value)
+        return super().format_value(value)
+
+class RecipientEmailsField(forms.ModelMultipleChoiceField):
+    """Получатели по адресам. Форма не выводит всю адресную книгу владельца:
+    в базе ищутся только введённые адреса, одним запросом."""
+    widget = EmailListWidget(attrs={'rows': 6})
+    default_error_messages = {
+        'invalid_choice': 'Получатель %(value)s не найден.',
+    }
+
+    def __init__(self, queryset, **kwargs):
+        super().__init__(queryset, to_field_name='email', **kwargs)
+
 class MailingForm(forms.ModelForm):
-    recipients = forms.ModelMultipleChoiceField(
+    recipients = RecipientEmailsField(
         queryset=Recipient.objects.all(),
-        widget=forms.CheckboxSelectMultiple
+        required=False,
+        help_text='Адреса получателей; большие списки удобнее загрузить импортом или задать сегментом.',
     )
 
     class Meta:
         model = Mailing
-        fields = ['start_at', 'end_at', 'message', 'recipients']
+        fields = ['start_at', 'end_at', 'message', 'segment', 'recipients']
         widgets = {
             'start_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
             'end_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
-        }
\ No newline at end of file
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        segment = cleaned_data.get('segment')
+        recipients = cleaned_data.get('recipients')
+        if segment and recipients:
+            raise forms.ValidationError('Выберите либо сегмент, либо получателей.')
+        return cleaned_data
\ No newline at end of file
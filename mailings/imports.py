@@ -0,0 +1,211 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from .caching import bump_versions
+from .models import Mailing, Recipient
+
+# Сколько отклонённых строк перечислять в отчёте.
+MAX_REPORTED_ERRORS = 100
+
+FULL_NAME_LENGTH = Recipient._meta.get_field("full_name").max_length
+
+
+class RecipientImportError(ValueError):
+    pass
+
+
+def normalize_email(value):
+    """Проверяет адрес и приводит домен к нижнему регистру."""
+    email = (value or "").strip()
+    validate_email(email)
+    local, domain = email.rsplit("@", 1)
+    return f"{local}@{domain.lower()}"
+
+
+def import_format(filename, default="csv"):
+    if filename and filename.lower().endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return default
+
+
+def text_stream(file):
+    """Загруженный файл открыт в бинарном режиме; читаем его построчно как UTF-8."""
+    if isinstance(file, io.TextIOBase):
+        return file
+    return io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+
+
+def read_error(line_num, error):
+    """Ошибка чтения файла как ``RecipientImportError`` с номером строки.
+
+    Текст декодируется блоками, поэтому для ``UnicodeDecodeError`` номер
+    строки — первая ещё не прочитанная строка.
+    """
+    if isinstance(error, UnicodeDecodeError):
+        reason = "файл не в кодировке UTF-8"
+    else:
+        reason = f"неверный формат ({error})"
+    return RecipientImportError(f"Строка {line_num}: {reason}")
+
+
+def read_csv(file):
+    reader = csv.DictReader(text_stream(file))
+    try:
+        fieldnames = reader.fieldnames
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise read_error(reader.line_num + 1, e) from None
+    if not fieldnames or "email" not in fieldnames:
+        raise RecipientImportError("В CSV нет колонки email")
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise read_error(reader.line_num + 1, e) from None
+        yield reader.line_num, row
+
+
+def read_ndjson(file):
+    """Строки NDJSON; строка с неверным JSON не прерывает загрузку, а
+    попадает в отчёт как отклонённая (``row`` равен None)."""
+    lines = text_stream(file)
+    line_num = 0
+    while True:
+        try:
+            line = next(lines)
+        except StopIteration:
+            return
+        except UnicodeDecodeError as e:
+            raise read_error(line_num + 1, e) from None
+        line_num += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            row = None
+        yield line_num, row if isinstance(row, dict) else None
+
+
+def read_rows(file, input_format="csv"):
+    if input_format == "csv":
+        return read_csv(file)
+    if input_format == "ndjson":
+        return read_ndjson(file)
+    raise RecipientImportError(f"Неизвестный формат: {input_format}")
+
+
+class RecipientImporter:
+    """Загружает получателей пачками через ``bulk_create(update_conflicts=True)``.
+
+    Повторный импорт того же адреса обновляет имя и комментарий. Адреса,
+    которые уже принадлежат другому пользователю, отклоняются: ``email``
+    уникален глобально, и upsert иначе изменил бы чужого получателя.
+    Если передана ``mailing``, все загруженные получатели добавляются в неё.
+    """
+
+    def __init__(self, owner, mailing=None, chunk_size=None):
+        if mailing is not None and mailing.segment_id:
+            raise RecipientImportError("Получатели рассылки заданы сегментом")
+        self.owner = owner
+        self.mailing = mailing
+        self.chunk_size = chunk_size or settings.MAILING_IMPORT_CHUNK_SIZE
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.errors = []
+
+    def run(self, rows):
+        chunk = {}
+        for line_num, row in rows:
+            recipient = self.validate(line_num, row)
+            if recipient is None:
+                continue
+            chunk[recipient.email] = (line_num, recipient)
+            if len(chunk) >= self.chunk_size:
+                self.save_chunk(chunk)
+                chunk = {}
+        if chunk:
+            self.save_chunk(chunk)
+        return self
+
+    def reject(self, line_num, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_num, "error": reason})
+
+    def validate(self, line_num, row):
+        if row is None:
+            self.reject(line_num, "Неверная строка")
+            return None
+        try:
+            email = normalize_email(row.get("email"))
+        except ValidationError:
+            self.reject(line_num, f"Неверный email: {row.get('email')}")
+            return None
+        full_name = (row.get("full_name") or "").strip()
+        if not full_name or len(full_name) > FULL_NAME_LENGTH:
+            self.reject(line_num, f"Неверное имя для {email}")
+            return None
+        comment = (row.get("comment") or "").strip()
+        return Recipient(email=email, full_name=full_name, comment=comment, owner=self.owner)
+
+    def save_chunk(self, chunk):
+        with transaction.atomic():
+            owners = dict(
+                Recipient.objects.filter(email__in=chunk).values_list("email", "owner_id")
+            )
+            recipients = []
+            for email, (line_num, recipient) in chunk.items():
+                owner_id = owners.get(email)
+                if owner_id is not None and owner_id != self.owner.pk:
+                    self.reject(line_num, f"Адрес {email} принадлежит другому пользователю")
+                    continue
+                recipients.append(recipient)
+                if owner_id is None:
+                    self.inserted += 1
+                else:
+                    self.updated += 1
+            if not recipients:
+                return
+
+            Recipient.objects.bulk_create(
+                recipients,
+                update_conflicts=True,
+                unique_fields=["email"],
+                update_fields=["full_name", "comment", "updated_at"],
+            )
+            bump_versions((Recipient,), [self.owner.pk])
+            if self.mailing is not None:
+                self.attach([recipient.email for recipient in recipients])
+
+    def attach(self, emails):
+        ids = Recipient.objects.filter(email__in=emails, owner=self.owner).values_list("id", flat=True)
+        through = Mailing.recipients.through
+        through.objects.bulk_create(
+            [through(mailing_id=self.mailing.pk, recipient_id=pk) for pk in ids],
+            ignore_conflicts=True,
+        )
+
+    def report(self):
+        report = {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+        if self.mailing is not None:
+            report["mailing"] = self.mailing.pk
+        return report
+
+
+def import_recipients(file, owner, input_format="csv", mailing=None, chunk_size=None):
+    importer = RecipientImporter(owner, mailing, chunk_size)
+    return importer.run(read_rows(file, input_format))
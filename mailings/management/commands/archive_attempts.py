@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from mailings.archive import AttemptArchiver, retention_cutoff
+
+class Command(BaseCommand):
+    help = ('Сворачивает попытки отправки старше срока хранения в итоги по дням '
+            'и удаляет их пачками')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Срок хранения попыток в днях (по умолчанию MAILING_ATTEMPT_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Сколько попыток удалять за одну транзакцию')
+        parser.add_argument('--dump-dir', default=None,
+                            help='Каталог для выгрузки удаляемых попыток в NDJSON с gzip')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Пауза между пачками, секунд')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, сколько попыток будет заархивировано')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days не может быть отрицательным')
+        cutoff = retention_cutoff(options['days'])
+        archiver = AttemptArchiver(
+            cutoff, batch_size=options['batch_size'], dump_dir=options['dump_dir'],
+            pause=options['pause'], dry_run=options['dry_run'],
+        ).run()
+
+        if options['dry_run']:
+            self.stdout.write(f'Попыток до {cutoff:%Y-%m-%d} к архивации: {archiver.archived}')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Заархивировано попыток до {cutoff:%Y-%m-%d}: {archiver.archived} '
+            f'(обновлено строк итогов: {archiver.rollups})'
+        ))
+        if archiver.dump_path:
+            self.stdout.write(f'Выгрузка: {archiver.dump_path}')
@@ -0,0 +1,86 @@
+import json
+import platform
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from mailings.benchmark import PATHS, run_benchmark
+
+class Command(BaseCommand):
+    help = ('Замеряет скорость отправки на синтетических получателях через '
+            'локальный SMTP-сервер и выводит результат в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000,
+                            help='Сколько синтетических получателей создать')
+        parser.add_argument('--domains', type=int, default=10,
+                            help='На сколько доменов распределить получателей')
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Задержка ответа SMTP-сервера на письмо, секунд')
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help='Доля писем, которые SMTP-сервер отклоняет (0..1)')
+        parser.add_argument('--paths', default=','.join(PATHS),
+                            help=f'Какие пути отправки замерить через запятую: {", ".join(PATHS)}')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Сколько писем передавать в SMTP-соединение за раз')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Сколько SMTP-соединений использовать параллельно')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='На сколько процессов разделить получателей')
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help='Путь command отправляет через asyncio')
+        parser.add_argument('--output', default=None,
+                            help='Файл для JSON-результата (по умолчанию stdout)')
+        parser.add_argument('--keep', action='store_true',
+                            help='Не удалять созданные данные после замера')
+
+    def handle(self, *args, **options):
+        paths = [path.strip() for path in options['paths'].split(',') if path.strip()]
+        unknown = sorted(set(paths) - set(PATHS))
+        if unknown:
+            raise CommandError(f'Неизвестные пути отправки: {", ".join(unknown)}')
+        if options['recipients'] < 1 or options['domains'] < 1:
+            raise CommandError('--recipients и --domains должны быть больше нуля')
+        if not 0 <= options['failure_rate'] <= 1:
+            raise CommandError('--failure-rate должен быть от 0 до 1')
+        if options['use_async'] and options['workers'] > 1:
+            raise CommandError('--async нельзя совмещать с --workers')
+
+        parameters = {
+            name: options[name]
+            for name in ('recipients', 'domains', 'latency', 'failure_rate', 'batch_size',
+                         'concurrency', 'workers', 'use_async')
+        }
+        results = run_benchmark(paths=paths, keep=options['keep'], **parameters)
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'commit': self.commit(),
+            'python': platform.python_version(),
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'parameters': parameters,
+            'results': results,
+        }
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(data + '\n', encoding='utf-8')
+            for path, result in results.items():
+                self.stdout.write(
+                    f'{path:<8} {result["messages_per_second"]} писем/с, '
+                    f'p50 {result["latency_p50_ms"]} мс, p99 {result["latency_p99_ms"]} мс, '
+                    f'{result["queries_per_recipient"]} запросов на получателя'
+                )
+            self.stdout.write(self.style.SUCCESS(f'Результат сохранён в {options["output"]}'))
+        else:
+            self.stdout.write(data)
+
+    @staticmethod
+    def commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
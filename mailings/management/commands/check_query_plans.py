@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from mailings.query_plans import UnsupportedDatabase, check_plans, plan_subjects
+
+class Command(BaseCommand):
+    help = 'Выполняет EXPLAIN для основных запросов и падает, если таблица читается полным сканированием'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show-plans', action='store_true',
+                            help='Вывести планы всех запросов')
+
+    def handle(self, *args, **options):
+        # Настройки планировщика действуют до конца транзакции.
+        owner, mailing = plan_subjects()
+        with transaction.atomic():
+            try:
+                results = check_plans(owner, mailing)
+            except UnsupportedDatabase as e:
+                raise CommandError(str(e))
+            finally:
+                transaction.set_rollback(True)
+
+        failures = []
+        for check, plan, scans in results:
+            if scans:
+                failures.append(check.name)
+                self.stdout.write(self.style.ERROR(f'{check.name:<26} полное сканирование: {", ".join(scans)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{check.name:<26} ok'))
+            if scans or options['show_plans']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+        if failures:
+            raise CommandError(f'Запросы без подходящего индекса: {", ".join(failures)}')
@@ -1,11 +1,12 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import Group, Permission
+from mailings.access import MANAGERS_GROUP, invalidate_all
 
 class Command(BaseCommand):
     help = 'Создает группу "Менеджеры" и присваивает кастомные права'
 
     def handle(self, *args, **options):
-        managers_group, created = Group.objects.get_or_create(name='Менеджеры')
+        managers_group, created = Group.objects.get_or_create(name=MANAGERS_GROUP)
         if created:
             self.stdout.write(self.style.SUCCESS('Группа "Менеджеры" создана'))
 
@@ -13,6 +14,8 @@ class Command(BaseCommand):
         permissions = [
             'mailings.can_view_recipient', 'mailings.can_add_recipient',
             'mailings.can_change_recipient', 'mailings.can_delete_recipient',
+            'mailings.can_view_recipientsegment', 'mailings.can_add_recipientsegment',
+            'mailings.can_change_recipientsegment', 'mailings.can_delete_recipientsegment',
             'mailings.can_view_message', 'mailings.can_add_message',
             'mailings.can_change_message', 'mailings.can_delete_message',
             'mailings.can_view_mailing', 'mailings.can_add_mailing',
@@ -26,4 +29,6 @@ class Command(BaseCommand):
             except Permission.DoesNotExist:
                 self.stdout.write(self.style.ERROR(f'Право {perm_codename} не найдено'))
 
+        # Права групп закэшированы в снимках пользователей (mailings.access).
+        invalidate_all()
         self.stdout.write(self.style.SUCCESS('Права присвоены группе "Менеджеры"'))
\ No newline at end of file
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from mailings.exports import ExportError, export_lines, export_rows, filter_attempts
+from mailings.models import MailAttempt
+
+class Command(BaseCommand):
+    help = 'Выгружает попытки рассылок в CSV или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mailing', type=int, help='ID рассылки')
+        parser.add_argument('--since', help='Начало периода (дата или дата-время ISO 8601)')
+        parser.add_argument('--until', help='Конец периода (дата или дата-время ISO 8601)')
+        parser.add_argument('--status', help='SUCCESS или FAILED')
+        parser.add_argument('--output', choices=['csv', 'ndjson'], default='csv',
+                            help='Формат выгрузки')
+        parser.add_argument('--file', help='Файл для выгрузки (по умолчанию stdout)')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Сколько строк читать с курсора за раз')
+
+    def handle(self, *args, **options):
+        try:
+            queryset = filter_attempts(
+                MailAttempt.objects.all(),
+                mailing=options['mailing'],
+                since=options['since'],
+                until=options['until'],
+                status=options['status'],
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        lines = export_lines(export_rows(queryset, options['chunk_size']), options['output'])
+        if options['file']:
+            with open(options['file'], 'w', encoding='utf-8', newline='') as file:
+                file.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
@@ -0,0 +1,42 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from mailings.imports import RecipientImportError, import_format, import_recipients
+from mailings.models import Mailing
+
+class Command(BaseCommand):
+    help = 'Загружает получателей из CSV или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с колонками email, full_name, comment')
+        parser.add_argument('--owner', required=True, help='Email владельца получателей')
+        parser.add_argument('--mailing', type=int, help='Добавить получателей в рассылку с этим ID')
+        parser.add_argument('--input', choices=['csv', 'ndjson'],
+                            help='Формат файла (по умолчанию по расширению)')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Сколько получателей сохранять за раз')
+
+    def handle(self, *args, **options):
+        try:
+            owner = get_user_model().objects.get(email=options['owner'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'Пользователь {options["owner"]} не найден')
+
+        mailing = None
+        if options['mailing']:
+            try:
+                mailing = Mailing.objects.get(pk=options['mailing'], owner=owner)
+            except Mailing.DoesNotExist:
+                raise CommandError(f'Рассылка {options["mailing"]} не найдена')
+
+        input_format = options['input'] or import_format(options['path'])
+        with open(options['path'], 'rb') as file:
+            try:
+                importer = import_recipients(file, owner, input_format, mailing, options['chunk_size'])
+            except RecipientImportError as e:
+                raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено: {importer.inserted}, обновлено: {importer.updated}, отклонено: {importer.rejected}'
+        ))
+        for error in importer.errors:
+            self.stderr.write(f'Строка {error["line"]}: {error["error"]}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from mailings.stats import rebuild_stats
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику рассылок по таблице попыток'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mailing_ids', nargs='*', type=int,
+                            help='ID рассылок (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_stats(options['mailing_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Статистика пересчитана для рассылок: {rebuilt}'))
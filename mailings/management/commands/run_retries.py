@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from mailings.services import process_due_retries
+
+class Command(BaseCommand):
+    help = 'Повторяет отправку писем, не доставленных из-за временных ошибок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=500,
+                            help='Сколько повторов забирать за раз')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Сколько SMTP-соединений использовать параллельно')
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать наступившие повторы и завершиться')
+        parser.add_argument('--sleep', type=float, default=30.0,
+                            help='Пауза в секундах, когда повторять нечего')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_due_retries(limit=options['limit'], concurrency=options['concurrency'])
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f'Повторено писем: {processed}'))
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['sleep'])
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from mailings.services import (
+    claim_job, finish_expired_mailings, launch_due_mailings, process_due_retries, run_job
+)
+
+class Command(BaseCommand):
+    help = 'Запускает рассылки по start_at и завершает их по end_at'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=30.0,
+                            help='Пауза между проверками в секундах')
+        parser.add_argument('--limit', type=int, default=100,
+                            help='Сколько рассылок запускать за одну проверку')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить одну проверку и завершиться')
+        parser.add_argument('--run-jobs', action='store_true',
+                            help='Самому отправлять поставленные в очередь рассылки и повторы, '
+                                 'без run_send_worker и run_retries')
+
+    def handle(self, *args, **options):
+        while True:
+            finished = finish_expired_mailings()
+            if finished:
+                self.stdout.write(f'Завершено рассылок: {finished}')
+
+            jobs = launch_due_mailings(limit=options['limit'])
+            for job in jobs:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Рассылка {job.mailing_id} поставлена в очередь (задача {job.id})'
+                ))
+
+            if options['run_jobs']:
+                while (job := claim_job()) is not None:
+                    run_job(job)
+                while process_due_retries():
+                    pass
+
+            if options['once']:
+                break
+            # Если запустили полный лимит, возможно, есть ещё готовые рассылки.
+            if len(jobs) < options['limit']:
+                time.sleep(options['interval'])
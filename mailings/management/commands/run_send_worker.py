@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from mailings.services import claim_job, run_job
+
+class Command(BaseCommand):
+    help = 'Запускает воркер, который отправляет рассылки из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Разобрать очередь и завершиться')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Сколько SMTP-соединений использовать параллельно')
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            self.stdout.write(f'Задача {job.id}: рассылка {job.mailing_id}')
+            run_job(job, concurrency=options['concurrency'])
+            if job.status == "DONE":
+                self.stdout.write(self.style.SUCCESS(
+                    f'Задача {job.id} выполнена: {job.processed} писем'
+                ))
+            elif job.status == "FAILED":
+                self.stdout.write(self.style.ERROR(f'Задача {job.id} завершилась ошибкой: {job.error}'))
+            elif job.status == "CANCELLED":
+                self.stdout.write(self.style.WARNING(f'Задача {job.id} отменена: {job.error}'))
+            else:
+                # Аренда истекла, и задачу забрал другой воркер.
+                self.stdout.write(self.style.WARNING(f'Задача {job.id} перешла к воркеру {job.worker}'))
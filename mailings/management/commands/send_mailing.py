@@ -1,14 +1,30 @@
+import asyncio
+import time
+
 from django.core.management.base import BaseCommand, CommandError
-from django.core.mail import send_mail
-from django.conf import settings
-from django.utils import timezone
-from mailings.models import Mailing, MailAttempt
+from mailings.async_services import adispatch_mailing
+from mailings.metrics import format_profile
+from mailings.models import Mailing
+from mailings.services import dispatch_mailing
 
 class Command(BaseCommand):
     help = 'Отправляет рассылку по ID'
 
     def add_arguments(self, parser):
         parser.add_argument('mailing_id', type=int)
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Сколько писем передавать в SMTP-соединение за раз')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Сколько SMTP-соединений использовать параллельно')
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help='Отправлять через asyncio из одного event loop')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='На сколько процессов разделить получателей')
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать с начала списка, игнорируя контрольную точку '
+                                 '(уже доставленные письма всё равно не отправляются)')
+        parser.add_argument('--profile', action='store_true',
+                            help='Вывести время по фазам отправки, коды ответов SMTP и домены')
 
     def handle(self, *args, **options):
         mailing_id = options['mailing_id']
@@ -17,38 +33,29 @@ class Command(BaseCommand):
         except Mailing.DoesNotExist:
             raise CommandError(f'Рассылка с ID {mailing_id} не найдена')
 
-        recipients = mailing.recipients.all()
-        message = mailing.message
-
-        for recipient in recipients:
-            try:
-                send_mail(
-                    subject=message.subject,
-                    message=message.body,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[recipient.email],
-                    fail_silently=False,
-                )
-                MailAttempt.objects.create(
-                    mailing=mailing,
-                    recipient=recipient,
-                    status="SUCCESS",
-                    response="OK",
-                    owner=mailing.owner,
-                )
-            except Exception as e:
-                MailAttempt.objects.create(
-                    mailing=mailing,
-                    recipient=recipient,
-                    status="FAILED",
-                    response=str(e),
-                    owner=mailing.owner,
-                )
-
-        if mailing.status == "CREATED":
-            mailing.status = "RUNNING"
-        if mailing.end_at and mailing.end_at < timezone.now():
-            mailing.status = "FINISHED"
-        mailing.save()
-
-        self.stdout.write(self.style.SUCCESS(f'Рассылка {mailing_id} выполнена'))
\ No newline at end of file
+        if options['use_async'] and options['workers'] > 1:
+            raise CommandError('--async нельзя совмещать с --workers')
+
+        started = time.perf_counter()
+        if options['use_async']:
+            dispatcher = asyncio.run(adispatch_mailing(
+                mailing, batch_size=options['batch_size'], concurrency=options['concurrency'],
+                restart=options['restart'],
+            ))
+        else:
+            dispatcher = dispatch_mailing(
+                mailing, batch_size=options['batch_size'], concurrency=options['concurrency'] or 1,
+                workers=options['workers'], restart=options['restart'],
+            )
+
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(f'Рассылка {mailing_id} выполнена'))
+        if options['profile']:
+            self.stdout.write(
+                f'Успешно: {dispatcher.success}, ошибок: {dispatcher.failed}, за {elapsed:.3f} с'
+            )
+            for line in format_profile(dispatcher.metrics.snapshot()):
+                self.stdout.write(line)
+            if options['use_async'] or (options['concurrency'] or 1) > 1 or options['workers'] > 1:
+                self.stdout.write('Время фаз просуммировано по параллельным сессиям и может быть больше общего.')
\ No newline at end of file
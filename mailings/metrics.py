@@ -0,0 +1,258 @@
+"""Таймеры и счётчики конвейера отправки.
+
+Фазы отправки:
+
+* ``fetch`` — чтение получателей рассылки из БД;
+* ``build`` — сборка письма получателю;
+* ``throttle`` — ожидание лимитов домена;
+* ``smtp`` — диалог с SMTP-сервером (пачка или одно письмо);
+* ``persist`` — запись попыток вместе со статистикой и повторами.
+
+Каждый прогон копит значения в своём ``Metrics`` (их печатает
+``send_mailing --profile``) и по ходу отправки переносит прирост в реестр
+процесса ``registry``, который отдаёт ``/metrics``. С
+``MAILING_METRICS_SHARED`` прирост ещё и складывается в Redis, чтобы
+``/metrics`` показывал сумму по всем воркерам.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import suppress
+
+from django.conf import settings
+
+from .retries import SMTP_OK, reply_code
+
+PHASES = ("fetch", "build", "throttle", "smtp", "persist")
+
+REDIS_KEY = "mailings:metrics"
+
+# Домены сверх MAILING_METRICS_MAX_DOMAINS попадают в одну метку.
+OTHER_DOMAIN = "other"
+
+FAMILIES = {
+    "mailing_phase_seconds": ("summary", "Время фаз отправки, секунд"),
+    "mailing_smtp_replies_total": ("counter", "Ответы SMTP-сервера по кодам (none — без ответа)"),
+    "mailing_domain_messages_total": ("counter", "Письма по доменам получателей и итогу"),
+    "mailing_domain_smtp_seconds_total": ("counter", "Время SMTP-диалогов по доменам, секунд"),
+}
+
+_domains = set()
+_domains_lock = threading.Lock()
+
+
+def domain_label(domain):
+    """Домен как метка; число разных меток в процессе ограничено."""
+    if domain in _domains:
+        return domain
+    with _domains_lock:
+        if len(_domains) < settings.MAILING_METRICS_MAX_DOMAINS:
+            _domains.add(domain)
+            return domain
+    return OTHER_DOMAIN
+
+
+class Timer:
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.phase, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """Значения метрик по ключам ``(имя, ((метка, значение), ...))``.
+
+    Потокобезопасен: в ``ConcurrentMailingDispatcher`` SMTP-фазы
+    записываются из потоков пула.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.reported = {}
+
+    def add(self, name, labels=(), amount=1.0):
+        with self.lock:
+            self.values[name, labels] += amount
+
+    def observe(self, phase, seconds):
+        labels = (("phase", phase),)
+        with self.lock:
+            self.values["mailing_phase_seconds_sum", labels] += seconds
+            self.values["mailing_phase_seconds_count", labels] += 1
+
+    def timer(self, phase):
+        return Timer(self, phase)
+
+    def timed(self, iterable, phase):
+        """Итерирует ``iterable``, засекая время получения каждого элемента."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(phase, time.perf_counter() - started)
+            yield item
+
+    async def atimed(self, iterable, phase):
+        iterator = aiter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            self.observe(phase, time.perf_counter() - started)
+            yield item
+
+    def delivered(self, domain, seconds):
+        """SMTP-диалог с письмами одного домена занял ``seconds``."""
+        self.observe("smtp", seconds)
+        self.add("mailing_domain_smtp_seconds_total", (("domain", domain_label(domain)),), seconds)
+
+    def result(self, domain, error=None):
+        """Итог отправки одного письма."""
+        code = str(SMTP_OK) if error is None else str(reply_code(error) or "none")
+        status = "success" if error is None else "failed"
+        with self.lock:
+            self.values["mailing_smtp_replies_total", (("code", code),)] += 1
+            self.values["mailing_domain_messages_total", (("domain", domain_label(domain)), ("status", status))] += 1
+
+    def merge(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def delta(self):
+        """Прирост значений с прошлого вызова."""
+        with self.lock:
+            values = dict(self.values)
+            delta = {key: value - self.reported.get(key, 0.0) for key, value in values.items()}
+            self.reported = values
+        return {key: value for key, value in delta.items() if value}
+
+
+registry = Metrics()
+
+
+def series(name, labels):
+    if not labels:
+        return name
+    escaped = ",".join(
+        '{}="{}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"')) for label, value in labels
+    )
+    return f"{name}{{{escaped}}}"
+
+
+def redis_connection():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def report(metrics):
+    """Переносит прирост метрик прогона в реестр процесса (и в Redis)."""
+    delta = metrics.delta()
+    if not delta:
+        return
+    registry.merge(delta)
+    if settings.MAILING_METRICS_SHARED:
+        # Недоступный Redis не должен прерывать отправку.
+        with suppress(Exception):
+            publish(delta)
+
+
+def publish(values):
+    connection = redis_connection()
+    if connection is None:
+        return
+    pipeline = connection.pipeline(transaction=False)
+    for (name, labels), value in values.items():
+        pipeline.hincrbyfloat(REDIS_KEY, series(name, labels), value)
+    pipeline.execute()
+
+
+def collect():
+    """Значения для ``/metrics`` по строкам серий Prometheus."""
+    if settings.MAILING_METRICS_SHARED:
+        connection = redis_connection()
+        if connection is not None:
+            return {
+                field.decode(): float(value)
+                for field, value in connection.hgetall(REDIS_KEY).items()
+            }
+    return {series(name, labels): value for (name, labels), value in registry.snapshot().items()}
+
+
+def family(line):
+    name = line.split("{", 1)[0]
+    for suffix in ("_sum", "_count"):
+        if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+            return name[:-len(suffix)]
+    return name
+
+
+def render(values):
+    """Текстовый формат Prometheus 0.0.4."""
+    grouped = defaultdict(list)
+    for line, value in values.items():
+        grouped[family(line)].append((line, value))
+    lines = []
+    for name in sorted(grouped):
+        if name in FAMILIES:
+            kind, description = FAMILIES[name]
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{line} {value!r}" for line, value in sorted(grouped[name]))
+    return "\n".join(lines) + "\n"
+
+
+def format_profile(values, top=10):
+    """Строки разбивки прогона по фазам, кодам ответа и доменам для ``--profile``."""
+    def phase(name, suffix):
+        return values.get((f"mailing_phase_seconds_{suffix}", (("phase", name),)), 0.0)
+
+    messages = sum(value for (name, _), value in values.items() if name == "mailing_smtp_replies_total")
+    total = sum(phase(name, "sum") for name in PHASES) or 1.0
+    lines = [f"{'Фаза':<10} {'вызовов':>9} {'секунд':>10} {'доля':>7} {'мкс/письмо':>11}"]
+    for name in PHASES:
+        seconds = phase(name, "sum")
+        per_message = seconds / messages * 1e6 if messages else 0.0
+        lines.append(
+            f"{name:<10} {int(phase(name, 'count')):>9} {seconds:>10.3f} "
+            f"{seconds / total:>7.1%} {per_message:>11.1f}"
+        )
+
+    codes = sorted(
+        (labels[0][1], int(value)) for (name, labels), value in values.items()
+        if name == "mailing_smtp_replies_total"
+    )
+    lines.append("Коды ответа SMTP: " + (", ".join(f"{code}: {count}" for code, count in codes) or "нет"))
+
+    domains = defaultdict(lambda: [0, 0, 0.0])
+    for (name, labels), value in values.items():
+        if name == "mailing_domain_messages_total":
+            domain, status = labels[0][1], labels[1][1]
+            domains[domain][0 if status == "success" else 1] += int(value)
+        elif name == "mailing_domain_smtp_seconds_total":
+            domains[labels[0][1]][2] += value
+    if domains:
+        lines.append(f"{'Домен':<30} {'успешно':>9} {'ошибок':>8} {'SMTP, с':>9}")
+        busiest = sorted(domains.items(), key=lambda item: item[1][0] + item[1][1], reverse=True)[:top]
+        for domain, (success, failed, seconds) in busiest:
+            lines.append(f"{domain:<30} {success:>9} {failed:>8} {seconds:>9.3f}")
+    return lines
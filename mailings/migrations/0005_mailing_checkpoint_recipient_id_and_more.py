@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0004_mailing_mailings_ma_status_029e58_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='checkpoint_recipient_id',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mailattempt',
+            index=models.Index(fields=['mailing', 'recipient', 'status'], name='mailings_ma_mailing_e824ef_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0005_mailing_checkpoint_recipient_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailRetry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveSmallIntegerField(default=1)),
+                ('next_attempt_at', models.DateTimeField()),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retries', to='mailings.mailing')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retries', to='mailings.recipient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_attempt_at'], name='mailings_ma_next_at_d56b06_idx')],
+                'constraints': [models.UniqueConstraint(fields=('mailing', 'recipient'), name='unique_mail_retry')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0006_mailretry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mailattempt',
+            index=models.Index(fields=['owner', 'attempted_at', 'id'], name='mailings_ma_owner_i_d3f1d2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailattempt',
+            index=models.Index(fields=['attempted_at', 'id'], name='mailings_ma_attempt_6df100_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='mailings_ma_owner_i_e0cd2f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='mailings_me_owner_i_a788bd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='mailings_re_owner_i_2a1e88_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sendjob',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='mailings_se_owner_i_675273_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0007_mailattempt_mailings_ma_owner_i_d3f1d2_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mailing',
+            name='recipients',
+            field=models.ManyToManyField(blank=True, related_name='mailings', to='mailings.recipient'),
+        ),
+        migrations.CreateModel(
+            name='RecipientSegment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('comment_contains', models.CharField(blank=True, help_text='Тег или слово в комментарии получателя', max_length=255)),
+                ('domain', models.CharField(blank=True, help_text='Домен email, например example.com', max_length=255)),
+                ('created_after', models.DateTimeField(blank=True, null=True)),
+                ('created_before', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'permissions': [('can_view_recipientsegment', 'Can view recipient segment'), ('can_add_recipientsegment', 'Can add recipient segment'), ('can_change_recipientsegment', 'Can change recipient segment'), ('can_delete_recipientsegment', 'Can delete recipient segment')],
+            },
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='segment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='mailings', to='mailings.recipientsegment'),
+        ),
+        migrations.AddIndex(
+            model_name='recipientsegment',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='mailings_re_owner_i_ea3acc_idx'),
+        ),
+    ]
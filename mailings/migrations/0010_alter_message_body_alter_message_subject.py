@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:53
+
+import mailings.templating
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0009_mailingstats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='body',
+            field=models.TextField(help_text='Можно подставлять поля получателя: {{ full_name }}, {{ email }}, {{ comment }}', validators=[mailings.templating.validate_placeholders]),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='subject',
+            field=models.CharField(max_length=255, validators=[mailings.templating.validate_placeholders]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0010_alter_message_body_alter_message_subject'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mailing',
+            name='mailings_ma_status_029e58_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mailing',
+            name='mailings_ma_status_a7709e_idx',
+        ),
+        migrations.AddIndex(
+            model_name='mailattempt',
+            index=models.Index(fields=['mailing', 'status'], name='mailings_ma_mailing_22122f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(condition=models.Q(('status', 'FINISHED'), _negated=True), fields=['status', 'start_at'], name='mailing_active_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(condition=models.Q(('status', 'FINISHED'), _negated=True), fields=['end_at'], name='mailing_active_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(condition=models.Q(('status', 'FINISHED'), _negated=True), fields=['owner', 'status', 'start_at'], name='mailing_owner_active_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0011_mailing_active_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailAttemptRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('SUCCESS', 'Успешно'), ('FAILED', 'Не успешно')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_attempt_at', models.DateTimeField()),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='mailings.mailing')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempt_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'day'], name='mailings_ma_owner_i_65b831_idx')],
+                'constraints': [models.UniqueConstraint(fields=('mailing', 'day', 'status'), name='unique_attempt_rollup')],
+            },
+        ),
+    ]
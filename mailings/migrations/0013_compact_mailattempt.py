@@ -0,0 +1,206 @@
+"""Компактное хранение попыток: статус числом, код ответа, тексты ошибок в FailureReason.
+
+Миграция неатомарная: данные переносятся короткими транзакциями по
+диапазонам id, каждая трогает не больше ``BATCH_SIZE`` строк, поэтому
+блокировки строк не копятся на всю таблицу. Схемные шаги при этом
+по-прежнему блокируют таблицу попыток целиком: на PostgreSQL SET NOT NULL
+проверяет все строки, а индексы строятся без CONCURRENTLY, и на это время
+запись попыток останавливается. Отправку на время миграции лучше
+остановить. Если миграция упала на середине, уже выполненные шаги
+остаются в базе и перед повторным запуском их нужно откатить вручную.
+"""
+import hashlib
+import re
+from collections import defaultdict
+
+from django.db import migrations, models, transaction
+from django.db.models import Max, Min, OuterRef, Subquery
+import django.db.models.deletion
+
+STATUSES = {"SUCCESS": 1, "FAILED": 2}
+SMTP_OK = 250
+BATCH_SIZE = 5000
+
+# Код ответа в тексте исключений smtplib: "(451, b'...')" или "{'a@b.c': (550, b'...')}".
+REPLY_CODE_RE = re.compile(r"\((\d{3}),")
+
+
+def reason_key(text):
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big", signed=True)
+
+
+def reply_code(text):
+    match = REPLY_CODE_RE.search(text)
+    return int(match.group(1)) if match else None
+
+
+def id_ranges(queryset, size=BATCH_SIZE):
+    """Полуоткрытые диапазоны ``[start, stop)`` по id с шагом ``size``."""
+    bounds = queryset.aggregate(low=Min("id"), high=Max("id"))
+    if bounds["low"] is None:
+        return
+    for start in range(bounds["low"], bounds["high"] + 1, size):
+        yield start, start + size
+
+
+def compact_attempts(apps, schema_editor):
+    MailAttempt = apps.get_model("mailings", "MailAttempt")
+    MailAttemptRollup = apps.get_model("mailings", "MailAttemptRollup")
+    FailureReason = apps.get_model("mailings", "FailureReason")
+
+    for start, stop in id_ranges(MailAttempt.objects.all()):
+        with transaction.atomic():
+            batch = MailAttempt.objects.filter(id__gte=start, id__lt=stop)
+            for name, value in STATUSES.items():
+                batch.filter(status_name=name).update(status=value)
+            batch.filter(status=STATUSES["SUCCESS"]).update(smtp_code=SMTP_OK)
+            # Одинаковые тексты ошибок в пачке обновляются одним запросом.
+            groups = defaultdict(list)
+            for pk, text in batch.filter(status=STATUSES["FAILED"]).values_list("id", "response"):
+                groups[text].append(pk)
+            FailureReason.objects.bulk_create(
+                [FailureReason(id=reason_key(text), text=text) for text in groups if text], ignore_conflicts=True,
+            )
+            for text, ids in groups.items():
+                MailAttempt.objects.filter(id__in=ids).update(
+                    failure_id=reason_key(text) if text else None, smtp_code=reply_code(text),
+                )
+
+    for start, stop in id_ranges(MailAttemptRollup.objects.all()):
+        with transaction.atomic():
+            batch = MailAttemptRollup.objects.filter(id__gte=start, id__lt=stop)
+            for name, value in STATUSES.items():
+                batch.filter(status_name=name).update(status=value)
+
+
+def expand_attempts(apps, schema_editor):
+    MailAttempt = apps.get_model("mailings", "MailAttempt")
+    MailAttemptRollup = apps.get_model("mailings", "MailAttemptRollup")
+    FailureReason = apps.get_model("mailings", "FailureReason")
+
+    for start, stop in id_ranges(MailAttempt.objects.all()):
+        with transaction.atomic():
+            batch = MailAttempt.objects.filter(id__gte=start, id__lt=stop)
+            for name, value in STATUSES.items():
+                batch.filter(status=value).update(status_name=name)
+            batch.filter(status=STATUSES["SUCCESS"]).update(response="OK")
+            batch.filter(failure__isnull=False).update(
+                response=Subquery(FailureReason.objects.filter(id=OuterRef("failure_id")).values("text")[:1])
+            )
+
+    for start, stop in id_ranges(MailAttemptRollup.objects.all()):
+        with transaction.atomic():
+            batch = MailAttemptRollup.objects.filter(id__gte=start, id__lt=stop)
+            for name, value in STATUSES.items():
+                batch.filter(status=value).update(status_name=name)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('mailings', '0012_mailattemptrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailureReason',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('text', models.TextField()),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='mailattempt',
+            name='mailings_ma_mailing_e824ef_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mailattempt',
+            name='mailings_ma_mailing_22122f_idx',
+        ),
+        migrations.RemoveConstraint(
+            model_name='mailattemptrollup',
+            name='unique_attempt_rollup',
+        ),
+        migrations.RenameField(
+            model_name='mailattempt',
+            old_name='status',
+            new_name='status_name',
+        ),
+        migrations.RenameField(
+            model_name='mailattemptrollup',
+            old_name='status',
+            new_name='status_name',
+        ),
+        # Старые столбцы допускают NULL, чтобы при откате их можно было
+        # создать заново до заполнения данными.
+        migrations.AlterField(
+            model_name='mailattempt',
+            name='status_name',
+            field=models.CharField(max_length=20, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mailattemptrollup',
+            name='status_name',
+            field=models.CharField(max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailattempt',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Успешно'), (2, 'Не успешно')], null=True),
+        ),
+        migrations.AddField(
+            model_name='mailattempt',
+            name='smtp_code',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailattempt',
+            name='failure',
+            field=models.ForeignKey(
+                blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT,
+                related_name='+', to='mailings.failurereason',
+            ),
+        ),
+        migrations.AddField(
+            model_name='mailattemptrollup',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Успешно'), (2, 'Не успешно')], null=True),
+        ),
+        migrations.RunPython(compact_attempts, expand_attempts),
+        migrations.AlterField(
+            model_name='mailattempt',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Успешно'), (2, 'Не успешно')]),
+        ),
+        migrations.AlterField(
+            model_name='mailattemptrollup',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Успешно'), (2, 'Не успешно')]),
+        ),
+        migrations.RemoveField(
+            model_name='mailattempt',
+            name='status_name',
+        ),
+        migrations.RemoveField(
+            model_name='mailattempt',
+            name='response',
+        ),
+        migrations.RemoveField(
+            model_name='mailattemptrollup',
+            name='status_name',
+        ),
+        migrations.AddIndex(
+            model_name='mailattempt',
+            index=models.Index(fields=['mailing', 'recipient', 'status'], name='mailings_ma_mailing_e824ef_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailattempt',
+            index=models.Index(fields=['mailing', 'status'], name='mailings_ma_mailing_22122f_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='mailattemptrollup',
+            constraint=models.UniqueConstraint(fields=('mailing', 'day', 'status'), name='unique_attempt_rollup'),
+        ),
+    ]
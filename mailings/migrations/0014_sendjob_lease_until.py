@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0013_compact_mailattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendjob',
+            name='lease_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
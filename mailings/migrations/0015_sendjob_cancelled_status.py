@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0014_sendjob_lease_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sendjob',
+            name='status',
+            field=models.CharField(choices=[('QUEUED', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Выполнена'), ('FAILED', 'Ошибка'), ('CANCELLED', 'Отменена')], default='QUEUED', max_length=20),
+        ),
+    ]
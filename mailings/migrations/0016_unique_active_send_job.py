@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+ACTIVE_JOB_STATUSES = ("QUEUED", "RUNNING")
+
+
+def cancel_duplicate_jobs(apps, schema_editor):
+    """Оставляет у рассылки одну активную задачу: выполняемую, а из ожидающих — самую старую."""
+    SendJob = apps.get_model("mailings", "SendJob")
+    active = SendJob.objects.filter(status__in=ACTIVE_JOB_STATUSES)
+    duplicated = (
+        active.order_by().values("mailing_id").annotate(jobs=Count("id")).filter(jobs__gt=1)
+        .values_list("mailing_id", flat=True)
+    )
+    for mailing_id in list(duplicated):
+        # "RUNNING" > "QUEUED", поэтому выполняемые задачи идут первыми.
+        keep, *extra = active.filter(mailing_id=mailing_id).order_by("-status", "created_at", "id")
+        SendJob.objects.filter(pk__in=[job.pk for job in extra]).update(
+            status="CANCELLED", error="Повторная задача той же рассылки", finished_at=timezone.now(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0015_sendjob_cancelled_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='sendjob',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('status__in', ('QUEUED', 'RUNNING'))), fields=('mailing',),
+                name='unique_active_send_job',
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:26
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+
+def mark_archived(apps, schema_editor):
+    """Отмечает рассылки, у которых уже есть итоги заархивированных попыток."""
+    Mailing = apps.get_model("mailings", "Mailing")
+    MailAttemptRollup = apps.get_model("mailings", "MailAttemptRollup")
+    now = timezone.now()
+    Mailing.objects.filter(Exists(MailAttemptRollup.objects.filter(mailing=OuterRef("pk")))).update(
+        archived_at=now, updated_at=now,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0016_unique_active_send_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_archived, migrations.RunPython.noop),
+    ]
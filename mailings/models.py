@@ -1,6 +1,10 @@
+import hashlib
+
 from django.db import models
 from django.conf import settings
 
+from .templating import validate_placeholders
+
 
 class Recipient(models.Model):
     email = models.EmailField(unique=True)
@@ -24,11 +28,65 @@ class Recipient(models.Model):
             ("can_change_recipient", "Can change recipient"),
             ("can_delete_recipient", "Can delete recipient"),
         ]
+        indexes = [
+            models.Index(fields=["owner", "created_at", "id"]),
+        ]
+
+
+class RecipientSegment(models.Model):
+    """Сохранённый фильтр по получателям владельца.
+
+    Рассылка с сегментом хранит одну ссылку вместо строки M2M на каждого
+    получателя; список разрешается в queryset только во время отправки.
+    """
+    name = models.CharField(max_length=255)
+    comment_contains = models.CharField(
+        max_length=255, blank=True, help_text="Тег или слово в комментарии получателя"
+    )
+    domain = models.CharField(max_length=255, blank=True, help_text="Домен email, например example.com")
+    created_after = models.DateTimeField(null=True, blank=True)
+    created_before = models.DateTimeField(null=True, blank=True)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="segments"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def recipients(self):
+        recipients = Recipient.objects.filter(owner_id=self.owner_id)
+        if self.comment_contains:
+            recipients = recipients.filter(comment__icontains=self.comment_contains)
+        if self.domain:
+            recipients = recipients.filter(email__iendswith="@" + self.domain.lstrip("@"))
+        if self.created_after:
+            recipients = recipients.filter(created_at__gte=self.created_after)
+        if self.created_before:
+            recipients = recipients.filter(created_at__lt=self.created_before)
+        return recipients
+
+    class Meta:
+        permissions = [
+            ("can_view_recipientsegment", "Can view recipient segment"),
+            ("can_add_recipientsegment", "Can add recipient segment"),
+            ("can_change_recipientsegment", "Can change recipient segment"),
+            ("can_delete_recipientsegment", "Can delete recipient segment"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "created_at", "id"]),
+        ]
 
 
 class Message(models.Model):
-    subject = models.CharField(max_length=255)
-    body = models.TextField()
+    subject = models.CharField(max_length=255, validators=[validate_placeholders])
+    body = models.TextField(
+        validators=[validate_placeholders],
+        help_text="Можно подставлять поля получателя: {{ full_name }}, {{ email }}, {{ comment }}"
+    )
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -47,6 +105,27 @@ class Message(models.Model):
             ("can_change_message", "Can change message"),
             ("can_delete_message", "Can delete message"),
         ]
+        indexes = [
+            models.Index(fields=["owner", "created_at", "id"]),
+        ]
+
+
+# Незавершённые рассылки. Частичные индексы Mailing построены с этим
+# условием, и планировщик использует их, только если оно есть в запросе.
+ACTIVE_MAILINGS = ~models.Q(status="FINISHED")
+
+
+class MailingQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(ACTIVE_MAILINGS)
+
+    def due(self, now):
+        """Созданные рассылки, время старта которых наступило."""
+        return self.active().filter(status="CREATED", start_at__lte=now, end_at__gt=now, archived_at__isnull=True)
+
+    def expired(self, now):
+        """Незавершённые рассылки, у которых прошло время окончания."""
+        return self.active().filter(end_at__lte=now)
 
 
 class Mailing(models.Model):
@@ -60,7 +139,21 @@ class Mailing(models.Model):
     end_at = models.DateTimeField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="CREATED")
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name="mailings")
-    recipients = models.ManyToManyField(Recipient, related_name="mailings")
+    recipients = models.ManyToManyField(Recipient, related_name="mailings", blank=True)
+    segment = models.ForeignKey(
+        RecipientSegment,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="mailings"
+    )
+    # Последний получатель (по id), до которого включительно прерванная
+    # отправка уже всё записала; следующий запуск продолжит с него.
+    checkpoint_recipient_id = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # Когда попытки рассылки впервые ушли в архив (``archive_attempts``).
+    # От них остались только итоги по дням, и отправка уже не знает, кому
+    # письмо доставлено, поэтому заархивированную рассылку не отправить снова.
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False)
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -69,9 +162,17 @@ class Mailing(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = MailingQuerySet.as_manager()
+
     def __str__(self):
         return f"Mailing {self.id} ({self.get_status_display()})"
 
+    def audience(self):
+        """Получатели рассылки: сегмент, если он задан, иначе явный список."""
+        if self.segment_id:
+            return self.segment.recipients()
+        return self.recipients.all()
+
     class Meta:
         permissions = [
             ("can_view_mailing", "Can view mailing"),
@@ -80,19 +181,62 @@ class Mailing(models.Model):
             ("can_delete_mailing", "Can delete mailing"),
             ("can_send_mailing", "Can send mailing"),
         ]
+        indexes = [
+            # Завершённые рассылки планировщику не нужны и в индексы не попадают.
+            models.Index(fields=["status", "start_at"], condition=ACTIVE_MAILINGS, name="mailing_active_start_idx"),
+            models.Index(fields=["end_at"], condition=ACTIVE_MAILINGS, name="mailing_active_end_idx"),
+            models.Index(
+                fields=["owner", "status", "start_at"], condition=ACTIVE_MAILINGS, name="mailing_owner_active_idx",
+            ),
+            models.Index(fields=["owner", "created_at", "id"]),
+        ]
 
 
-class MailAttempt(models.Model):
-    STATUS_CHOICES = [
-        ("SUCCESS", "Успешно"),
-        ("FAILED", "Не успешно"),
-    ]
+class AttemptStatus(models.IntegerChoices):
+    SUCCESS = 1, "Успешно"
+    FAILED = 2, "Не успешно"
+
+
+class FailureReason(models.Model):
+    """Текст ошибки отправки, один на все попытки с таким же текстом.
+
+    Ключ — первые 8 байт SHA-256 текста: его можно вычислить без запроса
+    к БД и вставлять причины вместе с попытками через ``ignore_conflicts``.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    text = models.TextField()
+
+    def __str__(self):
+        return self.text[:100]
 
+    @staticmethod
+    def key(text):
+        return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big", signed=True)
+
+    @classmethod
+    def intern(cls, text):
+        """Несохранённая причина с вычисленным ключом; для пустого текста — None."""
+        if not text:
+            return None
+        return cls(id=cls.key(text), text=text)
+
+
+class MailAttempt(models.Model):
     mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name="attempts")
     recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE, related_name="attempts")
     attempted_at = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
-    response = models.TextField(blank=True)
+    status = models.PositiveSmallIntegerField(choices=AttemptStatus.choices)
+    # Код ответа SMTP; пусто, если сервер не ответил (обрыв, таймаут).
+    smtp_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    # Причины не удаляются, поэтому обратный индекс по ним не нужен.
+    failure = models.ForeignKey(
+        FailureReason,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="+",
+        db_index=False
+    )
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -102,7 +246,131 @@ class MailAttempt(models.Model):
     def __str__(self):
         return f"Attempt {self.id} — {self.get_status_display()}"
 
+    @property
+    def response(self):
+        """Ответ в прежнем виде: «OK» у успешной попытки, иначе текст ошибки."""
+        if self.status == AttemptStatus.SUCCESS:
+            return "OK"
+        return self.failure.text if self.failure_id else ""
+
     class Meta:
         permissions = [
             ("can_view_mailattempt", "Can view mail attempt"),
-        ]
\ No newline at end of file
+        ]
+        indexes = [
+            models.Index(fields=["mailing", "recipient", "status"]),
+            models.Index(fields=["mailing", "status"]),
+            models.Index(fields=["owner", "attempted_at", "id"]),
+            models.Index(fields=["attempted_at", "id"]),
+        ]
+
+
+# Статусы незавершённой задачи отправки; у рассылки такая задача может быть только одна.
+ACTIVE_JOB_STATUSES = ("QUEUED", "RUNNING")
+
+
+class SendJob(models.Model):
+    STATUS_CHOICES = [
+        ("QUEUED", "В очереди"),
+        ("RUNNING", "Выполняется"),
+        ("DONE", "Выполнена"),
+        ("FAILED", "Ошибка"),
+        ("CANCELLED", "Отменена"),
+    ]
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name="jobs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="QUEUED")
+    processed = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+    # До какого момента задача закреплена за воркером. Воркер продлевает
+    # аренду при каждом сбросе попыток; задачу с истёкшей арендой может
+    # забрать другой воркер.
+    lease_until = models.DateTimeField(null=True, blank=True)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="send_jobs"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Job {self.id} — {self.get_status_display()}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["mailing"], condition=models.Q(status__in=ACTIVE_JOB_STATUSES), name="unique_active_send_job",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["owner", "created_at", "id"]),
+        ]
+
+
+class MailRetry(models.Model):
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name="retries")
+    recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE, related_name="retries")
+    attempts = models.PositiveSmallIntegerField(default=1)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Retry {self.mailing_id}/{self.recipient_id} #{self.attempts}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["mailing", "recipient"], name="unique_mail_retry"),
+        ]
+        indexes = [
+            models.Index(fields=["next_attempt_at"]),
+        ]
+
+
+class MailingStats(models.Model):
+    """Итоги рассылки, которые отправка обновляет на каждом сбросе буфера попыток."""
+    mailing = models.OneToOneField(Mailing, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    sent = models.PositiveIntegerField(default=0)
+    success = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    recipients_reached = models.PositiveIntegerField(default=0)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for mailing {self.mailing_id}"
+
+
+class MailAttemptRollup(models.Model):
+    """Итоги заархивированных попыток рассылки за день с одним статусом.
+
+    Строки ``MailAttempt`` старше срока хранения сворачиваются сюда
+    командой ``archive_attempts`` и удаляются.
+    """
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name="rollups")
+    day = models.DateField()
+    status = models.PositiveSmallIntegerField(choices=AttemptStatus.choices)
+    count = models.PositiveIntegerField(default=0)
+    last_attempt_at = models.DateTimeField()
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="attempt_rollups"
+    )
+
+    def __str__(self):
+        return f"Rollup {self.mailing_id} {self.day} {self.status}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["mailing", "day", "status"], name="unique_attempt_rollup"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "day"]),
+        ]
@@ -0,0 +1,132 @@
+import base64
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class Keyset:
+    """Keyset-пагинация по индексированному набору полей, например ``("-created_at", "-id")``.
+
+    Курсор хранит значения ключа крайней строки страницы, и следующая
+    страница выбирается условием ``(created_at, id) < (...)`` вместо OFFSET,
+    поэтому стоимость страницы не зависит от её глубины.
+    """
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+        self.fields = [name.lstrip("-") for name in ordering]
+
+    def encode(self, row, reverse):
+        values = [getattr(row, field) for field in self.fields]
+        data = {"k": [value.isoformat() if hasattr(value, "isoformat") else value for value in values]}
+        if reverse:
+            data["r"] = 1
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def decode(self, cursor, model):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(data["k"]) != len(self.fields):
+                raise InvalidCursor(cursor)
+            values = [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, data["k"])]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise InvalidCursor(cursor)
+        return values, bool(data.get("r"))
+
+    def after(self, values, ordering):
+        """Условие «строка идёт после ``values``» для порядка ``ordering``."""
+        conditions = []
+        for index, name in enumerate(ordering):
+            field = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") else "gt"
+            equal = {self.fields[i]: values[i] for i in range(index)}
+            conditions.append(Q(**equal, **{f"{field}__{lookup}": values[index]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def page(self, queryset, cursor, page_size):
+        """Возвращает ``(rows, next_cursor, previous_cursor)``."""
+        reverse = False
+        ordering = self.ordering
+        if cursor:
+            values, reverse = self.decode(cursor, queryset.model)
+            if reverse:
+                ordering = [name[1:] if name.startswith("-") else f"-{name}" for name in ordering]
+            queryset = queryset.filter(self.after(values, ordering))
+        rows = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        if not rows:
+            return rows, None, None
+        has_next = has_more or reverse
+        has_previous = has_more if reverse else bool(cursor)
+        next_cursor = self.encode(rows[-1], reverse=False) if has_next else None
+        previous_cursor = self.encode(rows[0], reverse=True) if has_previous else None
+        return rows, next_cursor, previous_cursor
+
+
+class KeysetPagination(BasePagination):
+    """DRF-пагинация на основе ``Keyset``; по умолчанию — по (created_at, id)."""
+
+    ordering = ("-created_at", "-id")
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            rows, self.next_cursor, self.previous_cursor = Keyset(self.ordering).page(
+                queryset, request.query_params.get(self.cursor_query_param), page_size
+            )
+        except InvalidCursor:
+            raise NotFound("Неверный курсор.")
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_link(self.next_cursor),
+            "previous": self.get_link(self.previous_cursor),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class AttemptKeysetPagination(KeysetPagination):
+    ordering = ("-attempted_at", "-id")
@@ -0,0 +1,178 @@
+"""Проверка планов основных запросов на полное сканирование таблиц.
+
+Для querysets страниц, эндпоинтов API и фоновых задач выполняется
+EXPLAIN, и в плане ищется последовательное сканирование таблиц
+приложения. В PostgreSQL на время проверки выключается
+``enable_seqscan``: на маленькой тестовой базе планировщик иначе выбирает
+Seq Scan даже при подходящем индексе, а так он остаётся только там, где
+индекса нет. Используется командой ``check_query_plans``.
+
+Для EXPLAIN данные не нужны: querysets строятся для несохранённых
+владельца и рассылки (``plan_subjects``), и проверка ничего не пишет в базу.
+"""
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import HttpRequest
+from django.utils import timezone
+from rest_framework.request import Request
+
+from .exports import filter_attempts
+from .models import MailAttempt, Mailing, MailRetry
+from .pagination import Keyset, KeysetPagination
+from .services import claimable_jobs, remaining_recipients
+from .views import (
+    MailAttemptListView, MailAttemptViewSet, MailingListView, MailingViewSet, MessageListView, MessageViewSet,
+    RecipientListView, RecipientSegmentListView, RecipientSegmentViewSet, RecipientViewSet, SendJobViewSet,
+)
+
+# Строка плана с полным сканированием таблицы: имя таблицы в первой группе.
+SEQ_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"\bSCAN (\w+)(?! USING)(?:\s|$)"),
+}
+
+
+class UnsupportedDatabase(Exception):
+    pass
+
+
+@dataclass
+class PlanCheck:
+    name: str
+    build: Callable
+
+
+def app_tables():
+    """Таблицы моделей приложения, включая промежуточные таблицы M2M."""
+    tables = set()
+    for model in apps.get_app_config("mailings").get_models(include_auto_created=True):
+        tables.add(model._meta.db_table)
+    return tables
+
+
+def plan_subjects():
+    """Несохранённые владелец и рассылка, для которых строятся querysets проверок."""
+    owner = get_user_model()(pk=0, email="query-plans@example.invalid")
+    now = timezone.now()
+    mailing = Mailing(pk=0, owner=owner, start_at=now, end_at=now)
+    return owner, mailing
+
+
+def request_for(user):
+    request = HttpRequest()
+    request.method = "GET"
+    request.user = user
+    return request
+
+
+def sample_value(model, field):
+    """Значение поля ключа пагинации для курсора, указывающего в середину списка."""
+    if model._meta.get_field(field).get_internal_type() == "DateTimeField":
+        return timezone.now()
+    return 0
+
+
+def list_view_page(view_class):
+    """Первая страница веб-списка в том виде, как её выбирает ``KeysetPaginationMixin``."""
+    def build(owner, mailing):
+        view = view_class()
+        view.setup(request_for(owner))
+        return view.get_queryset().order_by(*view.keyset_ordering)[:view.page_size + 1]
+    return build
+
+
+def viewset_page(viewset_class, cursor=False):
+    """Страница списка API; с ``cursor=True`` — не первая, а следующая по курсору."""
+    def build(owner, mailing):
+        request = Request(request_for(owner))
+        request.user = owner
+        view = viewset_class(request=request, action="list", kwargs={}, format_kwarg=None)
+        queryset = view.filter_queryset(view.get_queryset())
+        pagination = view.pagination_class or KeysetPagination
+        ordering = pagination.ordering
+        if cursor:
+            keyset = Keyset(ordering)
+            values = [sample_value(queryset.model, field) for field in keyset.fields]
+            queryset = queryset.filter(keyset.after(values, ordering))
+        return queryset.order_by(*ordering)[:pagination.page_size + 1]
+    return build
+
+
+CHECKS = [
+    PlanCheck("messages_list", list_view_page(MessageListView)),
+    PlanCheck("recipients_list", list_view_page(RecipientListView)),
+    PlanCheck("segments_list", list_view_page(RecipientSegmentListView)),
+    PlanCheck("mailings_list", list_view_page(MailingListView)),
+    PlanCheck("attempts_list", list_view_page(MailAttemptListView)),
+    PlanCheck(
+        "mailing_detail_attempts",
+        lambda owner, mailing: mailing.attempts.select_related("recipient", "failure").order_by(
+            "-attempted_at", "-id"
+        )[:50],
+    ),
+    PlanCheck("api_recipients", viewset_page(RecipientViewSet)),
+    PlanCheck("api_segments", viewset_page(RecipientSegmentViewSet)),
+    PlanCheck("api_messages", viewset_page(MessageViewSet)),
+    PlanCheck("api_mailings", viewset_page(MailingViewSet)),
+    PlanCheck("api_mailings_cursor", viewset_page(MailingViewSet, cursor=True)),
+    PlanCheck("api_attempts", viewset_page(MailAttemptViewSet)),
+    PlanCheck("api_attempts_cursor", viewset_page(MailAttemptViewSet, cursor=True)),
+    PlanCheck("api_jobs", viewset_page(SendJobViewSet)),
+    PlanCheck(
+        "export_owner_since",
+        lambda owner, mailing: filter_attempts(
+            MailAttempt.objects.filter(owner=owner), since=timezone.localdate().isoformat()
+        ).order_by("id"),
+    ),
+    PlanCheck(
+        "export_mailing_status",
+        lambda owner, mailing: filter_attempts(mailing.attempts.all(), status="FAILED").order_by("id"),
+    ),
+    PlanCheck("remaining_recipients", lambda owner, mailing: remaining_recipients(mailing)),
+    PlanCheck(
+        "owner_active_mailings",
+        lambda owner, mailing: Mailing.objects.active().filter(owner=owner, status="RUNNING").order_by("start_at"),
+    ),
+    PlanCheck("due_mailings", lambda owner, mailing: Mailing.objects.due(timezone.now()).order_by("start_at")),
+    PlanCheck("expired_mailings", lambda owner, mailing: Mailing.objects.expired(timezone.now())),
+    PlanCheck("claimable_jobs", lambda owner, mailing: claimable_jobs(timezone.now()).order_by("created_at")),
+    PlanCheck(
+        "due_retries",
+        lambda owner, mailing: MailRetry.objects.filter(
+            next_attempt_at__lte=timezone.now()
+        ).order_by("next_attempt_at"),
+    ),
+]
+
+
+def seq_scans(plan, vendor=None):
+    """Таблицы приложения, которые план читает полным сканированием."""
+    vendor = vendor or connection.vendor
+    pattern = SEQ_SCAN_PATTERNS.get(vendor)
+    if pattern is None:
+        raise UnsupportedDatabase(f"Проверка планов не поддерживает {vendor}")
+    tables = app_tables()
+    return sorted({table for table in pattern.findall(plan) if table in tables})
+
+
+def check_plans(owner, mailing, checks=CHECKS):
+    """Возвращает ``(проверка, план, таблицы с полным сканированием)``.
+
+    Вызывается внутри транзакции: в PostgreSQL ``SET LOCAL`` действует до
+    её конца.
+    """
+    if connection.vendor not in SEQ_SCAN_PATTERNS:
+        raise UnsupportedDatabase(f"Проверка планов не поддерживает {connection.vendor}")
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+    results = []
+    for check in checks:
+        plan = check.build(owner, mailing).explain()
+        results.append((check, plan, seq_scans(plan)))
+    return results
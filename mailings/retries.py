@@ -0,0 +1,105 @@
+import random
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import AttemptStatus, MailAttempt, MailRetry
+
+# Код ответа SMTP на принятое письмо.
+SMTP_OK = 250
+
+
+def refused_codes(error):
+    """Коды отказа по отдельным адресам из ``SMTPRecipientsRefused``."""
+    refused = getattr(error, "recipients", None)
+    if not refused:
+        return []
+    # smtplib: {адрес: (код, текст)}, aiosmtplib: [SMTPRecipientRefused, ...]
+    items = refused.values() if isinstance(refused, dict) else refused
+    return [item[0] if isinstance(item, tuple) else getattr(item, "code", None) for item in items]
+
+
+def reply_code(error):
+    """Код ответа SMTP, с которым закончилась отправка, или None для сетевых ошибок."""
+    code = getattr(error, "smtp_code", None) or getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    return next((code for code in refused_codes(error) if isinstance(code, int)), None)
+
+
+def is_transient(error):
+    """Можно ли повторить отправку после ``error``.
+
+    Временными считаются ответы 4xx и сетевые ошибки (обрыв, таймаут);
+    постоянными — ответы 5xx и всё остальное. Понимает исключения как
+    smtplib, так и aiosmtplib.
+    """
+    code = getattr(error, "smtp_code", None) or getattr(error, "code", None)
+    if isinstance(code, int):
+        return 400 <= code < 500
+    codes = refused_codes(error)
+    if codes:
+        return all(isinstance(code, int) and 400 <= code < 500 for code in codes)
+    # Все исключения smtplib наследуют OSError, но без кода ответа временным
+    # бывает только обрыв соединения: например, SMTPNotSupportedError
+    # («SMTPUTF8 не поддерживается») повтор не исправит.
+    if isinstance(error, smtplib.SMTPException):
+        return isinstance(error, smtplib.SMTPServerDisconnected)
+    return isinstance(error, OSError)
+
+
+def backoff_delay(attempts):
+    """Экспоненциальная задержка перед повтором номер ``attempts`` с джиттером.
+
+    Половина задержки фиксирована, половина случайна, чтобы повторы
+    одной неудачной пачки не приходили к серверу одновременно.
+    """
+    delay = min(settings.MAILING_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.MAILING_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def schedule_retries(mailing, attempts, retry_counts):
+    """Обновляет очередь повторов по записанным попыткам рассылки.
+
+    Временные ошибки (пока не исчерпан ``MAILING_RETRY_MAX_ATTEMPTS``)
+    планируются на повтор; для успешных и окончательно неудачных
+    получателей повторы удаляются. ``retry_counts`` — сколько раз каждый
+    получатель уже стоял в очереди повторов.
+    """
+    now = timezone.now()
+    retries = []
+    finished = []
+    for attempt in attempts:
+        tries = retry_counts.get(attempt.recipient_id, 0) + 1
+        if getattr(attempt, "retryable", False) and tries <= settings.MAILING_RETRY_MAX_ATTEMPTS:
+            retries.append(MailRetry(
+                mailing=mailing,
+                recipient_id=attempt.recipient_id,
+                attempts=tries,
+                next_attempt_at=now + backoff_delay(tries),
+                last_error=attempt.response,
+            ))
+        elif attempt.recipient_id in retry_counts:
+            finished.append(attempt.recipient_id)
+    if finished:
+        MailRetry.objects.filter(mailing=mailing, recipient_id__in=finished).delete()
+    if retries:
+        MailRetry.objects.bulk_create(
+            retries,
+            update_conflicts=True,
+            unique_fields=["mailing", "recipient"],
+            update_fields=["attempts", "next_attempt_at", "last_error"],
+        )
+
+
+def drop_stale_retries(mailing):
+    """Удаляет повторы получателей, которым рассылка уже доставлена или которых в ней больше нет."""
+    delivered = MailAttempt.objects.filter(
+        mailing=mailing, recipient=OuterRef("recipient"), status=AttemptStatus.SUCCESS,
+    )
+    return MailRetry.objects.filter(mailing=mailing).filter(
+        Q(Exists(delivered)) | ~Q(recipient__in=mailing.audience())
+    ).delete()[0]
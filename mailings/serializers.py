@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Recipient, Message, Mailing, MailAttempt
+from .models import Recipient, RecipientSegment, Message, Mailing, MailingStats, MailAttempt, SendJob, AttemptStatus
 
 
 class RecipientSerializer(serializers.ModelSerializer):
@@ -9,6 +9,13 @@ class RecipientSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "created_at", "updated_at", "owner")
 
 
+class RecipientSegmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RecipientSegment
+        fields = "__all__"
+        read_only_fields = ("id", "created_at", "updated_at", "owner")
+
+
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
@@ -22,9 +29,57 @@ class MailingSerializer(serializers.ModelSerializer):
         fields = "__all__"
         read_only_fields = ("id", "created_at", "updated_at", "owner")
 
+    def validate_segment(self, segment):
+        user = self.context["request"].user
+        if segment is not None and not user.is_staff and segment.owner_id != user.pk:
+            raise serializers.ValidationError("Сегмент не найден.")
+        return segment
+
+    def validate(self, attrs):
+        instance = self.instance
+        segment = attrs["segment"] if "segment" in attrs else getattr(instance, "segment", None)
+        if "recipients" in attrs:
+            has_recipients = bool(attrs["recipients"])
+        else:
+            has_recipients = instance is not None and instance.recipients.exists()
+        # Пустая рассылка допустима: получателей можно добавить позже импортом.
+        if segment and has_recipients:
+            raise serializers.ValidationError("Укажите либо сегмент, либо получателей.")
+        return attrs
+
+
+class MailingStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MailingStats
+        fields = ("mailing", "sent", "success", "failed", "recipients_reached", "last_attempt_at", "updated_at")
+        read_only_fields = fields
+
+
+class DailyStatsSerializer(serializers.Serializer):
+    day = serializers.DateField()
+    success = serializers.IntegerField()
+    failed = serializers.IntegerField()
+
 
 class MailAttemptSerializer(serializers.ModelSerializer):
+    # Статус и ответ отдаются в прежнем виде: "SUCCESS"/"FAILED" и текст ошибки.
+    status = serializers.SerializerMethodField()
+    response = serializers.CharField(read_only=True)
+
     class Meta:
         model = MailAttempt
-        fields = "__all__"
+        fields = ("id", "mailing", "recipient", "attempted_at", "status", "response", "smtp_code", "owner")
         read_only_fields = ("id", "attempted_at", "owner")
+
+    def get_status(self, attempt):
+        return AttemptStatus(attempt.status).name
+
+
+class SendJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SendJob
+        fields = (
+            "id", "mailing", "status", "processed", "succeeded", "failed",
+            "error", "created_at", "started_at", "finished_at",
+        )
+        read_only_fields = fields
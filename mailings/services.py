@@ -0,0 +1,648 @@
+import multiprocessing
+import os
+import queue
+import smtplib
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import wait as wait_futures
+from collections import defaultdict, deque
+from datetime import timedelta
+from contextlib import suppress
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db import connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from .models import ACTIVE_JOB_STATUSES, AttemptStatus, FailureReason, MailAttempt, Mailing, MailRetry, SendJob
+from .caching import bump_versions
+from .metrics import Metrics, report
+from .retries import SMTP_OK, drop_stale_retries, is_transient, reply_code, schedule_retries
+from .stats import record_stats
+from .templating import compile_message
+from .throttling import DomainQueue, DomainThrottle, email_domain
+
+# Сколько пачек получателей держать в памяти для чередования доменов.
+INTERLEAVE_BATCHES = 10
+
+EXPIRED_ERROR = "Рассылка завершена: наступило время окончания"
+ARCHIVED_ERROR = "Попытки рассылки заархивированы, повторная отправка невозможна"
+
+
+class MailingArchivedError(ValueError):
+    pass
+
+
+class DispatchMessage(EmailMessage):
+    """Письмо одному получателю рассылки."""
+
+    def __init__(self, recipient, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recipient = recipient
+        self.domain = email_domain(recipient.email)
+
+
+class CompiledDispatchMessage(DispatchMessage):
+    """Письмо, собранное из заранее скомпилированного сообщения рассылки.
+
+    ``message()`` подставляет данные получателя в готовые куски вместо
+    построения MIME-объекта с нуля.
+    """
+
+    def __init__(self, recipient, compiled):
+        super().__init__(recipient, from_email=compiled.from_email, to=[recipient.email])
+        self.compiled = compiled
+
+    def message(self):
+        return self.compiled.render(self.recipient)
+
+
+class AttemptBuffer:
+    """Копит попытки отправки и сохраняет их одним ``bulk_create``.
+
+    Буфер сбрасывается каждые ``size`` записей или ``interval`` секунд,
+    поэтому при падении процесса теряется не больше одного буфера.
+    ``on_flush`` вызывается внутри той же транзакции; время записи
+    учитывается в фазе ``persist`` переданных ``metrics``.
+    """
+
+    def __init__(self, size=None, interval=None, on_flush=None, metrics=None):
+        self.size = size or settings.MAILING_FLUSH_SIZE
+        self.interval = settings.MAILING_FLUSH_INTERVAL if interval is None else interval
+        self.on_flush = on_flush
+        self.metrics = metrics
+        self.attempts = []
+        self.flushed_at = time.monotonic()
+
+    def add(self, attempt):
+        if self.put(attempt):
+            self.flush()
+
+    def put(self, attempt):
+        """Добавляет попытку без сброса; возвращает True, если пора сбросить буфер."""
+        self.attempts.append(attempt)
+        return self.due()
+
+    def due(self):
+        return len(self.attempts) >= self.size or time.monotonic() - self.flushed_at >= self.interval
+
+    def take(self):
+        attempts, self.attempts = self.attempts, []
+        self.flushed_at = time.monotonic()
+        return attempts
+
+    def flush(self):
+        attempts = self.take()
+        if attempts:
+            self.save(attempts)
+
+    def save(self, attempts):
+        started = time.perf_counter()
+        with transaction.atomic():
+            # Причины вставляются до попыток, уже известные пропускаются.
+            reasons = {attempt.failure_id: attempt.failure for attempt in attempts if attempt.failure_id}
+            if reasons:
+                FailureReason.objects.bulk_create(reasons.values(), ignore_conflicts=True)
+            MailAttempt.objects.bulk_create(attempts)
+            if self.on_flush:
+                self.on_flush(attempts)
+        if self.metrics is not None:
+            self.metrics.observe("persist", time.perf_counter() - started)
+
+
+def remaining_recipients(mailing, after=None):
+    """Получатели рассылки без успешной попытки, по возрастанию id.
+
+    Anti-join через ``NOT EXISTS`` опирается на индекс
+    (mailing, recipient, status) таблицы попыток. У заархивированной
+    рассылки успешных попыток в таблице уже нет, поэтому оставшихся
+    получателей у неё не бывает.
+    """
+    if mailing.archived_at is not None:
+        return mailing.audience().none()
+    delivered = MailAttempt.objects.filter(mailing=mailing, recipient=OuterRef("pk"), status=AttemptStatus.SUCCESS)
+    recipients = mailing.audience().filter(~Exists(delivered)).order_by("pk")
+    if after is not None:
+        recipients = recipients.filter(pk__gt=after)
+    return recipients
+
+
+class MailingDispatcher:
+    """Отправляет рассылку через одно SMTP-соединение на весь прогон.
+
+    Письма уходят пачками по ``batch_size`` (см. ``deliver``);
+    соединение переоткрывается только после ошибки. Попытки копятся
+    в ``AttemptBuffer`` и пишутся в БД пачками; если передан ``job``,
+    вместе с ними обновляется его прогресс.
+
+    Получателям, которым рассылка уже доставлена, письмо повторно не
+    отправляется. С ``checkpoint=True`` при каждом сбросе буфера
+    запоминается, до какого получателя всё записано, и прерванный прогон
+    продолжается с этого места (если не передан ``restart=True``).
+
+    ``shard=(index, count)`` ограничивает прогон получателями с
+    ``id % count == index``; ``finalize=False`` не трогает статус рассылки.
+
+    Каждая пачка адресована одному домену: получатели группируются по
+    доменам, домены чередуются, а ``DomainThrottle`` ограничивает скорость
+    и число одновременных сессий на домен.
+
+    Временные ошибки ставятся в очередь повторов ``MailRetry``. Прогон
+    повторов передаёт ``retry_counts`` — {id получателя: число попыток} —
+    и отправляет только этим получателям.
+
+    Время фаз, коды ответов и итоги по доменам копятся в ``metrics``
+    (см. ``mailings.metrics``) и при каждом сбросе буфера переносятся в
+    реестр процесса.
+
+    Завершённая рассылка или рассылка, у которой наступил ``end_at``, не
+    отправляется: срок проверяется перед каждым получателем, а статус
+    перечитывается из БД при каждом сбросе буфера, так что прогон
+    останавливается и после ``finish_expired_mailings`` в планировщике.
+    """
+
+    def __init__(self, mailing, owner=None, batch_size=None, connection=None, buffer=None, job=None,
+                 checkpoint=True, restart=False, shard=None, finalize=True, throttle=None, retry_counts=None,
+                 metrics=None):
+        self.mailing = mailing
+        self.owner = owner or mailing.owner
+        self.batch_size = batch_size or settings.MAILING_BATCH_SIZE
+        self.connection = connection or get_connection()
+        self.metrics = metrics or Metrics()
+        self.buffer = buffer or AttemptBuffer(on_flush=self.flushed, metrics=self.metrics)
+        self.job = job
+        self.checkpoint = checkpoint
+        self.restart = restart
+        self.shard = shard
+        self.finalize = finalize
+        self.throttle = throttle or DomainThrottle(share=1 / shard[1] if shard else 1)
+        self.retry_counts = retry_counts
+        self.retries_only = retry_counts is not None
+        self.success = 0
+        self.failed = 0
+        # Почему прогон остановлен раньше времени; новые пачки после этого не отправляются.
+        self.stop_reason = None
+        # id получателей в порядке отправки и записанные, но ещё не
+        # вошедшие в непрерывный префикс для контрольной точки. Без
+        # ``checkpoint`` не заполняются, чтобы не копить id всего прогона.
+        self.issued = deque()
+        self.persisted = set()
+
+    def run(self):
+        try:
+            for batch in self.batches():
+                self.send_batch(batch)
+            self.wait()
+        finally:
+            self.close()
+            self.buffer.flush()
+            report(self.metrics)
+        if self.finalize:
+            self.update_status()
+        return self
+
+    def recipients(self):
+        after = None
+        if self.checkpoint and not self.restart:
+            after = self.mailing.checkpoint_recipient_id
+        recipients = remaining_recipients(self.mailing, after=after)
+        if self.shard is not None:
+            index, count = self.shard
+            recipients = recipients.alias(shard=Mod("pk", count)).filter(shard=index)
+        if self.retries_only:
+            recipients = recipients.filter(pk__in=list(self.retry_counts))
+        return recipients
+
+    def batches(self):
+        message = self.mailing.message
+        recipients = self.metrics.timed(self.recipients().iterator(chunk_size=self.batch_size), "fetch")
+        pending = DomainQueue(self.throttle, self.batch_size)
+        for recipient in recipients:
+            if self.should_stop():
+                return
+            if self.checkpoint:
+                self.issued.append(recipient.pk)
+            with self.metrics.timer("build"):
+                email = self.build_message(message, recipient)
+            pending.push(email.domain, email)
+            if len(pending) >= self.batch_size * INTERLEAVE_BATCHES:
+                yield self.next_batch(pending)
+        while pending and not self.should_stop():
+            yield self.next_batch(pending)
+
+    def expired(self):
+        return self.mailing.status == "FINISHED" or self.mailing.end_at <= timezone.now()
+
+    def should_stop(self):
+        if self.stop_reason is None and self.expired():
+            self.stop_reason = "expired"
+        return self.stop_reason is not None
+
+    def next_batch(self, pending):
+        with self.metrics.timer("throttle"):
+            return pending.pop_wait()[1]
+
+    def build_message(self, message, recipient):
+        return CompiledDispatchMessage(recipient, compile_message(message))
+
+    def send_batch(self, batch):
+        try:
+            results = self.deliver(self.connection, batch)
+        finally:
+            self.throttle.release(batch[0].domain)
+        self.record_results(results)
+
+    def deliver(self, connection, batch):
+        started = time.perf_counter()
+        try:
+            return deliver(connection, batch)
+        finally:
+            self.metrics.delivered(batch[0].domain, time.perf_counter() - started)
+
+    def wait(self):
+        pass
+
+    def close(self):
+        disconnect(self.connection)
+
+    def record_results(self, results):
+        for recipient, error in results:
+            self.record(recipient, error)
+
+    def record(self, recipient, error=None):
+        self.buffer.add(self.make_attempt(recipient, error))
+
+    def make_attempt(self, recipient, error=None):
+        self.metrics.result(email_domain(recipient.email), error)
+        if error is None:
+            self.success += 1
+            return MailAttempt(
+                mailing=self.mailing, recipient=recipient, status=AttemptStatus.SUCCESS, smtp_code=SMTP_OK,
+                owner=self.owner,
+            )
+        self.failed += 1
+        attempt = MailAttempt(
+            mailing=self.mailing, recipient=recipient, status=AttemptStatus.FAILED, smtp_code=reply_code(error),
+            failure=FailureReason.intern(str(error)), owner=self.owner,
+        )
+        attempt.retryable = is_transient(error)
+        return attempt
+
+    def flushed(self, attempts):
+        if self.checkpoint:
+            self.save_checkpoint(attempts)
+        # Рассылку мог завершить планировщик, пока шла отправка.
+        if Mailing.objects.filter(pk=self.mailing.pk, status="FINISHED").exists():
+            self.mailing.status = "FINISHED"
+        if self.retry_counts is None:
+            self.retry_counts = dict(
+                MailRetry.objects.filter(mailing=self.mailing).values_list("recipient_id", "attempts")
+            )
+        schedule_retries(self.mailing, attempts, self.retry_counts)
+        record_stats(self.mailing, attempts)
+        # Попытки пишутся через bulk_create, который не шлёт post_save.
+        bump_versions((MailAttempt,), {attempt.owner_id for attempt in attempts})
+        report(self.metrics)
+        if self.job is None:
+            return
+        succeeded = sum(1 for attempt in attempts if attempt.status == AttemptStatus.SUCCESS)
+        progress = dict(
+            processed=F("processed") + len(attempts),
+            succeeded=F("succeeded") + succeeded,
+            failed=F("failed") + len(attempts) - succeeded,
+        )
+        # Вместе с прогрессом продлевается аренда задачи. Если её уже забрал
+        # другой воркер, прогресс засчитывается, но новых писем этот прогон
+        # не отправляет.
+        renewed = SendJob.objects.filter(pk=self.job.pk, worker=self.job.worker).update(
+            lease_until=lease_expiry(), **progress
+        )
+        if not renewed:
+            SendJob.objects.filter(pk=self.job.pk).update(**progress)
+            self.stop_reason = "lease"
+
+    def save_checkpoint(self, attempts):
+        # Пачки завершаются не по порядку, поэтому контрольной точкой
+        # служит конец непрерывного префикса уже записанных получателей.
+        self.persisted.update(attempt.recipient_id for attempt in attempts)
+        checkpoint = None
+        while self.issued and self.issued[0] in self.persisted:
+            checkpoint = self.issued.popleft()
+            self.persisted.discard(checkpoint)
+        if checkpoint is not None:
+            Mailing.objects.filter(pk=self.mailing.pk).update(checkpoint_recipient_id=checkpoint)
+
+    def update_status(self):
+        update_mailing_status(self.mailing, clear_checkpoint=self.checkpoint)
+
+
+class ConcurrentMailingDispatcher(MailingDispatcher):
+    """Отправляет пачки параллельно через пул из ``concurrency`` соединений.
+
+    Каждый поток берёт соединение из пула на время пачки, так что одно
+    соединение никогда не используется двумя потоками сразу. Результаты
+    записываются в буфер в основном потоке по мере готовности пачек.
+    """
+
+    def __init__(self, mailing, concurrency=4, connection_factory=get_connection, **kwargs):
+        kwargs.setdefault("connection", connection_factory())
+        super().__init__(mailing, **kwargs)
+        self.concurrency = concurrency
+        self.pool = queue.Queue()
+        self.pool.put(self.connection)
+        for _ in range(concurrency - 1):
+            self.pool.put(connection_factory())
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="mailing")
+        self.pending = set()
+
+    def send_batch(self, batch):
+        self.pending.add(self.executor.submit(self.deliver_pooled, batch))
+        # Держим в работе не больше двух пачек на поток, чтобы не читать
+        # всех получателей в память заранее.
+        if len(self.pending) >= self.concurrency * 2:
+            done, self.pending = wait_futures(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                self.record_results(future.result())
+
+    def deliver_pooled(self, batch):
+        connection = self.pool.get()
+        try:
+            return self.deliver(connection, batch)
+        finally:
+            self.pool.put(connection)
+            self.throttle.release(batch[0].domain)
+
+    def wait(self):
+        for future in as_completed(self.pending):
+            self.record_results(future.result())
+        self.pending = set()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for future in self.pending:
+            if future.done() and not future.cancelled():
+                self.record_results(future.result())
+        self.pending = set()
+        while not self.pool.empty():
+            disconnect(self.pool.get())
+
+
+class ShardedMailingDispatcher:
+    """Делит получателей на ``workers`` непересекающихся шардов по ``id % workers``.
+
+    Каждый шард отправляется в отдельном процессе со своими соединениями
+    с БД и SMTP; итоговый статус рассылки выставляет родительский процесс.
+    Контрольные точки в этом режиме не ведутся — повторный запуск
+    пропускает уже доставленные письма за счёт anti-join.
+
+    Метрики шардов переносятся в реестры дочерних процессов (и в Redis),
+    а в ``metrics`` родителя собирается только их сумма для ``--profile``.
+    """
+
+    def __init__(self, mailing, workers, owner=None, **kwargs):
+        self.mailing = mailing
+        self.workers = workers
+        self.owner = owner or mailing.owner
+        self.kwargs = kwargs
+        self.success = 0
+        self.failed = 0
+        self.metrics = Metrics()
+        self.stop_reason = None
+
+    def run(self):
+        # Дочерние процессы не должны унаследовать открытые соединения с БД.
+        connections.close_all()
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=django.setup) as executor:
+            futures = [
+                executor.submit(run_shard, self.mailing.pk, self.owner.pk, (index, self.workers), self.kwargs)
+                for index in range(self.workers)
+            ]
+            for future in as_completed(futures):
+                success, failed, metrics, stop_reason = future.result()
+                self.success += success
+                self.failed += failed
+                self.metrics.merge(metrics)
+                self.stop_reason = self.stop_reason or stop_reason
+        update_mailing_status(self.mailing)
+        return self
+
+
+def run_shard(mailing_id, owner_id, shard, kwargs):
+    """Точка входа дочернего процесса ``ShardedMailingDispatcher``."""
+    mailing = Mailing.objects.select_related("message", "segment").get(pk=mailing_id)
+    owner = get_user_model().objects.get(pk=owner_id)
+    try:
+        dispatcher = dispatch_mailing(mailing, owner=owner, shard=shard, checkpoint=False, finalize=False, **kwargs)
+    finally:
+        connections.close_all()
+    return dispatcher.success, dispatcher.failed, dispatcher.metrics.snapshot(), dispatcher.stop_reason
+
+
+def update_mailing_status(mailing, clear_checkpoint=False):
+    """Выставляет статус рассылки по итогам прогона."""
+    if mailing.status == "CREATED":
+        mailing.status = "RUNNING"
+    if mailing.end_at and mailing.end_at < timezone.now():
+        mailing.status = "FINISHED"
+    update_fields = ["status", "updated_at"]
+    if clear_checkpoint:
+        # Прогон дошёл до конца — следующий начнётся с начала списка.
+        mailing.checkpoint_recipient_id = None
+        update_fields.append("checkpoint_recipient_id")
+    mailing.save(update_fields=update_fields)
+
+
+def deliver(connection, batch):
+    """Отправляет пачку ``DispatchMessage`` и возвращает пары (получатель, исключение или None).
+
+    Письма передаются в ``send_messages()`` по одному через уже открытое
+    соединение, поэтому ошибка всегда относится к своему письму — даже
+    если бэкенд упал ещё до сборки MIME, например в ``sanitize_address()``.
+    Отказ сервера принять конкретное письмо не рвёт соединение (smtplib сам
+    делает RSET); после остальных ошибок соединение открывается заново.
+    """
+    results = []
+    for email in batch:
+        try:
+            connection.open()
+            connection.send_messages([email])
+        except Exception as e:
+            results.append((email.recipient, e))
+            if not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                disconnect(connection)
+        else:
+            results.append((email.recipient, None))
+    return results
+
+
+def disconnect(connection):
+    with suppress(Exception):
+        connection.close()
+
+
+def dispatch_mailing(mailing, owner=None, concurrency=1, workers=1, **kwargs):
+    """Отправляет рассылку всем получателям и обновляет её статус."""
+    if workers > 1:
+        dispatcher = ShardedMailingDispatcher(mailing, workers, owner=owner, concurrency=concurrency, **kwargs)
+    elif concurrency > 1:
+        dispatcher = ConcurrentMailingDispatcher(mailing, owner=owner, concurrency=concurrency, **kwargs)
+    else:
+        dispatcher = MailingDispatcher(mailing, owner=owner, **kwargs)
+    return dispatcher.run()
+
+
+def enqueue_mailing(mailing, owner=None):
+    """Ставит отправку рассылки в очередь фонового воркера.
+
+    Если у рассылки уже есть задача в очереди или в работе, возвращается
+    она: повторное нажатие «отправить» не запускает второй параллельный
+    прогон. Гонку двух запросов разрешает ограничение
+    ``unique_active_send_job``, на котором ``get_or_create`` перечитывает
+    уже созданную задачу. Заархивированную рассылку поставить нельзя —
+    ``MailingArchivedError``.
+    """
+    if mailing.archived_at is not None:
+        raise MailingArchivedError(ARCHIVED_ERROR)
+    job, _ = SendJob.objects.get_or_create(
+        mailing=mailing, status__in=ACTIVE_JOB_STATUSES, defaults={"owner_id": owner.pk if owner else mailing.owner_id},
+    )
+    return job
+
+
+def lease_expiry(now=None):
+    return (now or timezone.now()) + timedelta(seconds=settings.MAILING_JOB_LEASE)
+
+
+def claimable_jobs(now):
+    """Задачи в очереди и задачи упавших воркеров, чья аренда истекла."""
+    return SendJob.objects.filter(Q(status="QUEUED") | Q(status="RUNNING", lease_until__lt=now))
+
+
+def claim_job(worker=None):
+    """Забирает самую старую задачу из очереди.
+
+    ``SKIP LOCKED`` позволяет нескольким воркерам на разных узлах разбирать
+    очередь параллельно, не блокируя друг друга. Задача закрепляется за
+    воркером на ``MAILING_JOB_LEASE`` секунд; если воркер упал, после этого
+    срока её заберёт другой и продолжит с контрольной точки.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            claimable_jobs(now).select_for_update(skip_locked=True)
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = "RUNNING"
+        job.worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        job.started_at = now
+        job.lease_until = lease_expiry(now)
+        job.save(update_fields=["status", "worker", "started_at", "lease_until"])
+    return job
+
+
+def run_job(job, **kwargs):
+    """Выполняет задачу отправки и фиксирует её итог.
+
+    Итог записывается, только если задача всё ещё закреплена за этим
+    воркером: после истечения аренды её мог забрать другой.
+    """
+    error = ""
+    try:
+        dispatcher = dispatch_mailing(job.mailing, owner=job.owner, job=job, **kwargs)
+    except Exception as e:
+        status, error = "FAILED", str(e)
+    else:
+        status = "DONE"
+        if dispatcher.stop_reason == "expired":
+            status, error = "CANCELLED", EXPIRED_ERROR
+    SendJob.objects.filter(pk=job.pk, worker=job.worker).update(
+        status=status, error=error, finished_at=timezone.now(), lease_until=None,
+    )
+    job.refresh_from_db()
+    return job
+
+
+def launch_due_mailings(now=None, limit=100):
+    """Ставит в очередь созданные рассылки, время старта которых наступило.
+
+    Рассылки забираются через ``SKIP LOCKED`` и сразу переводятся в RUNNING,
+    поэтому несколько планировщиков не запустят одну рассылку дважды.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        mailings = list(
+            Mailing.objects.select_for_update(skip_locked=True)
+            .due(now)
+            .order_by("start_at")[:limit]
+        )
+        if not mailings:
+            return []
+        Mailing.objects.filter(pk__in=[mailing.pk for mailing in mailings]).update(status="RUNNING", updated_at=now)
+        bump_versions((Mailing,), {mailing.owner_id for mailing in mailings})
+        # Рассылку могли уже отправить вручную — тогда берётся её задача.
+        return [enqueue_mailing(mailing) for mailing in mailings]
+
+
+def finish_expired_mailings(now=None):
+    """Завершает рассылки, у которых прошло время окончания.
+
+    Их задачи, ещё ждущие в очереди, отменяются; уже идущие прогоны
+    останавливаются сами (см. ``MailingDispatcher``).
+    """
+    now = now or timezone.now()
+    expired = Mailing.objects.expired(now)
+    SendJob.objects.filter(mailing__in=expired, status="QUEUED").update(
+        status="CANCELLED", error=EXPIRED_ERROR, finished_at=now,
+    )
+    bump_versions((Mailing,), expired.values_list("owner_id", flat=True).distinct())
+    return expired.update(status="FINISHED", updated_at=now)
+
+
+def claim_due_retries(limit=500, now=None):
+    """Забирает повторы, время которых наступило.
+
+    Забранные повторы сдвигаются на ``MAILING_RETRY_LEASE`` секунд вперёд:
+    если воркер упадёт, они снова станут доступны после этого срока.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        retries = list(
+            MailRetry.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:limit]
+        )
+        if retries:
+            MailRetry.objects.filter(pk__in=[retry.pk for retry in retries]).update(
+                next_attempt_at=now + timedelta(seconds=settings.MAILING_RETRY_LEASE)
+            )
+    return retries
+
+
+def process_due_retries(limit=500, **kwargs):
+    """Повторяет отправку получателям из очереди повторов, по рассылкам.
+
+    Повторы завершённых рассылок отбрасываются. Возвращает число
+    обработанных повторов.
+    """
+    retries = claim_due_retries(limit)
+    by_mailing = defaultdict(dict)
+    for retry in retries:
+        by_mailing[retry.mailing_id][retry.recipient_id] = retry.attempts
+    mailings = Mailing.objects.select_related("message", "owner", "segment").in_bulk(list(by_mailing))
+    for mailing_id, retry_counts in by_mailing.items():
+        mailing = mailings[mailing_id]
+        if mailing.status == "FINISHED" or mailing.end_at < timezone.now():
+            MailRetry.objects.filter(mailing=mailing).delete()
+            continue
+        drop_stale_retries(mailing)
+        dispatch_mailing(mailing, retry_counts=retry_counts, checkpoint=False, finalize=False, **kwargs)
+    return len(retries)
@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .access import invalidate_all, invalidate_user
+from .caching import bump_versions
+from .models import MailAttempt, Mailing, Message, Recipient
+
+# Чьи закэшированные списки устаревают при изменении модели. Удаление
+# получателя или рассылки каскадом удаляет попытки, а в списке попыток
+# виден email получателя. На удаление самих попыток обработчик не вешается:
+# он отключил бы быстрое каскадное удаление, и Django загружал бы каждую
+# попытку в память.
+AFFECTED_MODELS = {
+    Recipient: (Recipient, MailAttempt),
+    Message: (Message, Mailing),
+    Mailing: (Mailing, MailAttempt),
+    MailAttempt: (MailAttempt,),
+}
+
+
+def owner_data_changed(sender, instance, **kwargs):
+    bump_versions(AFFECTED_MODELS[sender], [instance.owner_id])
+
+
+def mailing_recipients_changed(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_versions((Mailing, Recipient), [instance.owner_id])
+
+
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+def user_access_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Изменились группы или права пользователя (с любой стороны связи)."""
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        invalidate_user(instance.pk)
+    elif pk_set:
+        invalidate_user(*pk_set)
+    else:
+        invalidate_all()
+
+
+def group_access_changed(sender, **kwargs):
+    if kwargs.get("action", "post_save") in ("post_save", "post_add", "post_remove", "post_clear"):
+        invalidate_all()
+
+
+def connect_signals():
+    for model in AFFECTED_MODELS:
+        post_save.connect(owner_data_changed, sender=model, dispatch_uid=f"mailings_cache_save_{model.__name__}")
+        if model is not MailAttempt:
+            post_delete.connect(
+                owner_data_changed, sender=model, dispatch_uid=f"mailings_cache_delete_{model.__name__}"
+            )
+    m2m_changed.connect(
+        mailing_recipients_changed, sender=Mailing.recipients.through, dispatch_uid="mailings_cache_m2m"
+    )
+
+    User = get_user_model()
+    post_save.connect(user_changed, sender=User, dispatch_uid="mailings_auth_user")
+    for through in (User.groups.through, User.user_permissions.through):
+        m2m_changed.connect(user_access_changed, sender=through, dispatch_uid=f"mailings_auth_{through.__name__}")
+    post_save.connect(group_access_changed, sender=Group, dispatch_uid="mailings_auth_group_save")
+    post_delete.connect(group_access_changed, sender=Group, dispatch_uid="mailings_auth_group_delete")
+    m2m_changed.connect(
+        group_access_changed, sender=Group.permissions.through, dispatch_uid="mailings_auth_group_perms"
+    )
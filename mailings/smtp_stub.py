@@ -0,0 +1,138 @@
+import base64
+import random
+import socketserver
+import threading
+import time
+
+from django.core.mail import get_connection
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP-диалог: EHLO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        server.count("sessions")
+        self.reply("220 stub ESMTP")
+        started = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb == "EHLO":
+                self.reply("250-stub")
+                self.reply("250-8BITMIME")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif verb == "HELO":
+                self.reply("250 stub")
+            elif verb == "AUTH":
+                if command.upper().startswith("AUTH LOGIN"):
+                    self.reply("334 " + base64.b64encode(b"Username:").decode())
+                    self.rfile.readline()
+                    self.reply("334 " + base64.b64encode(b"Password:").decode())
+                    self.rfile.readline()
+                self.reply("235 Authentication successful")
+            elif verb == "MAIL":
+                started = time.perf_counter()
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.failure_rate and random.random() < server.failure_rate:
+                    server.count("rejected")
+                    self.reply(server.failure_reply)
+                else:
+                    server.count("accepted")
+                    self.reply("250 OK queued")
+                if started is not None:
+                    server.observe(time.perf_counter() - started)
+                    started = None
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    """Локальный SMTP-сервер для проверки и замеров отправки.
+
+    Принимает письма, никуда их не доставляя. ``latency`` задаёт задержку
+    ответа на DATA в секундах, ``failure_rate`` — долю писем, отклоняемых
+    ответом ``failure_reply``.
+
+        with StubSMTPServer(latency=0.01) as server:
+            dispatch_mailing(mailing, connection=server.get_connection())
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0,
+                 failure_reply="451 Temporary failure, try again later"):
+        super().__init__((host, port), StubSMTPHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_reply = failure_reply
+        self.stats = {"sessions": 0, "accepted": 0, "rejected": 0}
+        self.latencies = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def observe(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def smtp_options(self):
+        """Параметры aiosmtplib для подключения к этому серверу."""
+        return {"hostname": self.server_address[0], "port": self.port, "start_tls": False}
+
+    def get_connection(self, **kwargs):
+        """Django email backend, настроенный на этот сервер."""
+        kwargs.setdefault("backend", "django.core.mail.backends.smtp.EmailBackend")
+        return get_connection(
+            host=self.server_address[0],
+            port=self.port,
+            username="",
+            password="",
+            use_tls=False,
+            use_ssl=False,
+            **kwargs,
+        )
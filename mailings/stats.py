@@ -0,0 +1,138 @@
+from collections import defaultdict
+
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Sum
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+from django.utils import timezone
+
+from .models import AttemptStatus, MailAttempt, MailAttemptRollup, MailingStats
+
+# Сколько строк статистики сохранять за раз при пересчёте.
+REBUILD_BATCH_SIZE = 500
+
+
+def record_stats(mailing, attempts):
+    """Прибавляет к статистике рассылки пачку только что записанных попыток.
+
+    Отправка берёт лишь получателей без успешной попытки, поэтому каждая
+    успешная попытка — новый охваченный получатель.
+    """
+    if not attempts:
+        return
+    success = sum(1 for attempt in attempts if attempt.status == AttemptStatus.SUCCESS)
+    last_attempt_at = max(attempt.attempted_at for attempt in attempts)
+    changes = dict(
+        sent=F("sent") + len(attempts),
+        success=F("success") + success,
+        failed=F("failed") + len(attempts) - success,
+        recipients_reached=F("recipients_reached") + success,
+        last_attempt_at=Greatest(Coalesce(F("last_attempt_at"), last_attempt_at), last_attempt_at),
+        updated_at=timezone.now(),
+    )
+    if not MailingStats.objects.filter(mailing_id=mailing.pk).update(**changes):
+        MailingStats.objects.get_or_create(mailing_id=mailing.pk)
+        MailingStats.objects.filter(mailing_id=mailing.pk).update(**changes)
+
+
+def get_stats(mailing):
+    try:
+        return mailing.stats
+    except MailingStats.DoesNotExist:
+        return MailingStats(mailing=mailing)
+
+
+def rebuild_stats(mailing_ids=None):
+    """Пересчитывает статистику по таблице попыток и итогам архива; возвращает число рассылок.
+
+    Успешная попытка у получателя рассылки бывает только одна, поэтому
+    охваченных получателей из архива можно считать по успешным попыткам.
+    """
+    attempts = MailAttempt.objects.all()
+    rollups = MailAttemptRollup.objects.all()
+    stats = MailingStats.objects.all()
+    if mailing_ids is not None:
+        attempts = attempts.filter(mailing_id__in=mailing_ids)
+        rollups = rollups.filter(mailing_id__in=mailing_ids)
+        stats = stats.filter(mailing_id__in=mailing_ids)
+
+    success = Q(status=AttemptStatus.SUCCESS)
+    archived = {
+        row["mailing_id"]: row
+        for row in rollups.order_by().values("mailing_id").annotate(
+            sent=Sum("count"),
+            success=Coalesce(Sum("count", filter=success), 0),
+            failed=Coalesce(Sum("count", filter=Q(status=AttemptStatus.FAILED)), 0),
+            last_attempt_at=Max("last_attempt_at"),
+        )
+    }
+    rows = (
+        attempts.order_by()
+        .values("mailing_id")
+        .annotate(
+            sent=Count("id"),
+            success=Count("id", filter=success),
+            failed=Count("id", filter=Q(status=AttemptStatus.FAILED)),
+            recipients_reached=Count("recipient_id", filter=success, distinct=True),
+            last_attempt_at=Max("attempted_at"),
+        )
+    )
+    now = timezone.now()
+    rebuilt = 0
+    batch = []
+    for row in rows.iterator():
+        batch.append(MailingStats(updated_at=now, **merge_archived(row, archived.pop(row["mailing_id"], None))))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            rebuilt += save_stats(batch)
+            batch = []
+    # Рассылки, все попытки которых уже в архиве.
+    for row in archived.values():
+        batch.append(MailingStats(updated_at=now, recipients_reached=row["success"], **row))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            rebuilt += save_stats(batch)
+            batch = []
+    if batch:
+        rebuilt += save_stats(batch)
+    stats.filter(
+        ~Exists(MailAttempt.objects.filter(mailing=OuterRef("mailing"))),
+        ~Exists(MailAttemptRollup.objects.filter(mailing=OuterRef("mailing"))),
+    ).delete()
+    return rebuilt
+
+
+def merge_archived(row, archived):
+    if archived is None:
+        return row
+    return dict(
+        row,
+        sent=row["sent"] + archived["sent"],
+        success=row["success"] + archived["success"],
+        failed=row["failed"] + archived["failed"],
+        recipients_reached=row["recipients_reached"] + archived["success"],
+        last_attempt_at=max(row["last_attempt_at"], archived["last_attempt_at"]),
+    )
+
+
+def daily_stats(mailing):
+    """Число попыток рассылки по дням и статусам: архив вместе с живыми попытками.
+
+    Возвращает список ``{"day", "success", "failed"}`` по возрастанию дня.
+    """
+    days = defaultdict(lambda: {"success": 0, "failed": 0})
+    for day, status, count in mailing.rollups.values_list("day", "status", "count"):
+        days[day][AttemptStatus(status).name.lower()] += count
+    live = (
+        mailing.attempts.order_by()
+        .values_list(TruncDate("attempted_at"), "status")
+        .annotate(count=Count("id"))
+    )
+    for day, status, count in live:
+        days[day][AttemptStatus(status).name.lower()] += count
+    return [{"day": day, **days[day]} for day in sorted(days)]
+
+
+def save_stats(batch):
+    return len(MailingStats.objects.bulk_create(
+        batch,
+        update_conflicts=True,
+        unique_fields=["mailing"],
+        update_fields=["sent", "success", "failed", "recipients_reached", "last_attempt_at", "updated_at"],
+    ))
@@ -0,0 +1,205 @@
+import base64
+import re
+import threading
+from collections import OrderedDict
+from email import charset as email_charset
+from email import quoprimime
+from email.header import Header
+from email.utils import formatdate, make_msgid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.mail.message import DNS_NAME, RFC5322_EMAIL_LINE_LENGTH_LIMIT, sanitize_address
+
+# Поля получателя, доступные в теме и тексте письма как {{ full_name }}.
+PLACEHOLDERS = ("email", "full_name", "comment")
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+# Адрес, который sanitize_address вернул бы без изменений.
+PLAIN_ADDRESS_RE = re.compile(r"^[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+@[A-Za-z0-9.-]+$")
+
+# Сколько байт текста помещать в одно encoded-word (RFC 2047), чтобы
+# строка заголовка не превышала 76 символов.
+ENCODED_WORD_BYTES = 45
+
+# Сколько скомпилированных сообщений держать в памяти процесса.
+CACHE_SIZE = 128
+
+
+def validate_placeholders(value):
+    unknown = sorted({name for name in PLACEHOLDER_RE.findall(value) if name not in PLACEHOLDERS})
+    if unknown:
+        raise ValidationError(
+            "Неизвестные подстановки: %(unknown)s. Доступны: %(known)s.",
+            params={"unknown": ", ".join(unknown), "known": ", ".join(PLACEHOLDERS)},
+        )
+
+
+class Template:
+    """Текст, разбитый на постоянные куски и имена полей получателя.
+
+    ``render`` только склеивает куски, без повторного разбора шаблона.
+    Подставляются лишь ``PLACEHOLDERS``: сообщение могло попасть в базу в
+    обход ``validate_placeholders`` (старые данные, ``update()``), и
+    ``{{ owner }}`` не должен выдавать в письмо чужие атрибуты получателя.
+    Неизвестные подстановки остаются в тексте как есть.
+    """
+
+    def __init__(self, text):
+        self.parts = []
+        static = []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            static.append(text[position:match.start()])
+            position = match.end()
+            if match.group(1) not in PLACEHOLDERS:
+                static.append(match.group(0))
+                continue
+            self.parts.append("".join(static))
+            self.parts.append(match.group(1))
+            static = []
+        static.append(text[position:])
+        self.parts.append("".join(static))
+        self.static = len(self.parts) == 1
+
+    def render(self, recipient):
+        if self.static:
+            return self.parts[0]
+        parts = self.parts[:]
+        for index in range(1, len(parts), 2):
+            parts[index] = str(getattr(recipient, parts[index], "") or "")
+        return "".join(parts)
+
+
+def header_line(name, value, encoding):
+    """Заголовок в том виде, как его сериализует email (с переносом длинных строк)."""
+    try:
+        value.encode("ascii")
+        charset = "us-ascii"
+    except UnicodeEncodeError:
+        charset = encoding
+    return f"{name}: " + Header(value, charset, header_name=name).encode(linesep="\n")
+
+
+def encoded_words(value, encoding):
+    """Быстрая замена ``Header.encode`` для изменяемых заголовков: base64
+    encoded-words, разбитые по границам символов."""
+    words = []
+    chunk = b""
+    for char in value:
+        data = char.encode(encoding)
+        if len(chunk) + len(data) > ENCODED_WORD_BYTES:
+            words.append(chunk)
+            chunk = b""
+        chunk += data
+    words.append(chunk)
+    return "\n ".join(f"=?{encoding}?b?{base64.b64encode(word).decode('ascii')}?=" for word in words)
+
+
+def address(email, encoding):
+    if PLAIN_ADDRESS_RE.match(email):
+        return email
+    return sanitize_address(email, encoding)
+
+
+def single_line(value):
+    return " ".join(value.splitlines())
+
+
+class PreparedMessage:
+    """Готовое к отправке письмо в байтах с интерфейсом ``email.message.Message``,
+    который нужен почтовым бэкендам Django (``as_bytes``, ``get_charset``)."""
+
+    def __init__(self, data, charset):
+        self.data = data
+        self.charset = charset
+
+    def as_bytes(self, unixfrom=False, linesep="\n"):
+        if linesep == "\n":
+            return self.data
+        return self.data.replace(b"\n", linesep.encode())
+
+    def as_string(self, unixfrom=False, linesep="\n"):
+        return self.as_bytes(linesep=linesep).decode(self.charset.get_output_charset())
+
+    def get_charset(self):
+        return self.charset
+
+    def __str__(self):
+        return self.as_string()
+
+
+class CompiledMessage:
+    """Сообщение рассылки, подготовленное к подстановке данных получателя.
+
+    Заголовки, которые не зависят от получателя (From, MIME-Version,
+    Content-Type, тема без подстановок), и тело без подстановок
+    сериализуются один раз; на каждого получателя формируются только To,
+    Date, Message-ID и изменяемые части.
+    """
+
+    def __init__(self, message, from_email=None, encoding=None):
+        self.encoding = encoding or settings.DEFAULT_CHARSET
+        self.charset = email_charset.Charset(self.encoding)
+        self.from_email = from_email or settings.DEFAULT_FROM_EMAIL
+        self.subject = Template(message.subject)
+        self.body = Template(message.body)
+
+        self.head = "\n".join([
+            f'Content-Type: text/plain; charset="{self.encoding}"',
+            "MIME-Version: 1.0",
+        ])
+        self.from_line = "From: " + sanitize_address(self.from_email, self.encoding)
+        self.subject_line = self.encode_subject(message.subject) if self.subject.static else None
+        self.body_part = self.encode_body(message.body) if self.body.static else None
+
+    def encode_subject(self, subject):
+        subject = single_line(subject)
+        if self.subject.static or subject.isascii():
+            return header_line("Subject", subject, self.encoding)
+        return "Subject: " + encoded_words(subject, self.encoding)
+
+    def encode_body(self, body):
+        """``(Content-Transfer-Encoding, тело)``, как их выбирает Django."""
+        text = "\n".join(body.splitlines())
+        if body.endswith(("\n", "\r")):
+            text += "\n"
+        data = text.encode(self.encoding)
+        if any(len(line) > RFC5322_EMAIL_LINE_LENGTH_LIMIT for line in data.splitlines()):
+            return "quoted-printable", quoprimime.body_encode(data.decode("latin-1")).encode("ascii")
+        return "8bit", data
+
+    def render(self, recipient):
+        subject_line = self.subject_line or self.encode_subject(self.subject.render(recipient))
+        transfer_encoding, body = self.body_part or self.encode_body(self.body.render(recipient))
+        headers = "\n".join([
+            self.head,
+            f"Content-Transfer-Encoding: {transfer_encoding}",
+            subject_line,
+            self.from_line,
+            "To: " + address(recipient.email, self.encoding),
+            "Date: " + formatdate(localtime=settings.EMAIL_USE_LOCALTIME),
+            "Message-ID: " + make_msgid(domain=DNS_NAME),
+        ])
+        return PreparedMessage(headers.encode("ascii") + b"\n\n" + body, self.charset)
+
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def compile_message(message):
+    """Скомпилированное сообщение из кэша по (id, updated_at)."""
+    key = (message.pk, message.updated_at, settings.DEFAULT_FROM_EMAIL)
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+    compiled = CompiledMessage(message)
+    with _compiled_lock:
+        _compiled[key] = compiled
+        while len(_compiled) > CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return compiled
@@ -0,0 +1,926 @@
+import asyncio
+import csv
+import math
+import smtplib
+import socket
+import tempfile
+from dataclasses import dataclass
+from datetime import timedelta
+from unittest import mock
+
+import aiosmtplib
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.middleware import RequestTimingMiddleware
+
+from . import templating
+from .caching import get_versions
+from .metrics import PHASES, Metrics, registry, render, series
+from .access import MANAGERS_GROUP
+from .archive import AttemptArchiver
+from .async_services import AsyncMailingDispatcher, adispatch_mailing
+from .models import (
+    AttemptStatus, FailureReason, MailAttempt, Mailing, Message, Recipient, RecipientSegment, SendJob,
+)
+from .retries import SMTP_OK, is_transient
+from .services import (
+    AttemptBuffer, MailingDispatcher, claim_job, dispatch_mailing, enqueue_mailing, finish_expired_mailings,
+    launch_due_mailings, run_job,
+)
+from .smtp_stub import StubSMTPServer
+from .stats import daily_stats, rebuild_stats
+from .templating import Template, compile_message
+from .throttling import DomainQueue, DomainThrottle, TokenBucket
+
+
+def seed(owner, count, mailing=None):
+    """Добавляет ``owner`` по ``count`` объектов каждого вида; возвращает рассылку."""
+    now = timezone.now()
+    offset = Recipient.objects.filter(owner=owner).count()
+    recipients = Recipient.objects.bulk_create(
+        Recipient(email=f"budget{offset + i}.{owner.pk}@example.com", full_name=f"Budget {i}", owner=owner)
+        for i in range(count)
+    )
+    messages = Message.objects.bulk_create(
+        Message(subject=f"Budget {i}", body="Budget", owner=owner) for i in range(count)
+    )
+    RecipientSegment.objects.bulk_create(
+        RecipientSegment(name=f"Budget {i}", domain="example.com", owner=owner) for i in range(count)
+    )
+    mailings = Mailing.objects.bulk_create(
+        Mailing(start_at=now, end_at=now + timedelta(days=1), message=message, owner=owner)
+        for message in messages
+    )
+    mailing = mailing or mailings[0]
+    mailing.recipients.add(*recipients)
+    for target in mailings:
+        if target is not mailing:
+            target.recipients.add(*recipients[:2])
+    MailAttempt.objects.bulk_create(
+        MailAttempt(mailing=mailing, recipient=recipient, status=AttemptStatus.SUCCESS, smtp_code=SMTP_OK, owner=owner)
+        for recipient in recipients
+    )
+    # Активная задача у рассылки может быть только одна.
+    SendJob.objects.bulk_create(SendJob(mailing=mailing, owner=owner, status="DONE") for _ in range(count))
+    return mailing
+
+
+def make_owner():
+    owner = get_user_model().objects.create(email="query-budget@example.com")
+    owner.user_permissions.add(*Permission.objects.filter(content_type__app_label="mailings"))
+    return owner
+
+
+@dataclass
+class Budget:
+    name: str
+    url: str
+    limit: int
+    api: bool = False
+
+
+# Бюджеты веб-страниц включают сессию, пользователя и три запроса снимка
+# прав, который при замере не кэшируется; API снимок прав не запрашивает.
+BUDGETS = [
+    Budget("messages_list", "/messages/", 6),
+    Budget("recipients_list", "/recipients/", 6),
+    Budget("segments_list", "/segments/", 6),
+    Budget("mailings_list", "/mailings/", 6),
+    Budget("attempts_list", "/attempts/", 6),
+    Budget("mailing_detail", "/mailings/{mailing}/", 10),
+    Budget("api_recipients", "/api/api/recipients/?page_size={page_size}", 1, api=True),
+    Budget("api_segments", "/api/api/segments/?page_size={page_size}", 1, api=True),
+    Budget("api_messages", "/api/api/messages/?page_size={page_size}", 1, api=True),
+    Budget("api_mailings", "/api/api/mailings/?page_size={page_size}", 2, api=True),
+    Budget("api_attempts", "/api/api/attempts/?page_size={page_size}", 1, api=True),
+    Budget("api_jobs", "/api/api/jobs/?page_size={page_size}", 1, api=True),
+    Budget("api_mailing_stats", "/api/api/mailings/{mailing}/stats/", 3, api=True),
+]
+
+SMALL = 3
+LARGE = 40
+
+
+# Кэш отключён, чтобы мерить сами запросы.
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+class QueryBudgetTests(TestCase):
+    """Страницы и API укладываются в бюджет запросов на малом и на большом
+    наборе данных: рост числа строк на странице не добавляет запросов (N+1)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_owner()
+        cls.mailing = seed(cls.owner, SMALL)
+
+    def client_for(self, budget):
+        if not budget.api:
+            web = Client()
+            web.force_login(self.owner)
+            return web
+        # Свежий объект пользователя, как в настоящем запросе к API.
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.get(pk=self.owner.pk))
+        return api
+
+    def assertBudgets(self, page_size):
+        for budget in BUDGETS:
+            with self.subTest(budget=budget.name, page_size=page_size):
+                client = self.client_for(budget)
+                url = budget.url.format(mailing=self.mailing.pk, page_size=page_size)
+                with self.assertNumQueries(budget.limit):
+                    response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_small_pages(self):
+        self.assertBudgets(SMALL)
+
+    def test_large_pages(self):
+        seed(self.owner, LARGE - SMALL, self.mailing)
+        self.assertBudgets(LARGE)
+
+
+def make_mailing(owner, emails, **kwargs):
+    now = timezone.now()
+    message = Message.objects.create(subject="Тест", body="Тест", owner=owner)
+    mailing = Mailing.objects.create(
+        start_at=now, end_at=now + timedelta(days=1), message=message, owner=owner, **kwargs
+    )
+    mailing.recipients.add(*(
+        Recipient.objects.create(email=email, full_name=email, owner=owner) for email in emails
+    ))
+    return mailing
+
+
+def attempt_statuses(mailing):
+    return dict(mailing.attempts.values_list("recipient__email", "status"))
+
+
+class DeliverTests(TestCase):
+    def test_address_error_is_recorded_for_its_own_message(self):
+        # Бэкенд падает на sanitize_address() до сборки письма: ошибка не
+        # должна достаться предыдущему, уже принятому сервером письму.
+        mailing = make_mailing(make_owner(), ["ok1@example.com", "bad\n@example.com", "ok3@example.com"])
+        with StubSMTPServer() as server:
+            dispatch_mailing(mailing, connection=server.get_connection(), batch_size=10)
+        self.assertEqual(server.stats["accepted"], 2)
+        self.assertEqual(attempt_statuses(mailing), {
+            "ok1@example.com": AttemptStatus.SUCCESS,
+            "bad\n@example.com": AttemptStatus.FAILED,
+            "ok3@example.com": AttemptStatus.SUCCESS,
+        })
+
+
+class SendJobLeaseTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        self.mailing = make_mailing(self.owner, [f"r{i}@example.com" for i in range(5)])
+
+    def test_claim_takes_over_job_with_expired_lease(self):
+        now = timezone.now()
+        SendJob.objects.create(
+            mailing=make_mailing(self.owner, ["alive@example.com"]), owner=self.owner, status="RUNNING",
+            worker="alive", lease_until=now + timedelta(minutes=5),
+        )
+        dead = SendJob.objects.create(
+            mailing=self.mailing, owner=self.owner, status="RUNNING",
+            worker="dead", lease_until=now - timedelta(seconds=1),
+        )
+        job = claim_job(worker="next")
+        self.assertEqual(job.pk, dead.pk)
+        self.assertEqual(job.worker, "next")
+        self.assertGreater(job.lease_until, now)
+        self.assertIsNone(claim_job(worker="other"))
+
+    @override_settings(MAILING_BATCH_SIZE=1, MAILING_FLUSH_SIZE=1)
+    def test_worker_stops_after_losing_lease(self):
+        SendJob.objects.create(mailing=self.mailing, owner=self.owner)
+        job = claim_job(worker="slow")
+        # Пока воркер не продлевал аренду, задачу забрал другой.
+        SendJob.objects.filter(pk=job.pk).update(worker="next")
+        job = run_job(job)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(job.status, "RUNNING")
+        self.assertEqual(job.worker, "next")
+        self.assertEqual(job.processed, 1)
+
+
+class FinishingBackend(EmailBackend):
+    """Почтовый бэкенд, после первой пачки завершающий рассылку, как планировщик."""
+
+    def __init__(self, mailing, **kwargs):
+        super().__init__(**kwargs)
+        self.mailing = mailing
+
+    def send_messages(self, messages):
+        sent = super().send_messages(messages)
+        Mailing.objects.filter(pk=self.mailing.pk).update(status="FINISHED")
+        return sent
+
+
+@override_settings(MAILING_BATCH_SIZE=1, MAILING_FLUSH_SIZE=1)
+class MailingDeadlineTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        self.mailing = make_mailing(self.owner, [f"r{i}@example.com" for i in range(5)])
+
+    def test_expired_job_is_cancelled_without_sending(self):
+        Mailing.objects.filter(pk=self.mailing.pk).update(end_at=timezone.now() - timedelta(minutes=1))
+        SendJob.objects.create(mailing=self.mailing, owner=self.owner)
+        job = run_job(claim_job(worker="w"))
+        self.assertEqual(job.status, "CANCELLED")
+        self.assertEqual(len(mail.outbox), 0)
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.status, "FINISHED")
+
+    def test_run_stops_when_mailing_is_finished(self):
+        dispatch_mailing(self.mailing, connection=FinishingBackend(self.mailing))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(self.mailing.attempts.count(), 1)
+
+    def test_finish_expired_cancels_queued_jobs(self):
+        job = SendJob.objects.create(mailing=self.mailing, owner=self.owner)
+        self.assertEqual(finish_expired_mailings(now=self.mailing.end_at), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "CANCELLED")
+        self.assertIsNone(claim_job(worker="w"))
+
+
+class EnqueueMailingTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        self.mailing = make_mailing(self.owner, ["r@example.com"])
+
+    def test_double_click_returns_the_active_job(self):
+        api = APIClient()
+        api.force_authenticate(self.owner)
+        url = f"/api/api/mailings/{self.mailing.pk}/send/"
+        first = api.post(url).json()["job_id"]
+        second = api.post(url).json()["job_id"]
+        self.assertEqual(first, second)
+        self.assertEqual(SendJob.objects.filter(mailing=self.mailing).count(), 1)
+
+    def test_finished_job_allows_a_new_one(self):
+        job = enqueue_mailing(self.mailing)
+        SendJob.objects.filter(pk=job.pk).update(status="DONE")
+        self.assertNotEqual(enqueue_mailing(self.mailing).pk, job.pk)
+
+    def test_scheduler_reuses_job_of_a_manual_send(self):
+        Mailing.objects.filter(pk=self.mailing.pk).update(start_at=timezone.now() - timedelta(minutes=1))
+        job = enqueue_mailing(self.mailing)
+        self.assertEqual([launched.pk for launched in launch_due_mailings()], [job.pk])
+
+
+class TransientErrorTests(SimpleTestCase):
+    def test_classification(self):
+        cases = [
+            (smtplib.SMTPResponseException(451, b"try later"), True),
+            (smtplib.SMTPResponseException(550, b"no such user"), False),
+            (smtplib.SMTPRecipientsRefused({"a@example.com": (452, b"mailbox full")}), True),
+            (smtplib.SMTPServerDisconnected("Connection unexpectedly closed"), True),
+            (smtplib.SMTPNotSupportedError("SMTPUTF8 not supported"), False),
+            (smtplib.SMTPException("No suitable authentication method found."), False),
+            (socket.timeout("timed out"), True),
+            (ConnectionRefusedError(), True),
+            (aiosmtplib.SMTPReadTimeoutError("timed out"), True),
+            (aiosmtplib.SMTPNotSupported("SMTPUTF8 not supported"), False),
+            (ValueError("bad address"), False),
+        ]
+        for error, transient in cases:
+            with self.subTest(error=repr(error)):
+                self.assertIs(is_transient(error), transient)
+
+
+class ExportParamsTests(TestCase):
+    def test_bad_params_are_rejected_with_400(self):
+        api = APIClient()
+        api.force_authenticate(make_owner())
+        for query in ["mailing=abc", "since=2024-13-45", "until=2024-02-30T10:00", "since=yesterday"]:
+            with self.subTest(query=query):
+                response = api.get(f"/api/api/attempts/export/?{query}")
+                self.assertEqual(response.status_code, 400)
+
+
+class RecipientImportTests(TestCase):
+    def test_non_numeric_mailing_is_rejected_with_400(self):
+        api = APIClient()
+        api.force_authenticate(make_owner())
+        upload = SimpleUploadedFile("recipients.csv", b"email,full_name\nr@example.com,R\n")
+        response = api.post("/api/api/recipients/import/", {"file": upload, "mailing": "abc"}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("mailing", response.json())
+        self.assertFalse(Recipient.objects.exists())
+
+    def post_file(self, name, content):
+        api = APIClient()
+        api.force_authenticate(self.owner)
+        upload = SimpleUploadedFile(name, content)
+        return api.post("/api/api/recipients/import/", {"file": upload}, format="multipart")
+
+    def test_non_utf8_file_is_rejected_with_400(self):
+        self.owner = make_owner()
+        files = {
+            "recipients.csv": "email,full_name\nr@example.com,Renée\n",
+            "recipients.ndjson": '{"email": "r@example.com", "full_name": "Renée"}\n',
+        }
+        for name, text in files.items():
+            with self.subTest(name=name):
+                response = self.post_file(name, text.encode("latin-1"))
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("UTF-8", response.json()["detail"])
+
+    def test_malformed_csv_is_rejected_with_400(self):
+        self.owner = make_owner()
+        huge = "x" * (csv.field_size_limit() + 1)
+        content = f"email,full_name\nr@example.com,R\nb@example.com,{huge}\n".encode()
+        response = self.post_file("recipients.csv", content)
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()["detail"].startswith("Строка 3:"))
+
+    def test_malformed_ndjson_line_is_reported(self):
+        self.owner = make_owner()
+        response = self.post_file("recipients.ndjson", b'{"email": "r@example.com", "full_name": "R"}\n{oops\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["errors"], [{"line": 2, "error": "Неверная строка"}])
+
+    def test_command_reports_unreadable_file(self):
+        owner = make_owner()
+        with tempfile.NamedTemporaryFile(suffix=".csv") as file:
+            file.write("email,full_name\nr@example.com,Renée\n".encode("latin-1"))
+            file.flush()
+            with self.assertRaisesMessage(CommandError, "UTF-8"):
+                call_command("import_recipients", file.name, owner=owner.email)
+
+
+class MailingFormTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        self.message = Message.objects.create(subject="Тест", body="Тест", owner=self.owner)
+        Recipient.objects.bulk_create(
+            Recipient(email=f"r{i}@example.com", full_name=f"R{i}", owner=self.owner) for i in range(3)
+        )
+        self.web = Client()
+        self.web.force_login(self.owner)
+
+    def form_data(self, recipients=""):
+        now = timezone.localtime().replace(second=0, microsecond=0, tzinfo=None)
+        return {
+            "start_at": now.isoformat(),
+            "end_at": (now + timedelta(days=1)).isoformat(),
+            "message": self.message.pk,
+            "recipients": recipients,
+        }
+
+    def test_form_does_not_list_the_address_book(self):
+        response = self.web.get("/mailings/create/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "r1@example.com")
+
+    def test_recipients_are_entered_as_emails(self):
+        response = self.web.post("/mailings/create/", self.form_data("r0@example.com\nr2@example.com"))
+        self.assertEqual(response.status_code, 302)
+        mailing = Mailing.objects.get()
+        self.assertEqual(
+            sorted(mailing.recipients.values_list("email", flat=True)), ["r0@example.com", "r2@example.com"]
+        )
+        response = self.web.get(f"/mailings/{mailing.pk}/update/")
+        self.assertContains(response, "r0@example.com\nr2@example.com")
+
+    def test_unknown_email_is_rejected(self):
+        response = self.web.post("/mailings/create/", self.form_data("r0@example.com nobody@example.com"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "nobody@example.com не найден")
+        self.assertFalse(Mailing.objects.exists())
+
+    def test_empty_mailing_can_be_created(self):
+        response = self.web.post("/mailings/create/", self.form_data())
+        self.assertEqual(response.status_code, 302)
+        api = APIClient()
+        api.force_authenticate(self.owner)
+        data = {k: v for k, v in self.form_data().items() if k != "recipients"}
+        self.assertEqual(api.post("/api/api/mailings/", data).status_code, 201)
+        self.assertEqual(Mailing.objects.filter(recipients=None, segment=None).count(), 2)
+
+
+class ApiScopingTests(TestCase):
+    def test_manager_sees_only_own_objects_through_the_api(self):
+        other = make_mailing(make_owner(), ["other@example.com"])
+        dispatch_mailing(other, batch_size=10)
+        manager = get_user_model().objects.create(email="manager@example.com")
+        manager.groups.add(Group.objects.create(name=MANAGERS_GROUP))
+        api = APIClient()
+        api.force_authenticate(manager)
+        for url in ["/api/api/recipients/", "/api/api/mailings/", "/api/api/attempts/", "/api/api/jobs/"]:
+            with self.subTest(url=url):
+                self.assertEqual(api.get(url).json()["results"], [])
+        export = api.get("/api/api/attempts/export/")
+        self.assertNotIn("other@example.com", b"".join(export.streaming_content).decode())
+        self.assertEqual(api.get(f"/api/api/mailings/{other.pk}/").status_code, 404)
+
+
+class ArchivedMailingTests(TestCase):
+    def test_archived_mailing_is_not_sent_again(self):
+        owner = make_owner()
+        mailing = make_mailing(owner, ["a@example.com", "b@example.com"])
+        dispatch_mailing(mailing, batch_size=10)
+        now = timezone.now()
+        Mailing.objects.filter(pk=mailing.pk).update(status="FINISHED", end_at=now - timedelta(minutes=1))
+        self.assertEqual(AttemptArchiver(cutoff=now).run().archived, 2)
+
+        # Рассылку «оживили»: вернули статус и продлили окончание.
+        Mailing.objects.filter(pk=mailing.pk).update(status="CREATED", end_at=now + timedelta(days=1))
+        mailing.refresh_from_db()
+        self.assertIsNotNone(mailing.archived_at)
+        mail.outbox.clear()
+        dispatch_mailing(mailing, batch_size=10)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(launch_due_mailings(), [])
+
+        api = APIClient()
+        api.force_authenticate(owner)
+        self.assertEqual(api.post(f"/api/api/mailings/{mailing.pk}/send/").status_code, 400)
+        self.assertFalse(SendJob.objects.filter(mailing=mailing).exists())
+
+        rebuild_stats([mailing.pk])
+        stats = Mailing.objects.get(pk=mailing.pk).stats
+        self.assertEqual((stats.sent, stats.recipients_reached), (2, 2))
+
+
+@override_settings(DEBUG=True)
+class RequestTimingMiddlewareTests(SimpleTestCase):
+    def test_sync_and_async_views_are_timed(self):
+        def sync_view(request):
+            return HttpResponse("ok")
+
+        async def async_view(request):
+            return HttpResponse("ok")
+
+        request = RequestFactory().get("/")
+        middleware = RequestTimingMiddleware(sync_view)
+        self.assertFalse(iscoroutinefunction(middleware))
+        self.assertIn("total;dur=", middleware(request)["Server-Timing"])
+
+        middleware = RequestTimingMiddleware(async_view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertIn("total;dur=", async_to_sync(middleware)(request)["Server-Timing"])
+
+    def test_asgi_chain_stays_async(self):
+        # Синхронное звено в цепочке заставило бы Django обернуть
+        # async-представления в async_to_sync.
+        outer = ASGIHandler()._middleware_chain.__wrapped__
+        self.assertIsInstance(outer, RequestTimingMiddleware)
+        self.assertTrue(iscoroutinefunction(outer))
+
+
+class TemplateTests(SimpleTestCase):
+    def test_render_fills_known_placeholders(self):
+        template = Template("Здравствуйте, {{ full_name }} ({{email}})!")
+        self.assertFalse(template.static)
+        recipient = Recipient(email="r@example.com", full_name="Иван")
+        self.assertEqual(template.render(recipient), "Здравствуйте, Иван (r@example.com)!")
+        self.assertEqual(Template("{{ comment }}").render(recipient), "")
+
+    def test_unknown_placeholders_stay_literal(self):
+        class Guarded:
+            full_name = "Иван"
+
+            def __getattr__(self, name):
+                raise AssertionError(f"Обращение к {name}")
+
+        template = Template("{{ owner }} {{ full_name }} {{pk}}")
+        self.assertEqual(template.render(Guarded()), "{{ owner }} Иван {{pk}}")
+        self.assertTrue(Template("Привет, {{ owner.password }} {{ pk }}").static)
+
+
+class CompileMessageTests(TestCase):
+    def setUp(self):
+        templating._compiled.clear()
+        self.message = Message.objects.create(subject="Тема", body="Привет, {{ full_name }}", owner=make_owner())
+
+    def test_compiled_message_is_cached_until_updated(self):
+        compiled = compile_message(self.message)
+        self.assertIs(compile_message(Message.objects.get(pk=self.message.pk)), compiled)
+        self.message.body = "Здравствуйте, {{ full_name }}"
+        self.message.save()
+        recompiled = compile_message(self.message)
+        self.assertIsNot(recompiled, compiled)
+        recipient = Recipient(email="r@example.com", full_name="Иван")
+        self.assertIn("Здравствуйте, Иван".encode(), recompiled.render(recipient).as_bytes())
+
+    def test_cache_keeps_only_recent_messages(self):
+        compiled = compile_message(self.message)
+        with mock.patch.object(templating, "CACHE_SIZE", 1):
+            other = Message.objects.create(subject="Другая", body="Текст", owner=self.message.owner)
+            compile_message(other)
+        self.assertIsNot(compile_message(self.message), compiled)
+
+
+class CheckpointTests(TestCase):
+    def setUp(self):
+        self.mailing = make_mailing(make_owner(), [f"r{i}@example.com" for i in range(5)])
+
+    @override_settings(MAILING_BATCH_SIZE=2, MAILING_FLUSH_SIZE=2)
+    def test_checkpoint_tracks_only_unpersisted_recipients(self):
+        dispatcher = MailingDispatcher(self.mailing, checkpoint=True, finalize=False).run()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(list(dispatcher.issued), [])
+        self.mailing.refresh_from_db()
+        last = self.mailing.recipients.order_by("-pk").first()
+        self.assertEqual(self.mailing.checkpoint_recipient_id, last.pk)
+
+    def test_run_without_checkpoint_keeps_no_ids(self):
+        dispatcher = MailingDispatcher(self.mailing, checkpoint=False).run()
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(list(dispatcher.issued), [])
+        self.assertEqual(dispatcher.persisted, set())
+
+
+class AsyncDispatchTests(TestCase):
+    def setUp(self):
+        self.mailing = make_mailing(make_owner(), [f"r{i}@example.com" for i in range(10)])
+
+    async def test_sends_through_smtp_sessions(self):
+        with StubSMTPServer() as server:
+            dispatcher = await adispatch_mailing(self.mailing, smtp_options=server.smtp_options(), concurrency=3)
+        self.assertEqual((dispatcher.success, dispatcher.failed), (10, 0))
+        self.assertEqual(server.stats["accepted"], 10)
+        statuses = await sync_to_async(attempt_statuses)(self.mailing)
+        self.assertEqual(set(statuses.values()), {AttemptStatus.SUCCESS})
+
+    async def test_failed_sessions_do_not_hang_the_send(self):
+        # Очередь вмещает два письма: без проверки сеансов producer
+        # остался бы ждать в queue.put навсегда.
+        with StubSMTPServer() as server, mock.patch.object(
+            AsyncMailingDispatcher, "asend", side_effect=RuntimeError("сеанс упал")
+        ):
+            with self.assertRaisesMessage(RuntimeError, "сеанс упал"):
+                await asyncio.wait_for(
+                    adispatch_mailing(self.mailing, smtp_options=server.smtp_options(), concurrency=1, batch_size=1),
+                    timeout=5,
+                )
+
+
+class Interrupted(BaseException):
+    """Падение процесса посреди отправки: ``deliver`` его не перехватывает."""
+
+
+class InterruptingBackend(EmailBackend):
+    """Почтовый бэкенд, который падает на письме номер ``fail_on``."""
+
+    def __init__(self, fail_on, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_on = fail_on
+
+    def send_messages(self, messages):
+        if len(mail.outbox) + 1 >= self.fail_on:
+            raise Interrupted()
+        return super().send_messages(messages)
+
+
+class AttemptBufferTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        self.mailing = make_mailing(self.owner, [f"r{i}@example.com" for i in range(20)])
+        self.recipients = list(self.mailing.recipients.order_by("pk"))
+
+    def attempt(self, recipient, failure=None):
+        return MailAttempt(
+            mailing=self.mailing, recipient=recipient, owner=self.owner,
+            status=AttemptStatus.FAILED if failure else AttemptStatus.SUCCESS, failure=FailureReason.intern(failure),
+        )
+
+    def test_flushes_every_size_attempts(self):
+        flushed = []
+        buffer = AttemptBuffer(size=3, interval=3600, on_flush=lambda attempts: flushed.append(len(attempts)))
+        for recipient in self.recipients[:7]:
+            buffer.add(self.attempt(recipient))
+        self.assertEqual(flushed, [3, 3])
+        self.assertEqual(MailAttempt.objects.count(), 6)
+        buffer.flush()
+        self.assertEqual(flushed, [3, 3, 1])
+        self.assertEqual(MailAttempt.objects.count(), 7)
+
+    def test_flush_cost_does_not_grow_with_rows(self):
+        # Тот же набор запросов на 2 и на 20 строк: одна вставка на буфер,
+        # плюс одна для причин ошибок.
+        for count, failure in [(2, None), (20, None), (2, "boom"), (20, "boom")]:
+            with self.subTest(count=count, failure=failure):
+                MailAttempt.objects.all().delete()
+                buffer = AttemptBuffer(size=100, interval=3600)
+                for recipient in self.recipients[:count]:
+                    buffer.put(self.attempt(recipient, failure))
+                with self.assertNumQueries(4 if failure else 3):  # SAVEPOINT, INSERT…, RELEASE
+                    buffer.flush()
+                self.assertEqual(MailAttempt.objects.count(), count)
+
+    @override_settings(MAILING_BATCH_SIZE=2, MAILING_FLUSH_SIZE=100, MAILING_FLUSH_INTERVAL=3600)
+    def test_partial_buffer_is_flushed_when_send_stops_early(self):
+        with self.assertRaises(Interrupted):
+            dispatch_mailing(self.mailing, connection=InterruptingBackend(fail_on=5))
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(self.mailing.attempts.count(), 4)
+        self.assertEqual(self.mailing.stats.sent, 4)
+
+
+class FakeClock:
+    """Подменяет модуль ``time`` в ``mailings.throttling``: время идёт только по ``sleep``."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ThrottlingTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("mailings.throttling.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_refills_at_rate_up_to_burst(self):
+        bucket = TokenBucket(rate=2, burst=4)
+        self.assertEqual(bucket.wait_time(4), 0.0)
+        bucket.take(4)
+        self.assertEqual(bucket.wait_time(1), 0.5)
+        self.clock.sleep(1)
+        self.assertEqual(bucket.wait_time(2), 0.0)
+        self.clock.sleep(60)
+        self.assertEqual(bucket.wait_time(4), 0.0)
+        self.assertEqual(bucket.wait_time(5), 0.5)
+
+    def test_domain_limits(self):
+        throttle = DomainThrottle(
+            limits={"slow.com": {"rate": 1, "burst": 2, "concurrency": 1}}, default={}, share=1,
+        )
+        self.assertEqual(throttle.max_batch("slow.com", 10), 2)
+        self.assertEqual(throttle.max_batch("fast.com", 10), 10)
+        throttle.acquire("slow.com", 2)
+        self.assertEqual(throttle.wait_time("slow.com", 1), math.inf)
+        throttle.release("slow.com")
+        self.assertEqual(throttle.wait_time("slow.com", 1), 1.0)
+        self.assertEqual(throttle.wait_time("fast.com", 1000), 0.0)
+
+    def test_share_splits_limits_between_processes(self):
+        throttle = DomainThrottle(limits={}, default={"rate": 10, "burst": 10, "concurrency": 4}, share=0.5)
+        self.assertEqual(throttle.max_batch("any.com", 100), 5)
+        self.assertEqual(throttle.concurrency("any.com"), 2)
+
+    def test_queue_interleaves_domains_and_reports_delay(self):
+        throttle = DomainThrottle(limits={"slow.com": {"rate": 1, "burst": 1}}, default={})
+        queue = DomainQueue(throttle, batch_size=2)
+        for i in range(3):
+            queue.push("slow.com", f"s{i}")
+            queue.push("fast.com", f"f{i}")
+        self.assertEqual(queue.pop(), ("slow.com", ["s0"], 0.0))
+        self.assertEqual(queue.pop(), ("fast.com", ["f0", "f1"], 0.0))
+        # Медленный домен ждёт токен, быстрый не задерживается.
+        self.assertEqual(queue.pop(), ("fast.com", ["f2"], 0.0))
+        throttle.release("slow.com")
+        self.assertEqual(queue.pop(), (None, [], 1.0))
+        self.assertEqual(len(queue), 2)
+        self.clock.sleep(1)
+        self.assertEqual(queue.pop(), ("slow.com", ["s1"], 0.0))
+
+    def test_pop_wait_sleeps_until_a_domain_is_free(self):
+        throttle = DomainThrottle(limits={"slow.com": {"rate": 2, "burst": 1}}, default={})
+        queue = DomainQueue(throttle, batch_size=1)
+        queue.push("slow.com", "a")
+        queue.push("slow.com", "b")
+        self.assertEqual(queue.pop_wait(), ("slow.com", ["a"]))
+        started = self.clock.now
+        self.assertEqual(queue.pop_wait(), ("slow.com", ["b"]))
+        self.assertAlmostEqual(self.clock.now - started, 0.5)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        Recipient.objects.bulk_create(
+            Recipient(email=f"r{i}@example.com", full_name=f"R{i}", owner=self.owner) for i in range(7)
+        )
+        # Одинаковое время создания: порядок внутри решает id.
+        Recipient.objects.update(created_at=timezone.now())
+        self.ids = list(Recipient.objects.order_by("-id").values_list("id", flat=True))
+        self.api = APIClient()
+        self.api.force_authenticate(self.owner)
+
+    def get_page(self, url):
+        response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [row["id"] for row in data["results"]], data["next"], data["previous"]
+
+    def test_next_and_previous_pages_round_trip(self):
+        first, next_url, previous_url = self.get_page("/api/api/recipients/?page_size=3")
+        self.assertEqual(first, self.ids[:3])
+        self.assertIsNone(previous_url)
+
+        second, next_url, previous_url = self.get_page(next_url)
+        self.assertEqual(second, self.ids[3:6])
+        self.assertEqual(self.get_page(previous_url)[0], first)
+
+        third, next_url, previous_url = self.get_page(next_url)
+        self.assertEqual(third, self.ids[6:])
+        self.assertIsNone(next_url)
+        back, next_url, previous_url = self.get_page(previous_url)
+        self.assertEqual(back, second)
+        self.assertIsNotNone(next_url)
+        again, next_url, previous_url = self.get_page(previous_url)
+        self.assertEqual(again, first)
+        self.assertIsNone(previous_url)
+
+    def test_invalid_cursor_is_rejected(self):
+        for cursor in ["garbage", "eyJrIjogWzFdfQ==", "eyJrIjogWyJ4IiwgIjEiXX0="]:
+            with self.subTest(cursor=cursor):
+                response = self.api.get(f"/api/api/recipients/?cursor={cursor}")
+                self.assertEqual(response.status_code, 404)
+
+
+class RefusingBackend(EmailBackend):
+    """Почтовый бэкенд, отклоняющий адреса, которые начинаются с ``bad``."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith("bad"):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b"no such user")})
+        return super().send_messages(messages)
+
+
+class MailingStatsTests(TestCase):
+    def setUp(self):
+        emails = [f"ok{i}@example.com" for i in range(4)] + ["bad0@example.com", "bad1@example.com"]
+        self.mailing = make_mailing(make_owner(), emails)
+
+    def counters(self):
+        stats = Mailing.objects.get(pk=self.mailing.pk).stats
+        return stats.sent, stats.success, stats.failed, stats.recipients_reached, stats.last_attempt_at
+
+    @override_settings(MAILING_BATCH_SIZE=2, MAILING_FLUSH_SIZE=3)
+    def test_incremental_counters_match_rebuild(self):
+        # Второй прогон снова пробует только недоставленных.
+        dispatch_mailing(self.mailing, connection=RefusingBackend())
+        dispatch_mailing(self.mailing, connection=RefusingBackend())
+        incremental = self.counters()
+        self.assertEqual(incremental[:4], (8, 4, 4, 4))
+        self.assertEqual(rebuild_stats([self.mailing.pk]), 1)
+        self.assertEqual(self.counters(), incremental)
+
+    def test_rebuild_merges_archived_rollups(self):
+        dispatch_mailing(self.mailing, connection=RefusingBackend())
+        expected = self.counters()
+        now = timezone.now()
+        # Половина попыток старше границы хранения и уйдёт в архив.
+        old = list(self.mailing.attempts.order_by("pk").values_list("pk", flat=True)[:3])
+        MailAttempt.objects.filter(pk__in=old).update(attempted_at=now - timedelta(days=3))
+        Mailing.objects.filter(pk=self.mailing.pk).update(status="FINISHED", end_at=now - timedelta(days=2))
+        self.assertEqual(AttemptArchiver(cutoff=now - timedelta(days=1)).run().archived, 3)
+        self.assertEqual(self.mailing.attempts.count(), 3)
+
+        rebuild_stats([self.mailing.pk])
+        self.assertEqual(self.counters(), expected)
+        days = daily_stats(self.mailing)
+        self.assertEqual(len(days), 2)
+        self.assertEqual(sum(day["success"] for day in days), 4)
+        self.assertEqual(sum(day["failed"] for day in days), 2)
+
+
+@override_settings(CACHES={"default": {
+    "BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "list-cache-tests",
+}})
+class ListCacheTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        self.other = get_user_model().objects.create(email="other-owner@example.com")
+        self.other.user_permissions.add(*Permission.objects.filter(content_type__app_label="mailings"))
+        self.client.force_login(self.owner)
+
+    def change(self, action):
+        # Версии меняются в on_commit, а TestCase не коммитит транзакцию.
+        with self.captureOnCommitCallbacks(execute=True):
+            return action()
+
+    def page(self, client=None):
+        return (client or self.client).get("/recipients/").content.decode()
+
+    def test_changes_invalidate_cached_list(self):
+        recipient = self.change(lambda: Recipient.objects.create(
+            email="first@example.com", full_name="Первый", owner=self.owner,
+        ))
+        self.assertIn("first@example.com", self.page())
+        # Прямой UPDATE сигналов не шлёт: страница отдаётся из кэша.
+        Recipient.objects.filter(pk=recipient.pk).update(full_name="Тихо")
+        self.assertNotIn("Тихо", self.page())
+
+        recipient.full_name = "Второй"
+        self.change(recipient.save)
+        self.assertIn("Второй", self.page())
+        self.change(lambda: Recipient.objects.create(email="new@example.com", full_name="Новый", owner=self.owner))
+        self.assertIn("new@example.com", self.page())
+        self.change(recipient.delete)
+        self.assertNotIn("first@example.com", self.page())
+
+    def test_recipients_change_bumps_mailing_version(self):
+        mailing = make_mailing(self.owner, [])
+        recipient = Recipient.objects.create(email="m2m@example.com", full_name="M2M", owner=self.owner)
+        before = get_versions((Mailing, Recipient), self.owner.pk)
+        self.change(lambda: mailing.recipients.add(recipient))
+        after = get_versions((Mailing, Recipient), self.owner.pk)
+        self.assertTrue(all(new != old for new, old in zip(after, before)))
+
+    def test_cache_is_scoped_per_owner(self):
+        other_client = Client()
+        other_client.force_login(self.other)
+        self.change(lambda: Recipient.objects.create(email="mine@example.com", full_name="Мой", owner=self.owner))
+        self.assertIn("mine@example.com", self.page())
+        self.assertNotIn("mine@example.com", self.page(other_client))
+
+        other_version = get_versions((Recipient,), self.other.pk)
+        self.change(lambda: Recipient.objects.create(email="more@example.com", full_name="Ещё", owner=self.owner))
+        self.assertEqual(get_versions((Recipient,), self.other.pk), other_version)
+
+
+class MetricsTests(TestCase):
+    def test_render_prometheus_text(self):
+        metrics = Metrics()
+        metrics.observe("fetch", 0.5)
+        metrics.observe("fetch", 0.25)
+        metrics.result("example.com")
+        metrics.result("example.com", smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no")}))
+        metrics.add("custom_total", (("name", 'a"b\\c'),))
+        text = render({series(name, labels): value for (name, labels), value in metrics.snapshot().items()})
+
+        lines = text.splitlines()
+        self.assertTrue(text.endswith("\n"))
+        self.assertIn("# TYPE mailing_phase_seconds summary", lines)
+        self.assertIn("# TYPE mailing_smtp_replies_total counter", lines)
+        # _sum и _count идут под заголовками своего семейства.
+        self.assertLess(
+            lines.index("# TYPE mailing_phase_seconds summary"),
+            lines.index('mailing_phase_seconds_sum{phase="fetch"} 0.75'),
+        )
+        self.assertIn('mailing_phase_seconds_count{phase="fetch"} 2.0', lines)
+        self.assertIn('mailing_smtp_replies_total{code="250"} 1.0', lines)
+        self.assertIn('mailing_smtp_replies_total{code="550"} 1.0', lines)
+        self.assertIn('mailing_domain_messages_total{domain="example.com",status="failed"} 1.0', lines)
+        self.assertIn('custom_total{name="a\\"b\\\\c"} 1.0', lines)
+        self.assertFalse(any(line.startswith("# HELP custom_total") for line in lines))
+
+    def test_send_records_phase_timers(self):
+        mailing = make_mailing(make_owner(), ["ok@example.com", "bad@example.com"])
+        before = registry.snapshot()
+        metrics = Metrics()
+        dispatch_mailing(mailing, connection=RefusingBackend(), metrics=metrics)
+
+        values = metrics.snapshot()
+        for phase in PHASES:
+            with self.subTest(phase=phase):
+                self.assertGreater(values["mailing_phase_seconds_count", (("phase", phase),)], 0)
+        self.assertEqual(values["mailing_smtp_replies_total", (("code", "250"),)], 1)
+        self.assertEqual(values["mailing_smtp_replies_total", (("code", "550"),)], 1)
+        # Прирост прогона перенесён в реестр процесса для /metrics.
+        key = "mailing_phase_seconds_count", (("phase", "persist"),)
+        self.assertEqual(registry.snapshot()[key] - before.get(key, 0.0), values[key])
+
+
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        self.staff = get_user_model().objects.create(email="staff@example.com", is_staff=True)
+        self.user = get_user_model().objects.create(email="user@example.com")
+
+    def get(self, user=None, **headers):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        return client.get("/metrics", headers=headers)
+
+    @override_settings(MAILING_METRICS_TOKEN="")
+    def test_staff_only_without_token(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(self.user).status_code, 403)
+        response = self.get(self.staff)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+
+    @override_settings(MAILING_METRICS_TOKEN="secret")
+    def test_bearer_token(self):
+        self.assertEqual(self.get(Authorization="Bearer secret").status_code, 200)
+        self.assertEqual(self.get(Authorization="Bearer wrong").status_code, 403)
+        self.assertEqual(self.get(Authorization="secret").status_code, 403)
+        # С заданным токеном вход персонала без него не пускает.
+        self.assertEqual(self.get(self.staff).status_code, 403)
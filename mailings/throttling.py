@@ -0,0 +1,147 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+# Как часто перепроверять домены, если все упёрлись в лимит сессий.
+POLL_INTERVAL = 0.05
+
+
+def email_domain(email):
+    return email.rsplit("@", 1)[-1].lower()
+
+
+class TokenBucket:
+    """Token bucket: ``rate`` токенов в секунду, в запасе не больше ``burst``."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, math.ceil(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, count):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= count:
+            return 0.0
+        return (count - self.tokens) / self.rate
+
+    def take(self, count):
+        self.tokens -= count
+
+
+class DomainThrottle:
+    """Лимиты отправки по доменам получателей.
+
+    Лимиты задаются в ``MAILING_DOMAIN_LIMITS``, например
+    ``{"gmail.com": {"rate": 10, "burst": 20, "concurrency": 2}}``, где
+    ``rate`` — писем в секунду, ``concurrency`` — одновременных SMTP-сессий
+    на домен. Для прочих доменов действует ``MAILING_DEFAULT_DOMAIN_LIMIT``;
+    отсутствующий ключ означает отсутствие ограничения. ``share`` задаёт
+    долю лимитов, доступную этому процессу (при отправке в несколько процессов).
+    """
+
+    def __init__(self, limits=None, default=None, share=1):
+        self.limits = settings.MAILING_DOMAIN_LIMITS if limits is None else limits
+        self.default = settings.MAILING_DEFAULT_DOMAIN_LIMIT if default is None else default
+        self.share = share
+        self.buckets = {}
+        self.active = {}
+        self.lock = threading.Lock()
+
+    def limit(self, domain):
+        return self.limits.get(domain, self.default)
+
+    def bucket(self, domain):
+        if domain not in self.buckets:
+            limit = self.limit(domain)
+            bucket = None
+            if limit.get("rate"):
+                burst = limit.get("burst")
+                bucket = TokenBucket(limit["rate"] * self.share, burst and max(1, burst * self.share))
+            self.buckets[domain] = bucket
+        return self.buckets[domain]
+
+    def concurrency(self, domain):
+        concurrency = self.limit(domain).get("concurrency")
+        return concurrency and max(1, int(concurrency * self.share))
+
+    def max_batch(self, domain, size):
+        bucket = self.bucket(domain)
+        return min(size, int(bucket.burst)) if bucket else size
+
+    def wait_time(self, domain, count):
+        """Через сколько секунд в домен можно отправить ``count`` писем.
+
+        ``math.inf`` означает, что заняты все разрешённые сессии и ждать
+        нужно завершения одной из них.
+        """
+        with self.lock:
+            concurrency = self.concurrency(domain)
+            if concurrency and self.active.get(domain, 0) >= concurrency:
+                return math.inf
+            bucket = self.bucket(domain)
+            return bucket.wait_time(count) if bucket else 0.0
+
+    def acquire(self, domain, count):
+        with self.lock:
+            bucket = self.bucket(domain)
+            if bucket:
+                bucket.take(count)
+            self.active[domain] = self.active.get(domain, 0) + 1
+
+    def release(self, domain):
+        with self.lock:
+            self.active[domain] -= 1
+
+
+class DomainQueue:
+    """Письма, разложенные по доменам получателей.
+
+    ``pop`` выдаёт пачку следующего по кругу домена, которому лимиты
+    разрешают отправку, поэтому домены чередуются и домен, упёршийся
+    в лимит, не задерживает остальные.
+    """
+
+    def __init__(self, throttle, batch_size):
+        self.throttle = throttle
+        self.batch_size = batch_size
+        self.queues = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, domain, item):
+        self.queues.setdefault(domain, deque()).append(item)
+        self.size += 1
+
+    def pop(self):
+        """Возвращает ``(domain, items, 0)`` или ``(None, [], delay)``, если все домены пока ждут."""
+        delay = math.inf
+        for _ in range(len(self.queues)):
+            domain, queue = next(iter(self.queues.items()))
+            self.queues.move_to_end(domain)
+            count = min(len(queue), self.throttle.max_batch(domain, self.batch_size))
+            wait = self.throttle.wait_time(domain, count)
+            if wait == 0:
+                items = [queue.popleft() for _ in range(count)]
+                if not queue:
+                    del self.queues[domain]
+                self.size -= count
+                self.throttle.acquire(domain, count)
+                return domain, items, 0.0
+            delay = min(delay, wait)
+        return None, [], delay
+
+    def pop_wait(self):
+        """Блокирующий ``pop``: ждёт, пока какой-нибудь домен не станет доступен."""
+        while True:
+            domain, items, delay = self.pop()
+            if items:
+                return domain, items
+            time.sleep(min(delay, POLL_INTERVAL))
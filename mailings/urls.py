@@ -1,13 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RecipientViewSet, MessageViewSet, MailingViewSet, MailAttemptViewSet
+from .views import (
+    RecipientViewSet, RecipientSegmentViewSet, MessageViewSet, MailingViewSet, MailAttemptViewSet, SendJobViewSet,
+    mailing_send_async,
+)
 
 router = DefaultRouter()
 router.register(r"recipients", RecipientViewSet, basename="recipient")
+router.register(r"segments", RecipientSegmentViewSet, basename="segment")
 router.register(r"messages", MessageViewSet, basename="message")
 router.register(r"mailings", MailingViewSet, basename="mailing")
 router.register(r"attempts", MailAttemptViewSet, basename="attempt")
+router.register(r"jobs", SendJobViewSet, basename="job")
 
 urlpatterns = [
+    path("api/mailings/<int:pk>/send-async/", mailing_send_async, name="mailing-send-async"),
     path("api/", include(router.urls)),
 ]
@@ -1,124 +1,290 @@
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.response import Response
-from django.core.mail import send_mail
-from django.utils import timezone
-from django.conf import settings
-
-from .models import Recipient, Message, Mailing, MailAttempt
-from .serializers import RecipientSerializer, MessageSerializer, MailingSerializer, MailAttemptSerializer
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .models import Recipient, RecipientSegment, Message, Mailing, MailAttempt, SendJob
+from .serializers import (
+    RecipientSerializer, RecipientSegmentSerializer, MessageSerializer, MailingSerializer, MailingStatsSerializer,
+    DailyStatsSerializer, MailAttemptSerializer, SendJobSerializer
+)
+from .access import has_perms, sees_all_objects
+from .async_services import adispatch_mailing
+from .caching import list_cache_key
+from .exports import ExportError, filter_attempts, streaming_export
+from .imports import RecipientImportError, import_format, import_recipients
+from .metrics import collect as collect_metrics, render as render_metrics
+from .pagination import AttemptKeysetPagination, InvalidCursor, Keyset, KeysetPagination
+from .services import ARCHIVED_ERROR, MailingArchivedError, enqueue_mailing
+from .stats import daily_stats, get_stats
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import PermissionRequiredMixin as DjangoPermissionRequiredMixin
+from django.db.models import Prefetch, ProtectedError
 from django.urls import reverse_lazy, reverse
-from django.http import HttpResponseRedirect
-from .forms import RecipientForm, MessageForm, MailingForm
-from django.views.decorators.cache import cache_page
-from django.utils.decorators import method_decorator
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .forms import RecipientForm, RecipientSegmentForm, MessageForm, MailingForm
+
+class OwnedViewSetMixin:
+    """Персонал работает с объектами всех пользователей, остальные — лишь
+    со своими. Списки отдаются keyset-пагинацией."""
+    pagination_class = KeysetPagination
 
-class RecipientViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return self.queryset.all()
+        return self.queryset.filter(owner=self.request.user)
+
+class RecipientViewSet(OwnedViewSetMixin, viewsets.ModelViewSet):
     serializer_class = RecipientSerializer
     queryset = Recipient.objects.all()
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        if self.request.user.is_staff:
-            return Recipient.objects.all()
-        return Recipient.objects.filter(owner=self.request.user)
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+    @action(detail=False, methods=["post"], url_path="import", parser_classes=[MultiPartParser])
+    def import_recipients(self, request):
+        """Массовая загрузка получателей из CSV или NDJSON (поле ``file``).
+
+        Колонки: ``email``, ``full_name``, ``comment``. Необязательное поле
+        ``mailing`` добавляет всех загруженных получателей в рассылку.
+        """
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": "Файл не передан."})
+
+        mailing = None
+        if request.data.get("mailing"):
+            try:
+                mailing_id = int(request.data["mailing"])
+            except ValueError:
+                raise ValidationError({"mailing": "Номер рассылки должен быть целым числом."}) from None
+            mailings = Mailing.objects.all() if request.user.is_staff else Mailing.objects.filter(owner=request.user)
+            mailing = mailings.filter(pk=mailing_id).first()
+            if mailing is None:
+                raise ValidationError({"mailing": "Рассылка не найдена."})
+
+        input_format = request.data.get("input") or import_format(upload.name)
+        try:
+            importer = import_recipients(upload, request.user, input_format, mailing)
+        except RecipientImportError as e:
+            raise ValidationError({"detail": str(e)})
+        return Response(importer.report())
+
+class RecipientSegmentViewSet(OwnedViewSetMixin, viewsets.ModelViewSet):
+    serializer_class = RecipientSegmentSerializer
+    queryset = RecipientSegment.objects.all()
+    permission_classes = [permissions.IsAuthenticated]
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
-class MessageViewSet(viewsets.ModelViewSet):
+    def perform_destroy(self, instance):
+        try:
+            instance.delete()
+        except ProtectedError:
+            raise ValidationError({"detail": "Сегмент используется в рассылках."})
+
+    @action(detail=True, methods=["get"])
+    def recipients(self, request, pk=None):
+        """Получатели, которые сейчас попадают в сегмент."""
+        segment = self.get_object()
+        page = self.paginate_queryset(segment.recipients())
+        return self.get_paginated_response(RecipientSerializer(page, many=True).data)
+
+class MessageViewSet(OwnedViewSetMixin, viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     queryset = Message.objects.all()
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        if self.request.user.is_staff:
-            return Message.objects.all()
-        return Message.objects.filter(owner=self.request.user)
-
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
-class MailingViewSet(viewsets.ModelViewSet):
+class MailingViewSet(OwnedViewSetMixin, viewsets.ModelViewSet):
     serializer_class = MailingSerializer
-    queryset = Mailing.objects.all()
+    queryset = Mailing.objects.prefetch_related(Prefetch("recipients", queryset=Recipient.objects.only("id")))
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
-        if self.request.user.is_staff:
-            return Mailing.objects.all()
-        return Mailing.objects.filter(owner=self.request.user)
-
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
     @action(detail=True, methods=["post"])
     def send(self, request, pk=None):
         mailing = self.get_object()
-        recipients = mailing.recipients.all()
-        message = mailing.message
-
-        for recipient in recipients:
-            try:
-                send_mail(
-                    subject=message.subject,
-                    message=message.body,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[recipient.email],
-                    fail_silently=False,
-                )
-                MailAttempt.objects.create(
-                    mailing=mailing,
-                    recipient=recipient,
-                    status="SUCCESS",
-                    response="OK",
-                    owner=request.user,
-                )
-            except Exception as e:
-                MailAttempt.objects.create(
-                    mailing=mailing,
-                    recipient=recipient,
-                    status="FAILED",
-                    response=str(e),
-                    owner=request.user,
-                )
-
-        if mailing.status == "CREATED":
-            mailing.status = "RUNNING"
-        if mailing.end_at and mailing.end_at < timezone.now():
-            mailing.status = "FINISHED"
-        mailing.save()
-
-        return Response({"status": "Рассылка выполнена"}, status=status.HTTP_200_OK)
-
-class MailAttemptViewSet(viewsets.ReadOnlyModelViewSet):
+        try:
+            job = enqueue_mailing(mailing, owner=request.user)
+        except MailingArchivedError as e:
+            raise ValidationError({"detail": str(e)})
+        return Response(
+            {"status": "Рассылка поставлена в очередь", "job_id": job.id},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=True, methods=["get"])
+    def stats(self, request, pk=None):
+        return Response(MailingStatsSerializer(get_stats(self.get_object())).data)
+
+    @action(detail=True, methods=["get"])
+    def daily(self, request, pk=None):
+        """Попытки по дням, включая заархивированные."""
+        return Response(DailyStatsSerializer(daily_stats(self.get_object()), many=True).data)
+
+    @action(detail=True, methods=["get"])
+    def report(self, request, pk=None):
+        """Потоковая выгрузка попыток рассылки: ``?output=csv|ndjson``.
+
+        Заархивированных попыток здесь нет — они в итогах ``daily`` и в
+        выгрузках ``archive_attempts --dump-dir``.
+        """
+        mailing = self.get_object()
+        return export_attempts(request, mailing.attempts.all(), f"mailing-{mailing.pk}")
+
+def export_attempts(request, queryset, filename):
+    params = request.query_params
+    try:
+        queryset = filter_attempts(
+            queryset,
+            mailing=params.get("mailing"),
+            since=params.get("since"),
+            until=params.get("until"),
+            status=params.get("status"),
+        )
+        return streaming_export(queryset, params.get("output", "csv"), filename)
+    except ExportError as e:
+        raise ValidationError({"detail": str(e)})
+
+@csrf_exempt
+@require_POST
+async def mailing_send_async(request, pk):
+    """Async-вариант ``MailingViewSet.send``: отправляет рассылку прямо в запросе.
+
+    DRF не поддерживает async-представления, поэтому JWT проверяется вручную.
+    Под ASGI (core/asgi.py) отправка не занимает воркер на всё время рассылки.
+    """
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"detail": str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if auth is None:
+        return JsonResponse({"detail": "Учетные данные не были предоставлены."}, status=status.HTTP_401_UNAUTHORIZED)
+    user = auth[0]
+
+    mailings = Mailing.objects.all() if user.is_staff else Mailing.objects.filter(owner=user)
+    try:
+        mailing = await mailings.aget(pk=pk)
+    except Mailing.DoesNotExist:
+        return JsonResponse({"detail": "Не найдено."}, status=status.HTTP_404_NOT_FOUND)
+    if mailing.archived_at is not None:
+        return JsonResponse({"detail": ARCHIVED_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+
+    dispatcher = await adispatch_mailing(mailing, owner=user)
+    return JsonResponse(
+        {"status": "Рассылка выполнена", "success": dispatcher.success, "failed": dispatcher.failed},
+        status=status.HTTP_200_OK,
+    )
+
+def metrics_view(request):
+    """Метрики отправки в текстовом формате Prometheus.
+
+    Доступны по ``Authorization: Bearer <MAILING_METRICS_TOKEN>``, а если
+    токен не задан — только персоналу.
+    """
+    token = settings.MAILING_METRICS_TOKEN
+    if token:
+        allowed = constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+    else:
+        allowed = request.user.is_authenticated and request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(collect_metrics()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+class MailAttemptViewSet(OwnedViewSetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = MailAttemptSerializer
-    queryset = MailAttempt.objects.all()
+    queryset = MailAttempt.objects.select_related("failure")
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = AttemptKeysetPagination
 
-    def get_queryset(self):
-        if self.request.user.is_staff:
-            return MailAttempt.objects.all()
-        return MailAttempt.objects.filter(owner=self.request.user)
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """Потоковая выгрузка попыток.
+
+        Фильтры: ``mailing``, ``since``, ``until``, ``status``; формат —
+        ``output=csv`` (по умолчанию) или ``output=ndjson``.
+        """
+        return export_attempts(request, self.get_queryset(), "attempts")
+
+class SendJobViewSet(OwnedViewSetMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = SendJobSerializer
+    queryset = SendJob.objects.all()
+    permission_classes = [permissions.IsAuthenticated]
 
 # Web views
 
+class PermissionRequiredMixin(DjangoPermissionRequiredMixin):
+    """Проверяет права по закэшированному снимку вместо запросов к БД."""
+    def has_permission(self):
+        return has_perms(self.request.user, self.get_permission_required())
+
 class BaseOwnedMixin(LoginRequiredMixin):
     def get_queryset(self):
-        if self.request.user.groups.filter(name='Менеджеры').exists() or self.request.user.is_staff:
-            return self.model.objects.all()
-        return self.model.objects.filter(owner=self.request.user)
+        queryset = super().get_queryset()
+        if sees_all_objects(self.request.user):
+            return queryset
+        return queryset.filter(owner=self.request.user)
+
+class OwnerCacheMixin:
+    """Кэширует отрендеренную страницу списка для каждого пользователя.
+
+    В ключ входят версии ``cache_models`` владельца (или всех владельцев,
+    если пользователь видит всё), поэтому изменение данных сразу даёт
+    новый ключ, а старые страницы просто истекают.
+    """
+    cache_models = ()
+
+    def get(self, request, *args, **kwargs):
+        owner_id = None if sees_all_objects(request.user) else request.user.pk
+        key = list_cache_key(type(self).__name__, request, self.cache_models, owner_id)
+        content = cache.get(key)
+        if content is not None:
+            return HttpResponse(content)
+        response = super().get(request, *args, **kwargs)
+        response.add_post_render_callback(
+            lambda response: cache.set(key, response.content, settings.MAILING_LIST_CACHE_TIMEOUT)
+        )
+        return response
+
+class KeysetPaginationMixin:
+    """Постраничный вывод ListView по курсору ``?cursor=`` без OFFSET."""
+    keyset_ordering = ("-created_at", "-id")
+    page_size = 50
+
+    def get_context_data(self, **kwargs):
+        try:
+            rows, next_cursor, previous_cursor = Keyset(self.keyset_ordering).page(
+                self.object_list, self.request.GET.get('cursor'), self.page_size
+            )
+        except InvalidCursor:
+            raise Http404('Неверный курсор')
+        context = super().get_context_data(object_list=rows, **kwargs)
+        context['next_cursor'] = next_cursor
+        context['previous_cursor'] = previous_cursor
+        return context
 
 # Messages
-class MessageListView(BaseOwnedMixin, ListView):
+class MessageListView(OwnerCacheMixin, KeysetPaginationMixin, BaseOwnedMixin, ListView):
     model = Message
+    queryset = Message.objects.only('id', 'subject', 'created_at')
     template_name = 'mailings/message_list.html'
-
-    @method_decorator(cache_page(60 * 15))
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+    cache_models = (Message,)
 
 class MessageDetailView(PermissionRequiredMixin, BaseOwnedMixin, DetailView):
     model = Message
@@ -150,13 +316,11 @@ class MessageDeleteView(PermissionRequiredMixin, BaseOwnedMixin, DeleteView):
     permission_required = 'mailings.can_delete_message'
 
 # Recipients
-class RecipientListView(BaseOwnedMixin, ListView):
+class RecipientListView(OwnerCacheMixin, KeysetPaginationMixin, BaseOwnedMixin, ListView):
     model = Recipient
+    queryset = Recipient.objects.only('id', 'email', 'full_name', 'created_at')
     template_name = 'mailings/recipient_list.html'
-
-    @method_decorator(cache_page(60 * 15))
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+    cache_models = (Recipient,)
 
 class RecipientDetailView(PermissionRequiredMixin, BaseOwnedMixin, DetailView):
     model = Recipient
@@ -187,59 +351,78 @@ class RecipientDeleteView(PermissionRequiredMixin, BaseOwnedMixin, DeleteView):
     success_url = reverse_lazy('recipients_list')
     permission_required = 'mailings.can_delete_recipient'
 
+# Segments
+class RecipientSegmentListView(KeysetPaginationMixin, PermissionRequiredMixin, BaseOwnedMixin, ListView):
+    model = RecipientSegment
+    template_name = 'mailings/segment_list.html'
+    permission_required = 'mailings.can_view_recipientsegment'
+
+class RecipientSegmentCreateView(PermissionRequiredMixin, LoginRequiredMixin, CreateView):
+    model = RecipientSegment
+    form_class = RecipientSegmentForm
+    template_name = 'mailings/segment_form.html'
+    success_url = reverse_lazy('segments_list')
+    permission_required = 'mailings.can_add_recipientsegment'
+
+    def form_valid(self, form):
+        form.instance.owner = self.request.user
+        return super().form_valid(form)
+
+class RecipientSegmentUpdateView(PermissionRequiredMixin, BaseOwnedMixin, UpdateView):
+    model = RecipientSegment
+    form_class = RecipientSegmentForm
+    template_name = 'mailings/segment_form.html'
+    success_url = reverse_lazy('segments_list')
+    permission_required = 'mailings.can_change_recipientsegment'
+
+class RecipientSegmentDeleteView(PermissionRequiredMixin, BaseOwnedMixin, DeleteView):
+    model = RecipientSegment
+    template_name = 'mailings/confirm_delete.html'
+    success_url = reverse_lazy('segments_list')
+    permission_required = 'mailings.can_delete_recipientsegment'
+
+    def form_valid(self, form):
+        try:
+            return super().form_valid(form)
+        except ProtectedError:
+            return self.render_to_response(
+                self.get_context_data(error='Сегмент используется в рассылках и не может быть удалён.')
+            )
+
 # Mailings
-class MailingListView(BaseOwnedMixin, ListView):
+class MailingListView(OwnerCacheMixin, KeysetPaginationMixin, BaseOwnedMixin, ListView):
     model = Mailing
     template_name = 'mailings/mailing_list.html'
-
-    @method_decorator(cache_page(60 * 15))
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+    cache_models = (Mailing,)
 
 class MailingDetailView(PermissionRequiredMixin, BaseOwnedMixin, DetailView):
     model = Mailing
+    queryset = Mailing.objects.select_related('message', 'segment', 'stats')
     template_name = 'mailings/mailing_detail.html'
     permission_required = 'mailings.can_view_mailing'
+    attempts_shown = 50
+    recipients_shown = 20
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['attempts'] = self.object.attempts.all()
+        context['stats'] = get_stats(self.object)
+        context['attempts'] = (
+            self.object.attempts.select_related('recipient', 'failure')
+            .only('id', 'mailing_id', 'status', 'attempted_at', 'failure__text', 'recipient__email')
+            .order_by('-attempted_at', '-id')[:self.attempts_shown]
+        )
+        if not self.object.segment_id:
+            context['recipients'] = self.object.recipients.only('email')[:self.recipients_shown]
+            context['recipients_count'] = self.object.recipients.count()
+        context['jobs'] = self.object.jobs.order_by('-created_at')[:5]
         return context
 
     def post(self, request, *args, **kwargs):
-        if not request.user.has_perm('mailings.can_send_mailing'):
-            return HttpResponseRedirect(reverse('mailing_detail', args=(self.object.pk,)))
         mailing = self.get_object()
-        recipients = mailing.recipients.all()
-        message = mailing.message
-        for recipient in recipients:
-            try:
-                send_mail(
-                    message.subject,
-                    message.body,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [recipient.email],
-                )
-                MailAttempt.objects.create(
-                    mailing=mailing,
-                    recipient=recipient,
-                    status="SUCCESS",
-                    response="OK",
-                    owner=request.user,
-                )
-            except Exception as e:
-                MailAttempt.objects.create(
-                    mailing=mailing,
-                    recipient=recipient,
-                    status="FAILED",
-                    response=str(e),
-                    owner=request.user,
-                )
-        if mailing.end_at < timezone.now():
-            mailing.status = "FINISHED"
-        else:
-            mailing.status = "RUNNING"
-        mailing.save()
+        if not has_perms(request.user, ['mailings.can_send_mailing']):
+            return HttpResponseRedirect(reverse('mailing_detail', args=(mailing.pk,)))
+        if mailing.archived_at is None:
+            enqueue_mailing(mailing, owner=request.user)
         return HttpResponseRedirect(reverse('mailing_detail', args=(mailing.pk,)))
 
 class MailingCreateView(PermissionRequiredMixin, LoginRequiredMixin, CreateView):
@@ -252,6 +435,7 @@ class MailingCreateView(PermissionRequiredMixin, LoginRequiredMixin, CreateView)
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
         form.fields['message'].queryset = Message.objects.filter(owner=self.request.user)
+        form.fields['segment'].queryset = RecipientSegment.objects.filter(owner=self.request.user)
         form.fields['recipients'].queryset = Recipient.objects.filter(owner=self.request.user)
         return form
 
@@ -269,6 +453,7 @@ class MailingUpdateView(PermissionRequiredMixin, BaseOwnedMixin, UpdateView):
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
         form.fields['message'].queryset = Message.objects.filter(owner=self.request.user)
+        form.fields['segment'].queryset = RecipientSegment.objects.filter(owner=self.request.user)
         form.fields['recipients'].queryset = Recipient.objects.filter(owner=self.request.user)
         return form
 
@@ -279,15 +464,16 @@ class MailingDeleteView(PermissionRequiredMixin, BaseOwnedMixin, DeleteView):
     permission_required = 'mailings.can_delete_mailing'
 
 # Attempts
-class MailAttemptListView(LoginRequiredMixin, ListView):
+class MailAttemptListView(OwnerCacheMixin, KeysetPaginationMixin, LoginRequiredMixin, ListView):
     model = MailAttempt
     template_name = 'mailings/attempt_list.html'
-
-    @method_decorator(cache_page(60 * 15))
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
+    keyset_ordering = ("-attempted_at", "-id")
+    cache_models = (MailAttempt,)
 
     def get_queryset(self):
-        if self.request.user.groups.filter(name='Менеджеры').exists() or self.request.user.is_staff:
-            return MailAttempt.objects.all()
-        return MailAttempt.objects.filter(owner=self.request.user)
\ No newline at end of file
+        attempts = MailAttempt.objects.select_related('recipient', 'failure').only(
+            'id', 'mailing_id', 'status', 'attempted_at', 'failure__text', 'recipient__email'
+        )
+        if sees_all_objects(self.request.user):
+            return attempts
+        return attempts.filter(owner=self.request.user)
\ No newline at end of file